@@ -0,0 +1,121 @@
+#! /usr/bin/env python2
+#
+#   bench-objects.py    WJ135
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''measure memory use of the objects that synctool-client makes
+for every entry in the overlay tree: a SyncObject with two SyncStats,
+and a VNode while checking
+
+Run it with the synctool lib dir in the PYTHONPATH:
+    PYTHONPATH=src python2 contrib/bench-objects.py [number of entries]
+'''
+
+import os
+import sys
+import gc
+import time
+
+try:
+    from typing import List
+except ImportError:
+    pass
+
+import synctool.object
+import synctool.syncstat
+
+# default number of entries
+NUM_ENTRIES = 500000
+
+
+def rss():
+    # type: () -> int
+    '''Returns resident set size in bytes'''
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def sizeof(obj):
+    # type: (object) -> int
+    '''Returns size of the object itself, including its __dict__'''
+
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def make_entries(num):
+    # type: (int) -> List[synctool.object.SyncObject]
+    '''Returns list of SyncObjects, like the overlay walk makes'''
+
+    # stat this file, so that the stat structures are filled in
+    path = os.path.abspath(__file__)
+
+    arr = []
+    for i in xrange(num):
+        name = 'file%07d' % i
+        obj = synctool.object.SyncObject(name + '._all', name)
+        obj.src_path = os.path.join('/opt/synctool/var/overlay/all',
+                                    obj.src_path)
+        obj.dest_path = os.path.join('/etc', obj.dest_path)
+        obj.src_stat = synctool.syncstat.SyncStat(path)
+        obj.dest_stat = synctool.syncstat.SyncStat(path)
+        arr.append(obj)
+
+    return arr
+
+
+def main():
+    # type: () -> None
+    '''run the benchmark'''
+
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+    else:
+        num = NUM_ENTRIES
+
+    gc.collect()
+    rss0 = rss()
+    objects0 = len(gc.get_objects())
+    t0 = time.time()
+
+    arr = make_entries(num)
+
+    t1 = time.time()
+    gc.collect()
+    rss1 = rss()
+    objects1 = len(gc.get_objects())
+
+    # a VNode is made for every check, and thrown away afterwards
+    vnodes = [obj.vnode_obj() for obj in arr[:1000]]
+    t2 = time.time()
+    for obj in arr:
+        obj.vnode_obj()
+    t3 = time.time()
+
+    obj = arr[0]
+    print 'entries                    %10d' % num
+    print 'build time                 %10.3fs' % (t1 - t0)
+    print 'RSS growth                 %10.1f MiB' % ((rss1 - rss0) /
+                                                     1048576.0)
+    print 'RSS per entry              %10d bytes' % ((rss1 - rss0) / num)
+    print 'gc tracked objects/entry   %10.2f' % (float(objects1 - objects0) /
+                                                num)
+    print 'size of SyncObject         %10d bytes' % sizeof(obj)
+    print 'size of SyncStat           %10d bytes' % sizeof(obj.src_stat)
+    print 'size of VNode              %10d bytes' % sizeof(vnodes[0])
+    print 'VNodes made per second     %10d' % (num / (t3 - t2))
+
+
+if __name__ == '__main__':
+    main()
+
+# EOB
@@ -0,0 +1,150 @@
+#! /usr/bin/env python2
+#
+#   bench-stat.py    WJ136
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''count the system calls that walking the overlay tree takes
+
+It makes a repository in a temp dir, and walks it like synctool-client
+does, for destination trees that are missing, half present, and
+complete. It counts the calls to lstat() and listdir(), with and
+without listing destination directories (see synctool.syncstat)
+
+Run it with the synctool lib dir in the PYTHONPATH:
+    PYTHONPATH=src python2 contrib/bench-stat.py [dirs] [files per dir]
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+try:
+    from typing import Dict, Tuple
+except ImportError:
+    pass
+
+import synctool.lib
+import synctool.overlay
+import synctool.param
+import synctool.syncstat
+
+# default size of the repository
+NUM_DIRS = 100
+NUM_FILES = 100
+
+# COUNTS[name of system call] -> number of calls
+COUNTS = {}     # type: Dict[str, int]
+
+
+def counted(name, func):
+    '''Returns wrapper for func that counts the calls'''
+
+    def wrapper(*args, **kwargs):
+        '''count the call'''
+
+        COUNTS[name] = COUNTS.get(name, 0) + 1
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def make_tree(top, num_dirs, num_files, keep):
+    # type: (str, int, int, int) -> None
+    '''make a tree of files; every keep-th file is made
+    If keep is 0, nothing is made
+    '''
+
+    if keep == 0:
+        return
+
+    for d in xrange(num_dirs):
+        path = os.path.join(top, 'dir%04d' % d)
+        os.makedirs(path)
+        for f in xrange(num_files):
+            if f % keep == 0:
+                with open(os.path.join(path, 'file%04d' % f), 'w') as fd:
+                    fd.write('synctool\n')
+
+
+def _callback(obj, _pre_dict, _post_dict):
+    '''do nothing; the walk itself does the stat() calls'''
+
+    return True, False
+
+
+def walk(overlay):
+    # type: (str) -> Tuple[Dict[str, int], float]
+    '''walk the overlay tree
+    Returns tuple: counts of system calls, time taken
+    '''
+
+    COUNTS.clear()
+    t0 = time.time()
+    synctool.overlay.visit(overlay, _callback)
+    return dict(COUNTS), time.time() - t0
+
+
+def main():
+    # type: () -> None
+    '''run the benchmark'''
+
+    num_dirs = NUM_DIRS
+    num_files = NUM_FILES
+    if len(sys.argv) > 1:
+        num_dirs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_files = int(sys.argv[2])
+
+    tmpdir = os.path.realpath(tempfile.mkdtemp(prefix='synctool-bench-'))
+    dest = os.path.join(tmpdir, 'dest')
+    overlay = os.path.join(tmpdir, 'overlay')
+    # the overlay tree mirrors the full path of the destination
+    repo = os.path.join(overlay, 'all') + dest
+    make_tree(repo, num_dirs, num_files, 1)
+
+    synctool.lib.DRY_RUN = True
+    synctool.lib.QUIET = True
+    synctool.param.MY_GROUPS = ['all']
+    synctool.param.ALL_GROUPS = ['all']
+    synctool.param.REQUIRE_EXTENSION = False
+
+    os.lstat = counted('lstat', os.lstat)
+    os.listdir = counted('listdir', os.listdir)
+
+    direct = synctool.syncstat.DirListing.stat
+    print '%d entries' % (num_dirs * num_files)
+    print '%-14s %-16s %10s %10s %10s' % ('destination', 'method', 'lstat',
+                                          'listdir', 'time')
+    try:
+        for descr, keep in (('missing', 0), ('half present', 2),
+                            ('complete', 1)):
+            shutil.rmtree(dest, ignore_errors=True)
+            make_tree(dest, num_dirs, num_files, keep)
+
+            for method in ('stat per entry', 'listing'):
+                if method == 'stat per entry':
+                    synctool.syncstat.DirListing.stat = (
+                        lambda self, path: synctool.syncstat.SyncStat(path))
+                else:
+                    synctool.syncstat.DirListing.stat = direct
+
+                counts, secs = walk(overlay)
+                print '%-14s %-16s %10d %10d %9.3fs' % (
+                    descr, method, counts.get('lstat', 0),
+                    counts.get('listdir', 0), secs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
+
+# EOB
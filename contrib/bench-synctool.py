@@ -0,0 +1,571 @@
+#! /usr/bin/env python2
+#
+#   bench-synctool.py    WJ137
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''benchmark the hot paths of synctool
+
+It makes a synthetic synctool root in a temp dir: a config file with
+nodes and groups, and an overlay, delete and purge tree that target a
+temp destination dir. It then times what synctool-client does with it;
+walking the overlay tree and checking and fixing the entries, deleting
+and purging; and some master side code: node ranges, reading the config
+file and aggregating output.
+
+Nothing is run over ssh. The results can be saved as JSON, and compared
+to the results of another version of synctool, so that regressions are
+easily spotted:
+
+    PYTHONPATH=src python2 contrib/bench-synctool.py -o old.json
+    (switch to another version)
+    PYTHONPATH=src python2 contrib/bench-synctool.py -c old.json
+
+The repository trees mirror the full path of the destination dir, so
+they hold dirs like tmp/ that stand for real system dirs. These are
+given the same mode and owner as the real ones, so that fixing leaves
+the real ones alone. Still, do not run this as root on a shared host.
+'''
+
+import os
+import sys
+import stat
+import copy
+import time
+import json
+import errno
+import getopt
+import shutil
+import tempfile
+import platform
+import cStringIO
+
+try:
+    from typing import List, Dict, Tuple, Callable, Any
+except ImportError:
+    pass
+
+import synctool.aggr
+import synctool.config
+import synctool.configparser
+import synctool.lib
+import synctool.main.client
+import synctool.overlay
+import synctool.param
+import synctool.range
+
+# PARAMS holds the size of the synthetic repository
+PARAMS = {
+    'groups': 10,       # number of groups
+    'nodes': 1000,      # number of nodes
+    'dirs': 20,         # number of directories
+    'depth': 2,         # depth of each directory
+    'files': 50,        # files per directory
+    'size': 4096,       # size of each file in bytes
+    'templates': 2,     # percentage of files that is a template
+    'posts': 10,        # percentage of files that has a .post script
+    'delete': 5,        # files per directory in the delete tree
+    'purge': 2,         # number of purge directories
+    'repeat': 3,        # number of runs for each benchmark
+}   # type: Dict[str, int]
+
+# the node that the client side benchmarks run as
+NODENAME = 'n0001'
+
+
+class Repository(object):
+    '''synthetic synctool root dir and destination dir'''
+
+    def __init__(self, tmpdir):
+        # type: (str) -> None
+        '''initialize instance'''
+
+        self.rootdir = os.path.join(tmpdir, 'root')
+        self.dest = os.path.join(tmpdir, 'dest')
+        self.conf_file = os.path.join(self.rootdir, 'etc', 'synctool.conf')
+        # relative paths of the destination dirs
+        self.dirs = []              # type: List[str]
+        # paths of the generated template output in the overlay tree
+        self.generated = []         # type: List[str]
+
+    def make(self):
+        # type: () -> None
+        '''make the repository'''
+
+        for subdir in ('bin', 'etc', 'var/overlay/all', 'var/delete/all',
+                       'var/purge/all'):
+            os.makedirs(os.path.join(self.rootdir, subdir))
+
+        self._make_config()
+
+        for d in xrange(PARAMS['dirs']):
+            path = ['dir%04d' % d]
+            for level in xrange(1, PARAMS['depth']):
+                path.append('sub%d' % level)
+            self.dirs.append(os.path.join(*path))
+
+        for path in self.dirs:
+            self._make_overlay_dir(path)
+            self._make_delete_dir(path)
+
+        for p in xrange(PARAMS['purge']):
+            self._make_purge_dir('purge%03d' % p)
+
+        for tree in ('overlay', 'delete', 'purge'):
+            self._mirror_ancestors(tree)
+
+    def _make_config(self):
+        # type: () -> None
+        '''write synctool.conf'''
+
+        groups = ['g%03d' % g for g in xrange(PARAMS['groups'])]
+        with open(self.conf_file, 'w') as f:
+            f.write('master %s\n' % NODENAME)
+            for n in xrange(PARAMS['nodes']):
+                node = 'n%04d' % (n + 1)
+                if node == NODENAME:
+                    # this node is in all groups, so that
+                    # all files in the overlay tree apply
+                    node_groups = groups
+                else:
+                    node_groups = [groups[n % len(groups)]]
+                f.write('node %s %s ipaddress:10.%d.%d.%d\n' %
+                        (node, ' '.join(node_groups), (n >> 16) & 0xff,
+                         (n >> 8) & 0xff, n & 0xff))
+
+    def _repo_dir(self, tree, path):
+        # type: (str, str) -> str
+        '''Returns dir in the repository tree for destination path
+        The trees mirror the full path of the destination
+        '''
+
+        return os.path.join(self.rootdir, 'var', tree, 'all') + \
+            os.path.join(self.dest, path)
+
+    def _mirror_ancestors(self, tree):
+        # type: (str) -> None
+        '''give the dirs in the repository tree that stand for the
+        ancestors of the destination dir (like /tmp) the same mode
+        and owner as the real ones
+        Otherwise, synctool would "fix" the real ones
+        '''
+
+        top = os.path.join(self.rootdir, 'var', tree, 'all')
+        # the destination dir itself is made by this program
+        path = os.path.dirname(self.dest)
+        while path != os.sep:
+            mirror = top + path
+            if os.path.isdir(mirror):
+                statbuf = os.lstat(path)
+                os.chmod(mirror, stat.S_IMODE(statbuf.st_mode))
+                if os.geteuid() == 0:
+                    os.lchown(mirror, statbuf.st_uid, statbuf.st_gid)
+
+            path = os.path.dirname(path)
+
+    def _make_overlay_dir(self, path):
+        # type: (str) -> None
+        '''make directory with files in the overlay tree'''
+
+        src_dir = self._repo_dir('overlay', path)
+        os.makedirs(src_dir)
+
+        data = 'x' * PARAMS['size']
+        for i in xrange(PARAMS['files']):
+            name = os.path.join(src_dir, 'file%04d' % i)
+            group = 'g%03d' % (i % PARAMS['groups'])
+
+            if i % 100 < PARAMS['templates']:
+                _write_file(name + '._template', data)
+                _write_script(name + '._template.post', 'cp "$1" "$2"')
+                self.generated.append(name + '._' + NODENAME)
+                continue
+
+            _write_file(name + '._' + group, data)
+
+            if i % 100 < PARAMS['posts']:
+                _write_script(name + '.post', ':')
+
+    def _make_delete_dir(self, path):
+        # type: (str) -> None
+        '''make directory with files in the delete tree'''
+
+        if PARAMS['delete'] <= 0:
+            return
+
+        src_dir = self._repo_dir('delete', path)
+        os.makedirs(src_dir)
+        for i in xrange(PARAMS['delete']):
+            _write_file(os.path.join(src_dir, 'old%04d._all' % i), '')
+
+    def _make_purge_dir(self, path):
+        # type: (str) -> None
+        '''make directory with files in the purge tree'''
+
+        src_dir = self._repo_dir('purge', path)
+        os.makedirs(src_dir)
+        data = 'x' * PARAMS['size']
+        for i in xrange(PARAMS['files']):
+            _write_file(os.path.join(src_dir, 'file%04d' % i), data)
+
+    def clear_dest(self):
+        # type: () -> None
+        '''remove the destination dir and the generated templates'''
+
+        shutil.rmtree(self.dest, ignore_errors=True)
+        os.mkdir(self.dest)
+
+        for path in self.generated:
+            try:
+                os.unlink(path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def add_old_files(self):
+        # type: () -> None
+        '''put the files that are in the delete tree in the destination'''
+
+        for path in self.dirs:
+            dest_dir = os.path.join(self.dest, path)
+            for i in xrange(PARAMS['delete']):
+                _write_file(os.path.join(dest_dir, 'old%04d' % i), '')
+
+    def change_dest(self):
+        # type: () -> None
+        '''change the contents of every tenth destination file'''
+
+        data = 'y' * PARAMS['size']
+        for path in self.dirs:
+            dest_dir = os.path.join(self.dest, path)
+            for i in xrange(0, PARAMS['files'], 10):
+                name = os.path.join(dest_dir, 'file%04d' % i)
+                if os.path.exists(name):
+                    _write_file(name, data)
+
+
+def _write_file(path, data):
+    # type: (str, str) -> None
+    '''write a file'''
+
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _write_script(path, command):
+    # type: (str, str) -> None
+    '''write a shell script'''
+
+    _write_file(path, '#! /bin/sh\n%s\n' % command)
+    os.chmod(path, 0755)
+
+
+def init_synctool(repo):
+    # type: (Repository) -> Dict[str, Any]
+    '''initialize synctool for the repository
+    Returns the config state before reading the config file
+    '''
+
+    sys.argv[0] = os.path.join(repo.rootdir, 'bin', 'synctool-client')
+    synctool.param.init()
+    pristine = _config_state()
+
+    synctool.param.CONF_FILE = repo.conf_file
+    synctool.config.read_config()
+    synctool.param.NODENAME = NODENAME
+    synctool.param.MY_GROUPS = synctool.config.get_my_groups()
+    synctool.lib.QUIET = True
+    return pristine
+
+
+def _config_state():
+    # type: () -> Dict[str, Any]
+    '''Returns copy of the settings that reading the config adds to'''
+
+    state = {}
+    for name in dir(synctool.param):
+        value = getattr(synctool.param, name)
+        if name.isupper() and isinstance(value, (dict, list, set)):
+            state[name] = copy.deepcopy(value)
+
+    state['SYMBOLS'] = copy.deepcopy(synctool.configparser.SYMBOLS)
+    return state
+
+
+def _restore_config(state):
+    # type: (Dict[str, Any]) -> None
+    '''restore settings saved by _config_state()'''
+
+    for name, value in state.items():
+        if name == 'SYMBOLS':
+            synctool.configparser.SYMBOLS = copy.deepcopy(value)
+        else:
+            setattr(synctool.param, name, copy.deepcopy(value))
+
+
+def run_benchmark(func, setup=None):
+    # type: (Callable[[], Any], Callable[[], Any]) -> List[float]
+    '''run func a number of times, with its output going to /dev/null
+    setup is run before each run, and is not timed
+    Returns list of times in seconds
+    '''
+
+    runs = []
+    for _ in xrange(PARAMS['repeat']):
+        if setup is not None:
+            setup()
+
+        sys.stdout.flush()
+        saved_fd = os.dup(1)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+        try:
+            t0 = time.time()
+            func()
+            runs.append(time.time() - t0)
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_fd, 1)
+            os.close(saved_fd)
+
+    return runs
+
+
+def benchmarks(repo, pristine):
+    # type: (Repository, Dict[str, Any]) -> List[Tuple[str, Callable, Callable]]
+    '''Returns list of benchmarks: (name, func, setup)'''
+
+    client = synctool.main.client
+    overlay_dir = synctool.param.OVERLAY_DIR
+
+    def dry_run():
+        '''set dry-run mode'''
+        synctool.lib.DRY_RUN = True
+
+    def fix():
+        '''set fix mode'''
+        synctool.lib.DRY_RUN = False
+
+    def overlay():
+        '''check (and fix) the overlay tree'''
+        client.overlay_files()
+
+    def new_dest():
+        '''start with an empty destination'''
+        repo.clear_dest()
+
+    def fix_new_dest():
+        '''start with an empty destination in fix mode'''
+        repo.clear_dest()
+        fix()
+
+    def synced_dest():
+        '''start with a synced destination in dry-run mode'''
+        fix()
+        overlay()
+        repo.add_old_files()
+        dry_run()
+
+    def changed_dest():
+        '''start with changed files in fix mode'''
+        repo.change_dest()
+        fix()
+
+    def delete():
+        '''check the delete tree'''
+        synctool.overlay.visit(synctool.param.DELETE_DIR,
+                               client._delete_callback)
+
+    nodes = 'n[0001-%04d]' % PARAMS['nodes']
+    nodelist = synctool.range.expand(nodes)
+
+    def expand():
+        '''expand a node range'''
+        synctool.range.expand(nodes)
+
+    def compress():
+        '''compress a node list'''
+        synctool.range.compress(nodelist)
+
+    def reset_config():
+        '''forget that the config was read'''
+        _restore_config(pristine)
+
+    def read_config():
+        '''parse the config file'''
+        synctool.configparser.read_config_file(repo.conf_file)
+
+    # output like synctool --aggregate gets: every node says
+    # what it did, and the nodes in a group do the same
+    lines = []
+    for n, node in enumerate(nodelist):
+        group = n % PARAMS['groups']
+        for i in xrange(10):
+            lines.append('%s: %s/dir%04d/file%04d updated\n' %
+                         (node, repo.dest, group, i))
+    output = ''.join(lines)
+
+    def aggregate():
+        '''aggregate the output of all nodes'''
+        synctool.aggr.aggregate(cStringIO.StringIO(output))
+
+    arr = [
+        ('overlay dry-run, new', overlay, lambda: (new_dest(), dry_run())),
+        ('overlay fix, new', overlay, fix_new_dest),
+        ('overlay dry-run, synced', overlay, synced_dest),
+        ('overlay fix, changed', overlay, changed_dest),
+        ('delete dry-run', delete, dry_run),
+    ]
+
+    if synctool.lib.search_path('rsync'):
+        arr.append(('purge dry-run', client.purge_files, dry_run))
+
+    arr.extend([
+        ('range expand', expand, None),
+        ('range compress', compress, None),
+        ('aggregate', aggregate, None),
+        # this one comes last, as it leaves the config half read
+        ('read config', read_config, reset_config),
+    ])
+    return arr
+
+
+def compare(results, names, filename):
+    # type: (Dict[str, Any], List[str], str) -> None
+    '''print the results next to those in a JSON file
+    names is the list of benchmarks in order
+    '''
+
+    with open(filename) as f:
+        old = json.load(f)
+
+    print
+    print 'compared to synctool %s (python %s)' % (old['version'],
+                                                   old['python'])
+    if old['params'] != PARAMS:
+        print 'note: the parameters differ'
+
+    print '%-28s %10s %10s %8s' % ('benchmark', 'old', 'new', 'ratio')
+    for name in names:
+        if name not in old['results']:
+            continue
+
+        t_old = old['results'][name]['best']
+        t_new = results['results'][name]['best']
+        if t_old > 0:
+            ratio = '%7.2fx' % (t_new / t_old)
+        else:
+            ratio = '-'
+        print '%-28s %9.3fs %9.3fs %8s' % (name, t_old, t_new, ratio)
+
+
+def usage():
+    # type: () -> None
+    '''print usage information'''
+
+    print 'usage: %s [options]' % os.path.basename(sys.argv[0])
+    print 'options:'
+    print '  -h, --help            Display this information'
+    print '  -o, --output=FILE     Save results as JSON'
+    print '  -c, --compare=FILE    Compare to results in JSON file'
+    for key in sorted(PARAMS.keys()):
+        print '      --%-15s (default: %d)' % (key + '=NUM', PARAMS[key])
+
+
+def get_options():
+    # type: () -> Tuple[str, str]
+    '''parse command-line options
+    Returns tuple: output filename, compare filename
+    '''
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'ho:c:',
+                                   ['help', 'output=', 'compare='] +
+                                   [key + '=' for key in PARAMS])
+    except getopt.GetoptError as reason:
+        print '%s: %s' % (os.path.basename(sys.argv[0]), reason)
+        sys.exit(1)
+
+    if args:
+        usage()
+        sys.exit(1)
+
+    output = compare_file = None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(1)
+
+        if opt in ('-o', '--output'):
+            output = arg
+            continue
+
+        if opt in ('-c', '--compare'):
+            compare_file = arg
+            continue
+
+        try:
+            PARAMS[opt[2:]] = int(arg)
+        except ValueError:
+            print '%s: %s: invalid number' % (os.path.basename(sys.argv[0]),
+                                              opt)
+            sys.exit(1)
+
+    if PARAMS['groups'] < 1 or PARAMS['nodes'] < 1 or PARAMS['depth'] < 1:
+        print ('%s: there must be at least one group, node and level' %
+               os.path.basename(sys.argv[0]))
+        sys.exit(1)
+
+    return output, compare_file
+
+
+def main():
+    # type: () -> None
+    '''run the benchmarks'''
+
+    output, compare_file = get_options()
+
+    tmpdir = os.path.realpath(tempfile.mkdtemp(prefix='synctool-bench-'))
+    results = {
+        'version': synctool.param.VERSION,
+        'python': platform.python_version(),
+        'params': PARAMS,
+        'results': {},
+    }   # type: Dict[str, Any]
+    names = []      # type: List[str]
+
+    try:
+        repo = Repository(tmpdir)
+        repo.make()
+        pristine = init_synctool(repo)
+
+        print '%-28s %10s %10s' % ('benchmark', 'best', 'mean')
+        for name, func, setup in benchmarks(repo, pristine):
+            runs = run_benchmark(func, setup)
+            best = min(runs)
+            mean = sum(runs) / len(runs)
+            results['results'][name] = {'best': best, 'runs': runs}
+            names.append(name)
+            print '%-28s %9.3fs %9.3fs' % (name, best, mean)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if compare_file:
+        compare(results, names, compare_file)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
+
+# EOB
@@ -23,9 +23,11 @@ synctool_template.py synctool_list.py"
 
 LAUNCHER="synctool_launch.py"
 
-LIBS="__init__.py aggr.py config.py configparser.py lib.py multiplex.py
-nodeset.py object.py overlay.py parallel.py param.py pkgclass.py pwdgrp.py
-range.py syncstat.py unbuffered.py update.py upload.py"
+LIBS="__init__.py aggr.py config.py configparser.py digest.py evloop.py
+fastcopy.py index.py journal.py lib.py metrics.py multiplex.py nodeset.py
+object.py overlay.py parallel.py param.py ping.py pipeline.py plan.py
+pkgclass.py postqueue.py pwdgrp.py range.py state.py store.py syncstat.py
+unbuffered.py update.py upload.py watch.py"
 
 MAIN_LIBS="__init__.py aggr.py client.py config.py master.py dsh_pkg.py
 client_pkg.py dsh_ping.py dsh_cp.py dsh.py template.py wrapper.py"
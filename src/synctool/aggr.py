@@ -8,73 +8,283 @@
 #   License.
 #
 
-'''aggregate: group together output that is the same'''
+'''aggregate: group together output that is the same
 
+The output of the nodes is read as a stream. The output of every node
+is checksummed as it comes in, so that nodes can be grouped by digest
+rather than by comparing their output against that of every other node.
+Output is buffered in memory up to SPILL_SIZE bytes per node;
+beyond that, it is spilled to a temp file.
+
+With option --live, the command tells the aggregator when a node is done.
+While waiting for the other nodes, the aggregator keeps showing
+which nodes had identical output so far, and which are still pending.
+'''
+
+import sys
+import time
+import hashlib
+import tempfile
 import subprocess
 
 try:
-    from typing import List, Dict, IO
+    from typing import List, Dict, Tuple, Set, IO
 except ImportError:
     pass
 
+import synctool.lib
 from synctool.lib import stderr
 import synctool.range
 
+# output of a node is buffered in memory up to this many bytes
+SPILL_SIZE = 16 * 1024
 
-def aggregate(f):
-    # type: (IO) -> None
-    '''group together input lines that are the same'''
+# the live view is redrawn at most once per this many seconds
+LIVE_INTERVAL = 1.0
+# number of groups shown in the live view
+LIVE_GROUPS = 10
 
-    lines = f.readlines()
-    if not lines:
-        return
 
-    lines = [x.strip() for x in lines]
+class NodeOutput(object):
+    '''the output of a single node'''
 
-    output_per_node = {}    # type: Dict[str, List[str]]
+    def __init__(self):
+        # type: () -> None
+        '''initialize instance'''
 
-    for line in lines:
-        arr = line.split(':', 1)
+        self.checksum = hashlib.md5()
+        # first line of output, for the live view
+        self.first = None       # type: str
+        self.lines = []         # type: List[str]
+        self.size = 0
+        # chunks of output that were spilled: (offset, length)
+        self.chunks = []        # type: List[Tuple[int, int]]
 
-        if len(arr) <= 1:
+    def add(self, line, spill):
+        # type: (str, Spill) -> None
+        '''add a line of output'''
+
+        if self.first is None:
+            self.first = line
+
+        self.checksum.update(line + '\n')
+        self.lines.append(line)
+        self.size += len(line) + 1
+
+        if self.size > SPILL_SIZE:
+            self.chunks.append(spill.write(self.lines))
+            self.lines = []
+            self.size = 0
+
+    def digest(self):
+        # type: () -> str
+        '''Returns digest of the output'''
+
+        return self.checksum.digest()
+
+    def output(self, spill):
+        # type: (Spill) -> None
+        '''print the output'''
+
+        for offset, length in self.chunks:
+            for line in spill.read(offset, length):
+                print line
+
+        for line in self.lines:
             print line
-            continue
 
-        node = arr[0]
-        output = arr[1]
 
-        if node not in output_per_node:
-            output_per_node[node] = [output,]
-        else:
-            output_per_node[node].append(output)
+class Spill(object):
+    '''temp file that holds spilled output of all nodes'''
 
-    nodes = output_per_node.keys()
-    if not nodes:
-        return
+    def __init__(self):
+        # type: () -> None
+        '''initialize instance'''
 
-    nodes.sort()
+        # the file is created only when needed
+        self.f = None       # type: IO[str]
+        self.end = 0
 
-    while nodes:
-        node = nodes.pop(0)
+    def write(self, lines):
+        # type: (List[str]) -> Tuple[int, int]
+        '''append lines to the temp file
+        Returns tuple: offset, length
+        '''
 
-        out = output_per_node[node]
+        if self.f is None:
+            self.f = tempfile.TemporaryFile(prefix='synctool-aggr-')
 
-        nodelist = [node,]
+        data = '\n'.join(lines)
+        offset = self.end
+        self.f.seek(offset)
+        self.f.write(data)
+        self.end += len(data)
+        return offset, len(data)
 
-        for node2 in nodes[:]:
-            if out == output_per_node[node2]:
-                nodelist.append(node2)
-                del output_per_node[node2]
-                nodes.remove(node2)
+    def read(self, offset, length):
+        # type: (int, int) -> List[str]
+        '''Returns lines in chunk of the temp file'''
 
-        print synctool.range.compress(nodelist) + ':'
-        for line in out:
+        self.f.seek(offset)
+        return self.f.read(length).split('\n')
+
+    def close(self):
+        # type: () -> None
+        '''delete the temp file'''
+
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class LiveView(object):
+    '''shows how the output of the nodes converges, while it comes in'''
+
+    def __init__(self):
+        # type: () -> None
+        '''initialize instance'''
+
+        self.pending = set()    # type: Set[str]
+        # nodes that are done, grouped by digest of their output
+        self.groups = {}        # type: Dict[str, List[str]]
+        # first line of output per group
+        self.first = {}         # type: Dict[str, str]
+        self.num_done = 0
+        self.last_draw = 0.0
+        # only clear the screen when it is a terminal
+        self.tty = sys.stdout.isatty()
+
+    def status(self, line, output_per_node):
+        # type: (str, Dict[str, NodeOutput]) -> None
+        '''handle a status line "%synctool-aggr% status nodes ..."'''
+
+        arr = line.split()
+        if len(arr) < 3:
+            return
+
+        if arr[1] == 'pending':
+            self.pending.update(arr[2:])
+            return
+
+        if arr[1] != 'done':
+            return
+
+        for node in arr[2:]:
+            if node not in self.pending:
+                continue
+
+            self.pending.remove(node)
+            self.num_done += 1
+
+            if node in output_per_node:
+                output = output_per_node[node]
+                digest = output.digest()
+                first = output.first
+            else:
+                # no output at all
+                digest = hashlib.md5().digest()
+                first = None
+
+            if digest not in self.groups:
+                self.groups[digest] = [node,]
+                self.first[digest] = first
+            else:
+                self.groups[digest].append(node)
+
+        # when all are done, the final output follows
+        now = time.time()
+        if self.pending and now - self.last_draw >= LIVE_INTERVAL:
+            self.draw()
+            self.last_draw = now
+
+    def draw(self):
+        # type: () -> None
+        '''show the groups so far, and the pending nodes'''
+
+        if self.tty:
+            # move cursor home and clear the screen
+            sys.stdout.write('\033[H\033[J')
+
+        print '%d of %d nodes done' % (self.num_done,
+                                       self.num_done + len(self.pending))
+
+        # show the largest groups first
+        groups = sorted(self.groups.items(), key=lambda x: len(x[1]),
+                        reverse=True)
+        for digest, nodelist in groups[:LIVE_GROUPS]:
+            print '  %d nodes identical so far: %s' % (
+                len(nodelist), synctool.range.compress(nodelist))
+            first = self.first[digest]
+            if first is None:
+                print '    (no output)'
+            else:
+                print '    ' + first.strip()
+
+        if len(groups) > LIVE_GROUPS:
+            print '  ... and %d more groups' % (len(groups) - LIVE_GROUPS)
+
+        print '  pending: %s' % synctool.range.compress(list(self.pending))
+        sys.stdout.flush()
+
+
+def aggregate(f, live=False):
+    # type: (IO, bool) -> None
+    '''group together input lines that are the same
+    If live is True, show the groups while the nodes are done
+    '''
+
+    output_per_node = {}    # type: Dict[str, NodeOutput]
+    spill = Spill()
+
+    view = None             # type: LiveView
+    if live:
+        view = LiveView()
+
+    tag = synctool.lib.AGGR_TAG + ' '
+
+    # Note: not 'for line in f', because that reads ahead
+    for line in iter(f.readline, ''):
+        line = line.strip()
+
+        if view is not None and line[:len(tag)] == tag:
+            view.status(line, output_per_node)
+            continue
+
+        arr = line.split(':', 1)
+        if len(arr) <= 1:
             print line
+            continue
+
+        node = arr[0]
+        if node not in output_per_node:
+            output_per_node[node] = NodeOutput()
 
+        output_per_node[node].add(arr[1], spill)
 
-def run(cmd_arr):
-    # type: (List[str]) -> bool
+    # group the nodes by the digest of their output
+    # the groups are ordered by the first node in the group
+    groups = {}             # type: Dict[str, List[str]]
+    order = []              # type: List[str]
+    for node in sorted(output_per_node.keys()):
+        digest = output_per_node[node].digest()
+        if digest not in groups:
+            groups[digest] = [node,]
+            order.append(digest)
+        else:
+            groups[digest].append(node)
+
+    for digest in order:
+        nodelist = groups[digest]
+        print synctool.range.compress(nodelist) + ':'
+        output_per_node[nodelist[0]].output(spill)
+
+    spill.close()
+
+
+def run(cmd_arr, live=False):
+    # type: (List[str], bool) -> bool
     '''pipe the output through the aggregator
+    If live is True, show the groups while the nodes are done
     Returns False on error, else True
     '''
 
@@ -86,6 +296,12 @@ def run(cmd_arr):
     if '--aggregate' in cmd_arr:
         cmd_arr.remove('--aggregate')
 
+    if live:
+        cmd_arr.remove('--live')
+        # the command reports when nodes are done
+        # Note: dsh has the remote command at the end of cmd_arr
+        cmd_arr.insert(1, '--aggr-status')
+
     try:
         f = subprocess.Popen(cmd_arr, shell=False, bufsize=4096,
                              stdout=subprocess.PIPE,
@@ -95,7 +311,7 @@ def run(cmd_arr):
         return False
 
     with f:
-        aggregate(f)
+        aggregate(f, live)
 
     return True
 
@@ -71,6 +71,23 @@ def read_config():
         error("'master' is not configured")
         errors += 1
 
+    # the object store is made from the digests in the index
+    if synctool.param.DEDUP_TRANSFER and not synctool.param.OVERLAY_INDEX:
+        error("'dedup_transfer' requires 'overlay_index yes'")
+        errors += 1
+
+    # the journal is made while updating the index
+    if synctool.param.INCREMENTAL and not synctool.param.OVERLAY_INDEX:
+        error("'incremental' requires 'overlay_index yes'")
+        errors += 1
+
+    # the digest cache holds MD5 checksums only
+    if (synctool.param.COMPARE_METHOD not in ('bytes', 'md5') and
+            synctool.param.DIGEST_CACHE != 'none'):
+        error("'compare_method %s' requires 'digest_cache none'" %
+              synctool.param.COMPARE_METHOD)
+        errors += 1
+
     for node in synctool.param.SLAVES:
         if node not in synctool.param.NODES:
             error("slave '%s': no such node" % node)
@@ -19,6 +19,7 @@
 import os
 import sys
 import re
+import imp
 
 try:
     from typing import List, Dict, Tuple, Pattern
@@ -45,6 +46,9 @@ PERSIST_TIME = re.compile(r'^\d+$|'
 # to see if a parameter is being redefined
 SYMBOLS = {}    # type: Dict[str, Symbol]
 
+# config files that were read, including the included ones
+FILES = []      # type: List[str]
+
 
 class Symbol(object):
     '''structure that says where a symbol was first defined'''
@@ -79,6 +83,7 @@ def read_config_file(configfile):
                                                                 err.strerror))
         return 1
 
+    FILES.append(configfile)
     this_module = sys.modules['synctool.configparser']
 
     lineno = 0
@@ -350,6 +355,30 @@ def config_ssh_control_persist(arr, configfile, lineno):
     return 0
 
 
+def config_ssh_pool(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: ssh_pool'''
+
+    err, param.SSH_POOL = _config_boolean('ssh_pool', arr[1],
+                                          configfile, lineno)
+    return err
+
+
+def config_ssh_pool_timeout(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: ssh_pool_timeout'''
+
+    err, param.SSH_POOL_TIMEOUT = _config_integer('ssh_pool_timeout', arr[1],
+                                                  configfile, lineno)
+
+    if not err and param.SSH_POOL_TIMEOUT < 1:
+        stderr("%s:%d: invalid argument for ssh_pool_timeout" %
+               (configfile, lineno))
+        return 1
+
+    return err
+
+
 def config_require_extension(arr, configfile, lineno):
     # type: (List[str], str, int) -> int
     '''parse keyword: require_extension'''
@@ -393,6 +422,172 @@ def config_sync_times(arr, configfile, lineno):
                                             lineno)
     return err
 
+
+def config_digest_cache(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: digest_cache'''
+
+    if len(arr) != 2:
+        stderr("%s:%d: 'digest_cache' requires a single argument" %
+               (configfile, lineno))
+        return 1
+
+    if not check_definition(arr[0], configfile, lineno):
+        return 1
+
+    mode = arr[1].lower()
+    if mode not in param.DIGEST_CACHE_MODES:
+        stderr("%s:%d: invalid argument for digest_cache" % (configfile,
+                                                             lineno))
+        return 1
+
+    param.DIGEST_CACHE = mode
+    return 0
+
+
+def config_check_mode(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: check_mode'''
+
+    if len(arr) != 2:
+        stderr("%s:%d: 'check_mode' requires a single argument" %
+               (configfile, lineno))
+        return 1
+
+    if not check_definition(arr[0], configfile, lineno):
+        return 1
+
+    mode = arr[1].lower()
+    if mode not in param.CHECK_MODES:
+        stderr("%s:%d: invalid argument for check_mode" % (configfile,
+                                                           lineno))
+        return 1
+
+    param.CHECK_MODE = mode
+    return 0
+
+
+def config_compare_method(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: compare_method'''
+
+    if len(arr) != 2:
+        stderr("%s:%d: 'compare_method' requires a single argument" %
+               (configfile, lineno))
+        return 1
+
+    if not check_definition(arr[0], configfile, lineno):
+        return 1
+
+    method = arr[1].lower()
+    if method not in param.COMPARE_METHODS:
+        stderr("%s:%d: invalid argument for compare_method" % (configfile,
+                                                               lineno))
+        return 1
+
+    if method == 'xxhash':
+        try:
+            imp.find_module('xxhash')
+        except ImportError:
+            stderr("%s:%d: compare_method xxhash requires the Python "
+                   "module 'xxhash'" % (configfile, lineno))
+            return 1
+
+    param.COMPARE_METHOD = method
+    return 0
+
+
+def config_check_workers(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: check_workers'''
+
+    err, param.CHECK_WORKERS = _config_integer('check_workers', arr[1],
+                                               configfile, lineno)
+
+    if not err and param.CHECK_WORKERS < 1:
+        stderr("%s:%d: invalid argument for check_workers" % (configfile,
+                                                              lineno))
+        return 1
+
+    return err
+
+
+def config_dest_state(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: dest_state'''
+
+    err, param.DEST_STATE = _config_boolean('dest_state', arr[1],
+                                            configfile, lineno)
+    return err
+
+
+def config_batch_post(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: batch_post'''
+
+    err, param.BATCH_POST = _config_boolean('batch_post', arr[1],
+                                            configfile, lineno)
+    return err
+
+
+def config_post_workers(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: post_workers'''
+
+    err, param.POST_WORKERS = _config_integer('post_workers', arr[1],
+                                              configfile, lineno)
+
+    if not err and param.POST_WORKERS < 1:
+        stderr("%s:%d: invalid argument for post_workers" % (configfile,
+                                                             lineno))
+        return 1
+
+    return err
+
+
+def config_overlay_index(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: overlay_index'''
+
+    err, param.OVERLAY_INDEX = _config_boolean('overlay_index', arr[1],
+                                               configfile, lineno)
+    return err
+
+
+def config_incremental(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: incremental'''
+
+    err, param.INCREMENTAL = _config_boolean('incremental', arr[1],
+                                             configfile, lineno)
+    return err
+
+
+def config_full_sweep_interval(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: full_sweep_interval'''
+
+    err, param.FULL_SWEEP_INTERVAL = _config_integer('full_sweep_interval',
+                                                     arr[1], configfile,
+                                                     lineno)
+
+    if not err and param.FULL_SWEEP_INTERVAL < 0:
+        stderr("%s:%d: invalid argument for full_sweep_interval" %
+               (configfile, lineno))
+        return 1
+
+    return err
+
+
+def config_dedup_transfer(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: dedup_transfer'''
+
+    err, param.DEDUP_TRANSFER = _config_boolean('dedup_transfer', arr[1],
+                                                configfile, lineno)
+    return err
+
+
 def config_ignore_dotfiles(arr, configfile, lineno):
     # type: (List[str], str, int) -> int
     '''parse keyword: ignore_dotfiles'''
@@ -705,6 +900,14 @@ def config_slave(arr, configfile, lineno):
     return 0
 
 
+def config_fanout(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: fanout'''
+
+    err, param.FANOUT = _config_boolean('fanout', arr[1], configfile, lineno)
+    return err
+
+
 def config_group(arr, configfile, lineno):
     # type: (List[str], str, int) -> int
     '''parse keyword: group'''
@@ -1040,6 +1243,57 @@ def config_ping_cmd(arr, configfile, lineno):
     return err
 
 
+def config_ping_engine(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: ping_engine'''
+
+    if len(arr) != 2:
+        stderr("%s:%d: 'ping_engine' requires a single argument" %
+               (configfile, lineno))
+        return 1
+
+    if not check_definition(arr[0], configfile, lineno):
+        return 1
+
+    engine = arr[1].lower()
+    if engine not in param.PING_ENGINES:
+        stderr("%s:%d: invalid argument for ping_engine" % (configfile,
+                                                            lineno))
+        return 1
+
+    param.PING_ENGINE = engine
+    return 0
+
+
+def config_ping_port(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: ping_port'''
+
+    err, param.PING_PORT = _config_integer('ping_port', arr[1], configfile,
+                                           lineno)
+
+    if not err and not 0 < param.PING_PORT < 65536:
+        stderr("%s:%d: invalid argument for ping_port" % (configfile, lineno))
+        return 1
+
+    return err
+
+
+def config_ping_timeout(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: ping_timeout'''
+
+    err, param.PING_TIMEOUT = _config_integer('ping_timeout', arr[1],
+                                              configfile, lineno)
+
+    if not err and param.PING_TIMEOUT < 1:
+        stderr("%s:%d: invalid argument for ping_timeout" % (configfile,
+                                                             lineno))
+        return 1
+
+    return err
+
+
 def config_ssh_cmd(arr, configfile, lineno):
     # type: (List[str], str, int) -> int
     '''parse keyword: ssh_cmd'''
@@ -1095,6 +1349,28 @@ def config_num_proc(arr, configfile, lineno):
     return err
 
 
+def config_parallel_engine(arr, configfile, lineno):
+    # type: (List[str], str, int) -> int
+    '''parse keyword: parallel_engine'''
+
+    if len(arr) != 2:
+        stderr("%s:%d: 'parallel_engine' requires a single argument" %
+               (configfile, lineno))
+        return 1
+
+    if not check_definition(arr[0], configfile, lineno):
+        return 1
+
+    engine = arr[1].lower()
+    if engine not in param.PARALLEL_ENGINES:
+        stderr("%s:%d: invalid argument for parallel_engine" % (configfile,
+                                                                lineno))
+        return 1
+
+    param.PARALLEL_ENGINE = engine
+    return 0
+
+
 def expand_grouplist(grouplist):
     # type: (List[str]) -> List[str]
     '''expand a list of (compound) groups recursively
@@ -0,0 +1,267 @@
+#
+#   synctool.digest.py    WJ126
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''persistent cache of file digests
+
+The cache is a plain text file under $SYNCTOOL/var/cache/ that holds
+a line per file: "digest size mtime inode path"
+An entry is valid as long as the size, mtime and inode of the file
+have not changed. When they do match, there is no need to read the
+file at all.
+'''
+
+import os
+import time
+import errno
+import hashlib
+
+try:
+    from typing import Dict, Tuple, Set
+    from synctool.syncstat import SyncStat
+except ImportError:
+    pass
+
+import synctool.lib
+from synctool.lib import verbose, error, warning
+import synctool.metrics
+import synctool.param
+
+# size for doing I/O while checksumming files
+IO_SIZE = 16 * 1024
+
+CACHE_FILE = 'digest.cache'
+# header line; bump the version when changing the file format
+CACHE_MAGIC = '# synctool digest cache v1 md5'
+
+# CACHE[path] -> (size, mtime, inode, digest)
+CACHE = None        # type: Dict[str, Tuple[int, int, int, str]]
+# set of paths that were looked up during this run
+USED = set()        # type: Set[str]
+DIRTY = False       # type: bool
+
+# digests that are known up front, like from the index made by the master
+# KNOWN[path] -> (size, mtime, digest)
+KNOWN = {}          # type: Dict[str, Tuple[int, int, str]]
+
+# time at which the cache was loaded
+# files modified at or after this time are not cached, because they may
+# still change within the same second without changing their mtime
+NOW = 0             # type: int
+
+
+def _cache_filename():
+    # type: () -> str
+    '''Returns full path of the cache file'''
+
+    return os.path.join(synctool.param.CACHE_DIR, CACHE_FILE)
+
+
+def load():
+    # type: () -> None
+    '''load the digest cache from disk'''
+
+    global CACHE, NOW
+
+    CACHE = {}
+    NOW = int(time.time())
+
+    filename = _cache_filename()
+    try:
+        f = open(filename, 'r')
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            warning('failed to read digest cache %s: %s' % (filename,
+                                                           err.strerror))
+        return
+
+    with f:
+        if f.readline().rstrip('\n') != CACHE_MAGIC:
+            verbose('discarding digest cache %s: unknown format' % filename)
+            return
+
+        for line in f:
+            arr = line.rstrip('\n').split(' ', 4)
+            if len(arr) != 5:
+                continue
+
+            digest, size, mtime, ino, path = arr
+            try:
+                CACHE[path] = (int(size), int(mtime), int(ino), digest)
+            except ValueError:
+                continue
+
+    verbose('loaded %d entries from digest cache' % len(CACHE))
+
+
+def save():
+    # type: () -> None
+    '''write the digest cache back to disk
+    Entries for files that no longer exist are evicted
+    '''
+
+    global DIRTY
+
+    if CACHE is None:
+        # cache was not used in this run,
+        # but it may still hold entries that need evicting
+        load()
+
+    # evict entries for files that have disappeared
+    # entries that were used in this run are known to exist
+    for path in CACHE.keys():
+        if path not in USED and not synctool.lib.path_exists(path):
+            del CACHE[path]
+            DIRTY = True
+
+    if not DIRTY:
+        return
+
+    if not synctool.lib.mkdir_p(synctool.param.CACHE_DIR):
+        # error message already printed
+        return
+
+    # write to temp file and rename, so that the cache is never corrupt
+    filename = _cache_filename()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        warning('failed to write digest cache %s: %s' % (tmp_filename,
+                                                        err.strerror))
+        return
+
+    with f:
+        f.write(CACHE_MAGIC + '\n')
+        for path in sorted(CACHE.keys()):
+            size, mtime, ino, digest = CACHE[path]
+            f.write('%s %d %d %d %s\n' % (digest, size, mtime, ino, path))
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        return
+
+    DIRTY = False
+
+
+def lookup(path, statbuf):
+    # type: (str, SyncStat) -> str
+    '''Returns cached digest for path, or None if not cached
+    or if the cached entry is stale
+    '''
+
+    if CACHE is None:
+        load()
+
+    USED.add(path)
+
+    try:
+        size, mtime, ino, digest = CACHE[path]
+    except KeyError:
+        return None
+
+    if (size != statbuf.size or mtime != statbuf.mtime or
+            ino != statbuf.ino):
+        return None
+
+    return digest
+
+
+def store(path, statbuf, digest):
+    # type: (str, SyncStat, str) -> None
+    '''put digest for path into the cache'''
+
+    global DIRTY
+
+    if CACHE is None:
+        load()
+
+    USED.add(path)
+
+    # newlines would break the file format
+    # recently modified files can not be trusted (see NOW above)
+    if '\n' in path or statbuf.mtime >= NOW:
+        if path in CACHE:
+            del CACHE[path]
+            DIRTY = True
+        return
+
+    CACHE[path] = (statbuf.size, statbuf.mtime, statbuf.ino, digest)
+    DIRTY = True
+
+
+def file_digest(path):
+    # type: (str) -> str
+    '''Returns MD5 hex digest of the file contents, or None on error'''
+
+    try:
+        return compute(path)
+    except IOError as err:
+        error('failed to read file %s: %s' % (path, err.strerror))
+        return None
+
+
+def compute(path):
+    # type: (str) -> str
+    '''Returns MD5 hex digest of the file contents
+    It raises IOError on error
+    '''
+
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(IO_SIZE)
+            if not data:
+                break
+
+            md5.update(data)
+            synctool.metrics.count('bytes_read', len(data))
+
+    synctool.metrics.count('hashed')
+    return md5.hexdigest()
+
+
+def known(path, statbuf):
+    # type: (str, SyncStat) -> str
+    '''Returns MD5 hex digest of the file if it is known up front
+    or cached, else None
+    '''
+
+    try:
+        size, mtime, digest = KNOWN[path]
+    except KeyError:
+        pass
+    else:
+        if size == statbuf.size and mtime == statbuf.mtime:
+            return digest
+
+    return lookup(path, statbuf)
+
+
+def checksum(path, statbuf):
+    # type: (str, SyncStat) -> str
+    '''Returns MD5 hex digest of the file, from cache if possible
+    It raises IOError on error
+    '''
+
+    digest = known(path, statbuf)
+    if digest is None:
+        digest = compute(path)
+        store(path, statbuf, digest)
+
+    return digest
+
+# EOB
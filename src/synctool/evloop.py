@@ -0,0 +1,192 @@
+#
+#   synctool.evloop.py    WJ127
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''run commands for many nodes from a single process
+
+This is an alternative to synctool.parallel; rather than forking
+a worker per parallel process, it starts the commands for up to
+NUM_PROC nodes and reads all their output in a single poll() loop.
+The commands of a single node are run one after another.
+This module is very UNIX-only, sorry
+'''
+
+import os
+import sys
+import errno
+import select
+import subprocess
+import collections
+
+try:
+    from typing import List, Dict, Iterable, Iterator
+except ImportError:
+    pass
+
+import synctool.lib
+from synctool.lib import verbose, stderr, unix_out
+import synctool.param
+
+# size for reading output of the commands
+IO_SIZE = 4096
+
+
+class Job(object):
+    '''represents the commands to run for a single node'''
+
+    def __init__(self, nodename, commands):
+        # type: (str, Iterable[List[str]]) -> None
+        '''commands is an iterable of command arrays
+        A generator is fine; the next command is taken from it
+        only after the previous command has finished
+        '''
+
+        self.nodename = nodename
+        self.commands = iter(commands)      # type: Iterator[List[str]]
+        self.proc = None                    # type: subprocess.Popen
+        self.buf = ''
+
+    def output(self, line):
+        # type: (str) -> None
+        '''handle a line of output'''
+
+        synctool.lib.output_with_nodename(line, self.nodename)
+
+    def finish(self):
+        # type: () -> None
+        '''called when all commands for this node are done'''
+
+        pass
+
+
+def enabled():
+    # type: () -> bool
+    '''Returns True if the event loop should be used'''
+
+    # when sleeping between runs, work is serialized anyway
+    return (synctool.param.PARALLEL_ENGINE == 'eventloop' and
+            synctool.param.SLEEP_TIME == 0)
+
+
+def run(jobs):
+    # type: (List[Job]) -> None
+    '''run jobs concurrently, bounded by NUM_PROC'''
+
+    pending = collections.deque(jobs)
+    active = {}     # type: Dict[int, Job]
+    poller = select.poll()
+
+    num_proc = max(synctool.param.NUM_PROC, 1)
+
+    while pending or active:
+        while pending and len(active) < num_proc:
+            job = pending.popleft()
+            if _spawn(job):
+                fd = job.proc.stdout.fileno()
+                active[fd] = job
+                poller.register(fd, select.POLLIN)
+
+        if not active:
+            break
+
+        try:
+            events = poller.poll()
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd, _ in events:
+            job = active[fd]
+            try:
+                data = os.read(fd, IO_SIZE)
+            except OSError as err:
+                if err.errno in (errno.EINTR, errno.EAGAIN):
+                    continue
+                data = ''
+
+            if data:
+                _feed(job, data)
+                continue
+
+            # end of output; the command is done
+            poller.unregister(fd)
+            del active[fd]
+            _reap(job)
+
+            # start the next command for this node (if any)
+            if _spawn(job):
+                fd = job.proc.stdout.fileno()
+                active[fd] = job
+                poller.register(fd, select.POLLIN)
+
+
+def _spawn(job):
+    # type: (Job) -> bool
+    '''start the next command of a job
+    Returns False if the job has no more commands
+    '''
+
+    while True:
+        try:
+            cmd_arr = next(job.commands)
+        except StopIteration:
+            job.proc = None
+            job.finish()
+            synctool.lib.aggr_status('done', [job.nodename])
+            return False
+
+        unix_out(' '.join(cmd_arr))
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        try:
+            job.proc = subprocess.Popen(cmd_arr, shell=False,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        except OSError as err:
+            stderr('failed to run command %s: %s' % (cmd_arr[0],
+                                                     err.strerror))
+            continue
+
+        job.buf = ''
+        return True
+
+
+def _feed(job, data):
+    # type: (Job, str) -> None
+    '''pass complete lines of output on to the job'''
+
+    job.buf += data
+    if '\n' not in job.buf:
+        return
+
+    lines = job.buf.split('\n')
+    job.buf = lines.pop()
+    for line in lines:
+        job.output(line)
+
+
+def _reap(job):
+    # type: (Job) -> None
+    '''flush remaining output and wait for the command to exit'''
+
+    if job.buf:
+        job.output(job.buf)
+        job.buf = ''
+
+    job.proc.stdout.close()
+    job.proc.wait()
+    if job.proc.returncode != 0:
+        verbose('exit code %d' % job.proc.returncode)
+
+    sys.stdout.flush()
+
+# EOB
@@ -0,0 +1,184 @@
+#
+#   synctool.fastcopy.py    WJ133
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''copy file data in the kernel
+
+Rather than copying file data through userspace buffers, let the kernel
+do the work. In order of preference:
+
+ * reflink: clone the data blocks (btrfs, XFS, ...); no data is copied
+ * copy_file_range(): copy within the kernel (Linux 4.5 and up)
+ * sendfile(): copy within the kernel (Linux 2.6.33 and up)
+ * read() and write(), when all else fails
+
+The system calls are used through ctypes, as Python 2 has no wrappers.
+'''
+
+import os
+import sys
+import errno
+import fcntl
+
+try:
+    from typing import Callable
+except ImportError:
+    pass
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# size for doing I/O while copying files
+IO_SIZE = 64 * 1024
+
+# max bytes per call of copy_file_range() or sendfile()
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# ioctl for cloning a file on Linux
+FICLONE = 0x40049409
+
+# errors meaning that the method can not be used for these files,
+# in which case the next method is tried
+UNSUPPORTED = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.ENOTTY,
+               errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM)
+
+LINUX = sys.platform.startswith('linux')
+
+_COPY_FILE_RANGE = None     # type: Callable
+_SENDFILE = None            # type: Callable
+
+if ctypes is not None and LINUX:
+    try:
+        _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        pass
+    else:
+        if hasattr(_LIBC, 'copy_file_range'):
+            _COPY_FILE_RANGE = _LIBC.copy_file_range
+            _COPY_FILE_RANGE.restype = ctypes.c_ssize_t
+            _COPY_FILE_RANGE.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                                         ctypes.c_int, ctypes.c_void_p,
+                                         ctypes.c_size_t, ctypes.c_uint]
+
+        if hasattr(_LIBC, 'sendfile'):
+            _SENDFILE = _LIBC.sendfile
+            _SENDFILE.restype = ctypes.c_ssize_t
+            _SENDFILE.argtypes = [ctypes.c_int, ctypes.c_int,
+                                  ctypes.c_void_p, ctypes.c_size_t]
+
+
+def copy(src, dest, mode=0600):
+    # type: (str, str, int) -> None
+    '''copy data of file src to new file dest
+    dest must not exist yet
+    It raises OSError or IOError on error
+    '''
+
+    fd_in = os.open(src, os.O_RDONLY)
+    try:
+        fd_out = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        try:
+            _copy_fd(fd_in, fd_out, os.fstat(fd_in).st_size)
+        finally:
+            os.close(fd_out)
+    finally:
+        os.close(fd_in)
+
+
+def _copy_fd(fd_in, fd_out, size):
+    # type: (int, int, int) -> None
+    '''copy size bytes from fd_in to fd_out'''
+
+    if LINUX and _reflink(fd_in, fd_out):
+        return
+
+    # the methods advance the file offsets, so that the next method
+    # can take over where the previous one left off
+    for method in (_COPY_FILE_RANGE, _SENDFILE):
+        if method is None:
+            continue
+
+        copied = _kernel_copy(method, fd_in, fd_out, size)
+        if copied is None:
+            continue
+
+        size -= copied
+        if size <= 0:
+            return
+
+    _read_write(fd_in, fd_out)
+
+
+def _reflink(fd_in, fd_out):
+    # type: (int, int) -> bool
+    '''clone the file
+    Returns False if the filesystem can not do it
+    '''
+
+    try:
+        fcntl.ioctl(fd_out, FICLONE, fd_in)
+    except IOError as err:
+        if err.errno in UNSUPPORTED:
+            return False
+        raise
+
+    return True
+
+
+def _kernel_copy(method, fd_in, fd_out, size):
+    # type: (Callable, int, int, int) -> int
+    '''copy using copy_file_range() or sendfile()
+    Returns number of bytes copied,
+    or None if the method can not be used for these files
+    '''
+
+    copied = 0
+    while copied < size:
+        count = min(size - copied, CHUNK_SIZE)
+        if method is _COPY_FILE_RANGE:
+            n = method(fd_in, None, fd_out, None, count, 0)
+        else:
+            n = method(fd_out, fd_in, None, count)
+
+        if n < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+
+            if err in UNSUPPORTED and copied == 0:
+                return None
+
+            raise OSError(err, os.strerror(err))
+
+        if n == 0:
+            # the file shrunk while copying
+            break
+
+        copied += n
+
+    return copied
+
+
+def _read_write(fd_in, fd_out):
+    # type: (int, int) -> None
+    '''copy the remaining data with read() and write()'''
+
+    while True:
+        data = os.read(fd_in, IO_SIZE)
+        if not data:
+            break
+
+        while data:
+            n = os.write(fd_out, data)
+            data = data[n:]
+
+# EOB
@@ -0,0 +1,471 @@
+#
+#   synctool.index.py    WJ128
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''index of the overlay/, delete/ and purge/ trees
+
+The master node keeps an index file per group for each tree:
+$SYNCTOOL/var/index/<tree>.<group>
+It lists every entry under the group dir with its parsed group
+extension, its stat info, and the MD5 digest of regular files.
+The index files are synced to the nodes along with the repository,
+so that synctool-client does not have to list and parse directories.
+
+The listing of a directory is used only when the mtime of
+the directory still matches the index; else the client falls back
+to reading the directory itself.
+
+With "incremental yes", the differences with the previous index are
+written to the journal (see synctool.journal).
+'''
+
+import os
+import stat
+import time
+
+try:
+    from typing import List, Dict, Tuple, Set, Iterator
+except ImportError:
+    pass
+
+try:
+    # scandir.walk() gets the file types from the directory listing,
+    # where os.walk() does a stat() call for every entry
+    import scandir
+except ImportError:
+    scandir = None
+
+import synctool.digest
+import synctool.journal
+import synctool.lib
+from synctool.lib import verbose, error, prettypath
+import synctool.overlay
+import synctool.param
+
+# header line; bump the version when changing the file format
+INDEX_MAGIC = '# synctool index v1'
+
+# LISTINGS[dirname] -> [mtime, {name: (dest_name, ov_type, group, ftype)}]
+LISTINGS = {}       # type: Dict[str, List]
+# set of (tree label, group) index files that have been loaded
+LOADED = set()      # type: Set[Tuple[str, str]]
+
+
+def _trees():
+    # type: () -> List[Tuple[str, str]]
+    '''Returns list of (label, tree dir)'''
+
+    return [('overlay', synctool.param.OVERLAY_DIR),
+            ('delete', synctool.param.DELETE_DIR),
+            ('purge', synctool.param.PURGE_DIR)]
+
+
+def index_filename(label, group):
+    # type: (str, str) -> str
+    '''Returns full path of index file'''
+
+    return os.path.join(synctool.param.INDEX_DIR, '%s.%s' % (label, group))
+
+
+def _filetype(mode):
+    # type: (int) -> str
+    '''Returns one-letter file type for the index'''
+
+    if stat.S_ISDIR(mode):
+        return 'd'
+
+    if stat.S_ISREG(mode):
+        return 'f'
+
+    return 'o'
+
+
+def _read_index(filename):
+    # type: (str) -> List[List[str]]
+    '''Returns list of entries (as arrays of fields) in index file,
+    or None if the index file can not be read
+    '''
+
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        return None
+
+    entries = []
+    with f:
+        if f.readline().rstrip('\n') != INDEX_MAGIC:
+            verbose('discarding index %s: unknown format' % filename)
+            return None
+
+        for line in f:
+            arr = line.rstrip('\n').split('\t')
+            if len(arr) != 8:
+                verbose('discarding index %s: invalid line' % filename)
+                return None
+
+            entries.append(arr)
+
+    return entries
+
+
+def _scan(group_dir, relpath, old, now, lines):
+    # type: (str, str, Dict[str, List[str]], int, List[str]) -> bool
+    '''recursively scan directory and append index lines
+    Returns False if the directory can not be indexed
+    '''
+
+    path = os.path.normpath(os.path.join(group_dir, relpath))
+    try:
+        entries = os.listdir(path)
+    except OSError as err:
+        error('failed to list directory %s: %s' % (prettypath(path),
+                                                   err.strerror))
+        return False
+
+    for entry in sorted(entries):
+        if '\t' in entry or '\n' in entry:
+            # can not put this name into the index
+            verbose('not indexing %s: invalid filename' %
+                    prettypath(os.path.join(path, entry)))
+            return False
+
+        entry_relpath = os.path.normpath(os.path.join(relpath, entry))
+        fullpath = os.path.join(path, entry)
+        try:
+            statbuf = os.lstat(fullpath)
+        except OSError as err:
+            error('stat(%s) failed: %s' % (fullpath, err.strerror))
+            return False
+
+        ftype = _filetype(statbuf.st_mode)
+        size = statbuf.st_size
+        mtime = int(statbuf.st_mtime)
+
+        # entries modified at or after this time can not be trusted;
+        # they may still change within the same second
+        digest = '-'
+        if mtime >= now:
+            mtime = -1
+
+        elif ftype == 'f':
+            # re-use the digest from the previous index if unchanged
+            arr = old.get(entry_relpath)
+            if (arr is not None and arr[1] == 'f' and
+                    arr[2] == str(size) and arr[3] == str(mtime)):
+                digest = arr[4]
+            else:
+                digest = synctool.digest.file_digest(fullpath)
+                if digest is None:
+                    return False
+
+        dest_name, ov_type, group = synctool.overlay.parse_extension(entry)
+        if group is None:
+            group = '-'
+
+        lines.append('\t'.join([entry_relpath, ftype, str(size), str(mtime),
+                                digest, str(ov_type), group, dest_name]))
+
+        if ftype == 'd':
+            if not _scan(group_dir, entry_relpath, old, now, lines):
+                return False
+
+    return True
+
+
+def _dest_paths(entries):
+    # type: (List[List[str]]) -> Dict[str, str]
+    '''Returns dict of destination paths by relative path
+    entries is the list of index entries (as arrays of fields)
+    '''
+
+    paths = {'.': os.sep}
+    for arr in entries:
+        relpath, dest_name, ov_type = arr[0], arr[7], arr[5]
+        if relpath == '.':
+            continue
+
+        if ov_type == str(synctool.overlay.OV_TEMPLATE_POST):
+            # the generator is for 'name._template'; it makes 'name'
+            dest_name = os.path.splitext(dest_name)[0]
+
+        parent = os.path.dirname(relpath) or '.'
+        paths[relpath] = os.path.join(paths.get(parent, os.sep), dest_name)
+
+    return paths
+
+
+def _changed_paths(old_entries, lines):
+    # type: (List[List[str]], List[str]) -> Set[str]
+    '''Returns set of destination paths of entries that were added,
+    changed or removed
+    '''
+
+    new_entries = [line.split('\t') for line in lines]
+    old = dict((arr[0], arr) for arr in old_entries)
+    new = dict((arr[0], arr) for arr in new_entries)
+    old_dest = _dest_paths(old_entries)
+    new_dest = _dest_paths(new_entries)
+
+    paths = set()   # type: Set[str]
+    for relpath in set(old.keys()) | set(new.keys()):
+        if old.get(relpath) != new.get(relpath):
+            if relpath in new_dest:
+                paths.add(new_dest[relpath])
+            else:
+                paths.add(old_dest[relpath])
+
+    return paths
+
+
+def _update_group(label, group, group_dir, now, changes):
+    # type: (str, str, str, int, List[Tuple[str, str, str]]) -> None
+    '''(re)generate the index file for a group dir
+    Changed destination paths are appended to changes,
+    as tuples: (label, group, dest path)
+    '''
+
+    filename = index_filename(label, group)
+
+    old_entries = _read_index(filename)
+    if old_entries is None:
+        old_entries = []
+
+    old = {}    # type: Dict[str, List[str]]
+    for arr in old_entries:
+        old[arr[0]] = arr
+
+    try:
+        statbuf = os.stat(group_dir)
+    except OSError as err:
+        error('stat(%s) failed: %s' % (group_dir, err.strerror))
+        return
+
+    mtime = int(statbuf.st_mtime)
+    if mtime >= now:
+        mtime = -1
+
+    lines = ['\t'.join(['.', 'd', '0', str(mtime), '-', '-', '-', '-'])]
+    if not _scan(group_dir, '.', old, now, lines):
+        # no index for this group; clients will scan the directory
+        _remove_index(filename)
+        # what changed is unknown
+        changes.append((label, group, '*'))
+        return
+
+    if ['\t'.join(arr) for arr in old_entries] == lines:
+        # unchanged
+        return
+
+    for path in sorted(_changed_paths(old_entries, lines)):
+        changes.append((label, group, path))
+
+    verbose('updating index %s' % prettypath(filename))
+
+    # write to temp file and rename, so that the index is never corrupt
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        error('failed to write index %s: %s' % (tmp_filename, err.strerror))
+        return
+
+    with f:
+        f.write(INDEX_MAGIC + '\n')
+        for line in lines:
+            f.write(line + '\n')
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        _remove_index(tmp_filename)
+
+
+def _remove_index(filename):
+    # type: (str) -> None
+    '''delete index file'''
+
+    try:
+        os.unlink(filename)
+    except OSError:
+        # silently ignore unlink error
+        pass
+
+
+def update():
+    # type: () -> None
+    '''(re)generate the index files for all trees
+    This is done on the master node
+    '''
+
+    if not synctool.lib.mkdir_p(synctool.param.INDEX_DIR, 0755):
+        # error message already printed
+        return
+
+    now = int(time.time())
+    valid = set([synctool.journal.JOURNAL_FILE])
+    changes = []    # type: List[Tuple[str, str, str]]
+
+    for label, tree in _trees():
+        try:
+            groups = os.listdir(tree)
+        except OSError as err:
+            error('failed to list directory %s: %s' % (tree, err.strerror))
+            continue
+
+        for group in sorted(groups):
+            group_dir = os.path.join(tree, group)
+            if not os.path.isdir(group_dir):
+                continue
+
+            _update_group(label, group, group_dir, now, changes)
+            valid.add('%s.%s' % (label, group))
+
+    # remove index files for groups that no longer exist
+    for entry in os.listdir(synctool.param.INDEX_DIR):
+        if entry not in valid:
+            verbose('removing index %s' % entry)
+            _remove_index(os.path.join(synctool.param.INDEX_DIR, entry))
+
+            arr = entry.split('.', 1)
+            if len(arr) == 2 and arr[0] in synctool.journal.TREES:
+                changes.append((arr[0], arr[1], '*'))
+
+    if synctool.param.INCREMENTAL and changes:
+        synctool.journal.record(changes)
+
+
+def read(label, group):
+    # type: (str, str) -> List[List[str]]
+    '''Returns list of entries (as arrays of fields) in the index
+    of a group for a tree, or None if there is no index
+    '''
+
+    return _read_index(index_filename(label, group))
+
+
+def _load(label, tree, group):
+    # type: (str, str, str) -> None
+    '''load the index file of a group for a tree'''
+
+    LOADED.add((label, group))
+
+    filename = index_filename(label, group)
+    entries = _read_index(filename)
+    if entries is None:
+        return
+
+    group_dir = os.path.join(tree, group)
+    for arr in entries:
+        relpath, ftype, size, mtime, digest, ov_type, grp, dest_name = arr
+        path = os.path.normpath(os.path.join(group_dir, relpath))
+
+        if ftype == 'd':
+            listing = LISTINGS.setdefault(path, [-1, {}])
+            listing[0] = int(mtime)
+        elif digest != '-':
+            # the digest module checks size and mtime before using it
+            synctool.digest.KNOWN[path] = (int(size), int(mtime), digest)
+
+        if relpath == '.':
+            continue
+
+        if grp == '-':
+            grp = None
+
+        listing = LISTINGS.setdefault(os.path.dirname(path), [-1, {}])
+        listing[1][os.path.basename(path)] = (dest_name, int(ov_type), grp,
+                                              ftype)
+
+    verbose('loaded index %s' % prettypath(filename))
+
+
+def _tree_of(path):
+    # type: (str) -> Tuple[str, str, str]
+    '''Returns (label, tree dir, group) that path is in,
+    or (None, None, None) if not under any group dir
+    '''
+
+    for label, tree in _trees():
+        if path[:len(tree) + 1] == tree + os.sep:
+            group = path[len(tree) + 1:].split(os.sep)[0]
+            return label, tree, group
+
+    return None, None, None
+
+
+def listdir(path):
+    # type: (str) -> Dict[str, Tuple[str, int, str, str]]
+    '''Returns dict of directory entries from the index:
+    {name: (dest_name, ov_type, group, ftype)}
+    or None if the directory should be scanned instead
+    '''
+
+    if not synctool.param.OVERLAY_INDEX:
+        return None
+
+    label, tree, group = _tree_of(path)
+    if label is None:
+        return None
+
+    if (label, group) not in LOADED:
+        _load(label, tree, group)
+
+    try:
+        mtime, entries = LISTINGS[path]
+    except KeyError:
+        return None
+
+    if mtime == -1:
+        return None
+
+    try:
+        statbuf = os.stat(path)
+    except OSError:
+        return None
+
+    if int(statbuf.st_mtime) != mtime:
+        verbose('index is out of date for %s' % prettypath(path))
+        return None
+
+    return entries
+
+
+def walk(top):
+    # type: (str) -> Iterator[Tuple[str, List[str], List[str]]]
+    '''like os.walk(), but use the index when possible'''
+
+    entries = listdir(top)
+    if entries is None:
+        if scandir is not None:
+            walker = scandir.walk
+        else:
+            walker = os.walk
+
+        for x in walker(top):
+            yield x
+        return
+
+    subdirs = []
+    files = []
+    for name in sorted(entries.keys()):
+        if entries[name][3] == 'd':
+            subdirs.append(name)
+        else:
+            files.append(name)
+
+    yield top, subdirs, files
+
+    # like os.walk(), the caller may modify subdirs
+    for name in subdirs:
+        for x in walk(os.path.join(top, name)):
+            yield x
+
+# EOB
@@ -0,0 +1,365 @@
+#
+#   synctool.journal.py    WJ138
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''journal of changes to the repository
+
+With "incremental yes", the master node keeps a journal next to the
+index: $SYNCTOOL/var/index/journal
+Whenever updating the index finds that something changed, the
+generation number goes up by one, and the destination paths of the
+entries that were added, changed or removed are written to the journal
+under that generation.
+
+synctool-client remembers the last generation that it applied without
+errors, in $SYNCTOOL/var/cache/. The next run checks only the paths that
+changed since then. Everything is checked as usual when the journal can
+not tell what changed, when the config changed, and every so often
+("full_sweep_interval"), so that changes made on the node itself are
+corrected as well.
+'''
+
+import os
+import time
+import errno
+import hashlib
+
+try:
+    from typing import List, Dict, Tuple, Set
+except ImportError:
+    pass
+
+import synctool.configparser
+import synctool.lib
+from synctool.lib import verbose, error, warning
+import synctool.param
+
+JOURNAL_FILE = 'journal'
+# header line; bump the version when changing the file format
+JOURNAL_MAGIC = '# synctool journal v1'
+
+STATE_FILE = 'journal.state'
+
+# the journal keeps at least this many lines of the latest generations
+MAX_LINES = 20000
+
+# labels of the trees in the journal
+TREES = ('overlay', 'delete', 'purge')
+
+# set by synctool-client --full
+FORCE_FULL = False  # type: bool
+
+# CHANGES[label] -> Changes; None when checking everything
+CHANGES = None      # type: Dict[str, Changes]
+# (journal id, generation) to record after a successful run
+PENDING = None      # type: Tuple[int, int]
+# time of the last full sweep
+LAST_FULL = 0       # type: int
+
+
+class Changes(object):
+    '''destination paths that changed in a tree'''
+
+    __slots__ = ('paths', 'dirs')
+
+    def __init__(self):
+        # type: () -> None
+        '''initialize instance'''
+
+        self.paths = set()  # type: Set[str]
+        # parent dirs of the changed paths
+        self.dirs = set()   # type: Set[str]
+
+    def add(self, path):
+        # type: (str) -> None
+        '''add changed path'''
+
+        self.paths.add(path)
+
+        while path != os.sep:
+            path = os.path.dirname(path)
+            if path in self.dirs:
+                break
+
+            self.dirs.add(path)
+
+    def changed(self, path):
+        # type: (str) -> bool
+        '''Returns True if the path itself changed'''
+
+        return path in self.paths
+
+    def wanted(self, path):
+        # type: (str) -> bool
+        '''Returns True if the path or anything below it changed'''
+
+        return path in self.paths or path in self.dirs
+
+
+def _journal_filename():
+    # type: () -> str
+    '''Returns full path of the journal'''
+
+    return os.path.join(synctool.param.INDEX_DIR, JOURNAL_FILE)
+
+
+def _state_filename():
+    # type: () -> str
+    '''Returns full path of the state file'''
+
+    return os.path.join(synctool.param.CACHE_DIR, STATE_FILE)
+
+
+def _read_journal():
+    # type: () -> Tuple[int, int, int, List[Tuple[int, str, str, str]]]
+    '''Returns tuple: journal id, generation, since, entries
+    The journal holds all changes after generation 'since'
+    entries is a list of tuples: (generation, label, group, dest path)
+    Returns None if the journal can not be read
+    '''
+
+    filename = _journal_filename()
+    try:
+        f = open(filename, 'r')
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            warning('failed to read journal %s: %s' % (filename,
+                                                      err.strerror))
+        return None
+
+    entries = []    # type: List[Tuple[int, str, str, str]]
+    with f:
+        if f.readline().rstrip('\n') != JOURNAL_MAGIC:
+            verbose('discarding journal %s: unknown format' % filename)
+            return None
+
+        try:
+            journal_id, generation, since = [
+                int(x) for x in f.readline().rstrip('\n').split('\t')]
+
+            for line in f:
+                gen, label, group, path = line.rstrip('\n').split('\t')
+                entries.append((int(gen), label, group, path))
+        except ValueError:
+            verbose('discarding journal %s: invalid line' % filename)
+            return None
+
+    return journal_id, generation, since, entries
+
+
+def record(changes):
+    # type: (List[Tuple[str, str, str]]) -> None
+    '''add a generation to the journal
+    changes is a list of tuples: (label, group, dest path)
+    A dest path of '*' means that anything in the group may have changed
+    This is done on the master node
+    '''
+
+    journal = _read_journal()
+    if journal is None:
+        # start a new journal
+        journal = (int(time.time()), 0, 0, [])
+
+    journal_id, generation, since, entries = journal
+    generation += 1
+    for label, group, path in changes:
+        entries.append((generation, label, group, path))
+
+    # drop the oldest generations, but keep the latest one
+    if len(entries) > MAX_LINES:
+        since = entries[-MAX_LINES][0] - 1
+        entries = [x for x in entries if x[0] > since]
+
+    verbose('journal generation %d: %d changes' % (generation, len(changes)))
+
+    # write to temp file and rename, so that the journal is never corrupt
+    filename = _journal_filename()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        error('failed to write journal %s: %s' % (tmp_filename, err.strerror))
+        return
+
+    with f:
+        f.write(JOURNAL_MAGIC + '\n')
+        f.write('%d\t%d\t%d\n' % (journal_id, generation, since))
+        for entry in entries:
+            f.write('%d\t%s\t%s\t%s\n' % entry)
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+
+
+def _fingerprint():
+    # type: () -> str
+    '''Returns digest of what else decides the outcome of a run:
+    the config files, the groups of this node and the synctool version
+    '''
+
+    h = hashlib.md5()
+    h.update('%s\n%s\n%s\n' % (synctool.param.VERSION,
+                               synctool.param.NODENAME,
+                               ' '.join(synctool.param.MY_GROUPS)))
+    for filename in synctool.configparser.FILES:
+        try:
+            with open(filename, 'r') as f:
+                h.update(f.read())
+        except IOError:
+            h.update('-')
+
+    return h.hexdigest()
+
+
+def _read_state():
+    # type: () -> Tuple[int, int, int, str]
+    '''Returns tuple: journal id, generation, time of last full sweep,
+    fingerprint; or None if there is no (valid) state
+    '''
+
+    try:
+        with open(_state_filename(), 'r') as f:
+            arr = f.readline().split()
+    except IOError:
+        return None
+
+    if len(arr) != 4:
+        return None
+
+    try:
+        return int(arr[0]), int(arr[1]), int(arr[2]), arr[3]
+    except ValueError:
+        return None
+
+
+def start():
+    # type: () -> None
+    '''decide whether this run checks only what changed
+    This is done on the client
+    '''
+
+    global CHANGES, PENDING, LAST_FULL
+
+    CHANGES = None
+    PENDING = None
+
+    if not synctool.param.INCREMENTAL:
+        return
+
+    journal = _read_journal()
+    if journal is None:
+        verbose('no journal, checking everything')
+        return
+
+    journal_id, generation, since, entries = journal
+    PENDING = (journal_id, generation)
+
+    if FORCE_FULL:
+        verbose('full sweep requested')
+        return
+
+    state = _read_state()
+    if state is None:
+        verbose('no previous generation, checking everything')
+        return
+
+    state_id, state_generation, LAST_FULL, fingerprint = state
+
+    if fingerprint != _fingerprint():
+        verbose('config changed, checking everything')
+        return
+
+    if (state_id != journal_id or state_generation < since or
+            state_generation > generation):
+        verbose('journal does not go back to generation %d, '
+                'checking everything' % state_generation)
+        return
+
+    if time.time() - LAST_FULL >= synctool.param.FULL_SWEEP_INTERVAL:
+        verbose('time for a full sweep')
+        return
+
+    changes = {}    # type: Dict[str, Changes]
+    for label in TREES:
+        changes[label] = Changes()
+
+    for gen, label, group, path in entries:
+        if (gen <= state_generation or label not in changes or
+                group not in synctool.param.MY_GROUPS):
+            continue
+
+        if path == '*':
+            verbose('group %s changed in an unknown way, '
+                    'checking everything' % group)
+            return
+
+        changes[label].add(path)
+
+    CHANGES = changes
+    verbose('checking what changed since generation %d (now %d)' %
+            (state_generation, generation))
+
+
+def changes(tree):
+    # type: (str) -> Changes
+    '''Returns Changes for tree (like synctool.param.OVERLAY_DIR),
+    or None if everything should be checked
+    '''
+
+    if CHANGES is None:
+        return None
+
+    for label, tree_dir in (('overlay', synctool.param.OVERLAY_DIR),
+                            ('delete', synctool.param.DELETE_DIR),
+                            ('purge', synctool.param.PURGE_DIR)):
+        if tree == tree_dir:
+            return CHANGES[label]
+
+    return None
+
+
+def finish():
+    # type: () -> None
+    '''record the generation that was applied
+    Nothing is recorded after a dry run, or when there were errors,
+    so that the same changes are checked again next time
+    '''
+
+    if (PENDING is None or synctool.lib.DRY_RUN or
+            synctool.lib.ERRORS > 0):
+        return
+
+    if CHANGES is None:
+        last_full = int(time.time())
+    else:
+        last_full = LAST_FULL
+
+    if not synctool.lib.mkdir_p(synctool.param.CACHE_DIR):
+        # error message already printed
+        return
+
+    filename = _state_filename()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        with open(tmp_filename, 'w') as f:
+            f.write('%d %d %d %s\n' % (PENDING[0], PENDING[1], last_full,
+                                       _fingerprint()))
+
+        os.rename(tmp_filename, filename)
+    except EnvironmentError as err:
+        warning('failed to write %s: %s' % (filename, err.strerror))
+
+# EOB
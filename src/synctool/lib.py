@@ -19,11 +19,12 @@ import shlex
 import syslog
 
 try:
-    from typing import List, Dict, Sequence
+    from typing import List, Dict, Set, Sequence
 except ImportError:
     pass
 
 from synctool import param
+import synctool.metrics
 
 # options (mostly) set by command-line arguments
 DRY_RUN = True      # type: bool
@@ -37,6 +38,18 @@ MASTERLOG = False   # type: bool
 # This option is pretty useless except in synctool-ssh it may be useful
 OPT_NODENAME = True # type: bool
 
+# tell the live aggregator (option --live) when nodes are done
+AGGR_STATUS = False # type: bool
+AGGR_TAG = '%synctool-aggr%'
+
+# number of commands run so far
+# A command may change any file, so synctool.pipeline discards
+# the work it did ahead of time while a command was running
+COMMANDS_RUN = 0    # type: int
+
+# number of errors reported in this run
+ERRORS = 0          # type: int
+
 MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec') # Sequence[str]
 
@@ -105,6 +118,9 @@ def error(msg):
     # type: (str) -> None
     '''print error message'''
 
+    global ERRORS
+    ERRORS += 1
+
     stderr('error: ' + msg)
 
 
@@ -119,6 +135,10 @@ def terse(code, msg):
     # type: (int, str) -> None
     '''print short message + shortened filename'''
 
+    global ERRORS
+    if code in (TERSE_ERROR, TERSE_FAIL):
+        ERRORS += 1
+
     if param.TERSE:
         # convert any path to terse path
         if msg.find(' ') >= 0:
@@ -318,10 +338,67 @@ def log(msg):
         _masterlog(msg)
 
 
-def run_with_nodename(cmd_arr, nodename):
-    # type: (List[str], str) -> int
+def output_with_nodename(line, nodename, relayed=None):
+    # type: (str, str, Set[str]) -> None
+    '''show a line of output of a node with its nodename
+    Log lines are passed on to the master's syslog
+    relayed is a set of nodenames whose output is relayed through
+    this node; their lines already carry their own nodename
+    '''
+
+    line = line.rstrip()
+
+    # if output is a log line, pass it to the master's syslog
+    if line[:15] == '%synctool-log% ':
+        if line[15:] == '--':
+            pass
+        else:
+            msg = line[15:]
+            if not (relayed and msg.split(': ', 1)[0] in relayed):
+                msg = '%s: %s' % (nodename, msg)
+
+            if MASTERLOG:
+                # relaying for the master; pass it on up
+                print '%synctool-log%', msg
+            elif not synctool.metrics.collect(msg):
+                _masterlog(msg)
+
+    elif relayed and line[:len(AGGR_TAG) + 1] == AGGR_TAG + ' ':
+        # status of relayed nodes; pass it on to the aggregator
+        print line
+
+    elif relayed and line.split(': ', 1)[0] in relayed:
+        # relayed output already has the nodename
+        print line
+
+    else:
+        # pass output on; simply use 'print' rather than 'stdout()'
+        if OPT_NODENAME:
+            print '%s: %s' % (nodename, line)
+        else:
+            # do not prepend the nodename of this node to the output
+            # if option --no-nodename was given
+            print line
+
+
+def aggr_status(status, nodenames):
+    # type: (str, List[str]) -> None
+    '''tell the live aggregator about the status of nodes
+    status is either 'pending' or 'done'
+    '''
+
+    if not AGGR_STATUS or not nodenames:
+        return
+
+    print AGGR_TAG, status, ' '.join(nodenames)
+    sys.stdout.flush()
+
+
+def run_with_nodename(cmd_arr, nodename, relayed=None):
+    # type: (List[str], str, Set[str]) -> int
     '''run command and show output with nodename
     It will run regardless of what DRY_RUN is
+    relayed is passed on to output_with_nodename()
     Returns process return code or -1 on error
     '''
 
@@ -341,22 +418,7 @@ def run_with_nodename(cmd_arr, nodename):
     f = proc.stdout
     with f:
         for line in f:
-            line = line.rstrip()
-
-            # if output is a log line, pass it to the master's syslog
-            if line[:15] == '%synctool-log% ':
-                if line[15:] == '--':
-                    pass
-                else:
-                    _masterlog('%s: %s' % (nodename, line[15:]))
-            else:
-                # pass output on; simply use 'print' rather than 'stdout()'
-                if OPT_NODENAME:
-                    print '%s: %s' % (nodename, line)
-                else:
-                    # do not prepend the nodename of this node to the output
-                    # if option --no-nodename was given
-                    print line
+            output_with_nodename(line, nodename, relayed)
 
     proc.wait()
     if proc.returncode != 0:
@@ -372,6 +434,8 @@ def shell_command(cmd):
     Returns: return code of shell command
     '''
 
+    global COMMANDS_RUN
+
     if DRY_RUN:
         not_str = 'not '
     else:
@@ -391,6 +455,8 @@ def shell_command(cmd):
 
     ret = 0
     if not DRY_RUN:
+        COMMANDS_RUN += 1
+
         sys.stdout.flush()
         sys.stderr.flush()
 
@@ -415,6 +481,9 @@ def exec_command(cmd_arr, silent=False):
     Returns: return code of execute command or -1 on error
     '''
 
+    global COMMANDS_RUN
+    COMMANDS_RUN += 1
+
     unix_out(' '.join(cmd_arr))
 
     sys.stdout.flush()
@@ -22,11 +22,19 @@ import synctool.lib
 from synctool.lib import verbose, stdout, stderr, error, warning, terse
 from synctool.lib import unix_out, prettypath
 from synctool.main.wrapper import catch_signals
+import synctool.digest
+import synctool.index
+import synctool.journal
+import synctool.metrics
 import synctool.overlay
+import synctool.pipeline
+import synctool.postqueue
+import synctool.state
 import synctool.syncstat
+import synctool.watch
 
 try:
-    from typing import List, Dict, Tuple, Callable
+    from typing import List, Dict, Set, Tuple, Callable
     from synctool.object import SyncObject
 except ImportError:
     pass
@@ -39,9 +47,13 @@ ACTION_DEFAULT = 0
 ACTION_DIFF = 1
 ACTION_ERASE_SAVED = 2
 ACTION_REFERENCE = 3
+ACTION_WATCH = 4
 
 SINGLE_FILES = []   # type: List[str]
 
+# with --watch: WATCHED['overlay'|'delete'] -> set of destination paths
+WATCHED = None      # type: Dict[str, Set[str]]
+
 
 def generate_template(obj, post_dict):
     # type: (SyncObject, Dict[str, str]) -> bool
@@ -194,7 +206,7 @@ def purge_files():
             if not os.path.isdir(purge_root):
                 continue
 
-            for path, subdirs, files in os.walk(purge_root):
+            for path, subdirs, files in synctool.index.walk(purge_root):
                 # rsync only purge dirs that actually contain files
                 # otherwise rsync --delete would wreak havoc
                 if not files:
@@ -216,8 +228,14 @@ def purge_files():
 
     cmd_rsync, opts_string = _make_rsync_purge_cmd()
 
+    # in an incremental run, only purge dirs that changed
+    changes = synctool.journal.changes(param.PURGE_DIR)
+
     # call rsync to copy the purge dirs
     for src, dest in paths:
+        if changes is not None and not changes.wanted(dest):
+            continue
+
         # trailing slash on source path is important for rsync
         src += os.sep
         dest += os.sep
@@ -331,17 +349,33 @@ def _overlay_callback(obj, pre_dict, post_dict):
     if obj.ov_type == synctool.overlay.OV_TEMPLATE:
         return generate_template(obj, post_dict), False
 
+    if WATCHED is not None:
+        WATCHED['overlay'].add(obj.dest_path)
+
     verbose('checking %s' % obj.print_src())
+    t0 = synctool.metrics.start()
     fixup = obj.check()
+    synctool.metrics.count('checked')
+
+    t1 = synctool.metrics.start()
     updated = obj.fix(fixup, pre_dict, post_dict)
+    if updated:
+        synctool.metrics.stop('fix', t1)
+        synctool.metrics.count('fixed')
+
+    synctool.metrics.object_time(obj.print_src(), t0)
     return True, updated
 
 
-def overlay_files():
-    # type: () -> None
+def overlay_files(changes=None):
+    # type: (synctool.journal.Changes) -> None
     '''run the overlay function'''
 
-    synctool.overlay.visit(param.OVERLAY_DIR, _overlay_callback)
+    synctool.pipeline.start()
+    synctool.postqueue.start()
+    synctool.overlay.visit(param.OVERLAY_DIR, _overlay_callback, changes)
+    synctool.pipeline.stop()
+    synctool.postqueue.run()
 
 
 def _delete_callback(obj, _pre_dict, post_dict):
@@ -351,6 +385,9 @@ def _delete_callback(obj, _pre_dict, post_dict):
     if obj.ov_type == synctool.overlay.OV_TEMPLATE:
         return generate_template(obj, post_dict), False
 
+    if WATCHED is not None:
+        WATCHED['delete'].add(obj.dest_path)
+
     # don't delete directories
     if obj.src_stat.is_dir():
 #       verbose('refusing to delete directory %s' % (obj.dest_path + os.sep))
@@ -365,17 +402,94 @@ def _delete_callback(obj, _pre_dict, post_dict):
     if obj.dest_stat.exists():
         vnode = obj.vnode_dest_obj()
         vnode.harddelete()
-        obj.run_script(post_dict)
+        obj.run_script(post_dict, batch=True)
         return True, True
 
     return True, False
 
 
-def delete_files():
-    # type: () -> None
+def delete_files(changes=None):
+    # type: (synctool.journal.Changes) -> None
     '''run the delete/ dir'''
 
-    synctool.overlay.visit(param.DELETE_DIR, _delete_callback)
+    synctool.postqueue.start()
+    synctool.overlay.visit(param.DELETE_DIR, _delete_callback, changes)
+    synctool.postqueue.run()
+
+
+def _watched_dirs():
+    # type: () -> Set[str]
+    '''Returns set of directories that hold the watched paths'''
+
+    dirs = set()    # type: Set[str]
+    for paths in WATCHED.values():
+        for path in paths:
+            dirs.add(os.path.dirname(path))
+    return dirs
+
+
+def _check_changed(changed):
+    # type: (Set[str]) -> None
+    '''check and fix the watched paths that changed'''
+
+    for label, func in (('overlay', overlay_files),
+                        ('delete', delete_files)):
+        changes = synctool.journal.Changes()
+        for path in changed & WATCHED[label]:
+            changes.add(path)
+
+        if changes.paths:
+            verbose('%d %s paths changed' % (len(changes.paths), label))
+            func(changes)
+
+
+def watch_files():
+    # type: () -> None
+    '''check everything, and then keep watching the destinations,
+    fixing what changes; every full_sweep_interval seconds,
+    everything is checked again. This never returns
+    '''
+
+    global WATCHED
+
+    try:
+        inotify = synctool.watch.Inotify()
+    except OSError as err:
+        error('can not watch files: %s' % err.strerror)
+        sys.exit(-1)
+
+    watching = False
+    while True:
+        WATCHED = {'overlay': set(), 'delete': set()}
+        purge_files()
+        overlay_files()
+        delete_files()
+        synctool.digest.save()
+        synctool.state.save()
+
+        inotify.watch(_watched_dirs())
+        if not watching:
+            # changes made before the watches were in place went unnoticed;
+            # check once more. Thanks to the dest_state, this is cheap
+            watching = True
+            continue
+
+        t_sweep = time.time() + param.FULL_SWEEP_INTERVAL
+        while time.time() < t_sweep:
+            try:
+                changed = inotify.wait(t_sweep - time.time())
+            except synctool.watch.Overflow:
+                warning('missed changes, checking everything')
+                break
+
+            if not changed:
+                continue
+
+            _check_changed(changed)
+            synctool.digest.save()
+            synctool.state.save()
+            # directories may have been created
+            inotify.watch(_watched_dirs())
 
 
 def _erase_saved_callback(obj, _pre_dict, post_dict):
@@ -656,7 +770,7 @@ def _diff_callback(obj, _pre_dict, post_dict):
         return generate_template(obj, post_dict), False
 
     if _match_single(obj.dest_path):
-        _exec_diff(obj.src_path, obj.dest_path)
+        _exec_diff(obj.src_data(), obj.dest_path)
 
         if not SINGLE_FILES:
             return False, False
@@ -729,7 +843,11 @@ def usage():
   -r, --ref=PATH        Show which source file synctool chooses
   -e, --erase-saved     Erase *.saved backup files
   -f, --fix             Perform updates (otherwise, do dry-run)
+      --watch           Keep running, fixing files as soon as they change
       --no-post         Do not run any .post scripts
+      --fast            Skip checksums when size and mtime match
+      --full            Check everything, even in incremental mode
+      --metrics         Report timings and counters of this run
   -N, --nodename=NODE   Force nodename
   -F, --fullpath        Show full paths instead of shortened ones
   -T, --terse           Show terse, shortened paths
@@ -753,7 +871,8 @@ def get_options():
     try:
         opts, args = getopt.getopt(sys.argv[1:], 'hc:d:1:r:efNFTvq',
                                    ['help', 'conf=', 'diff=', 'single=',
-                                    'ref=', 'erase-saved', 'fix', 'no-post',
+                                    'ref=', 'erase-saved', 'fix', 'watch',
+                                    'no-post', 'fast', 'full', 'metrics',
                                     'fullpath', 'terse', 'color', 'no-color',
                                     'masterlog', 'node=', 'nodename=',
                                     'verbose', 'quiet', 'unix', 'version'])
@@ -820,6 +939,7 @@ def get_options():
     opt_upload = False
     opt_suffix = False
     opt_fix = False
+    opt_watch = False
 
     for opt, arg in opts:
         if opt in ('-h', '--help', '-?', '-c', '--conf', '-T', '--terse',
@@ -832,10 +952,26 @@ def get_options():
             synctool.lib.DRY_RUN = False
             continue
 
+        if opt == '--watch':
+            opt_watch = True
+            continue
+
         if opt == '--no-post':
             synctool.lib.NO_POST = True
             continue
 
+        if opt == '--fast':
+            param.CHECK_MODE = 'metadata'
+            continue
+
+        if opt == '--full':
+            synctool.journal.FORCE_FULL = True
+            continue
+
+        if opt == '--metrics':
+            synctool.metrics.ENABLED = True
+            continue
+
         if opt == '--color':
             param.COLORIZE = True
             continue
@@ -926,6 +1062,12 @@ def get_options():
         usage()
         sys.exit(1)
 
+    if param.CHECK_MODE == 'metadata' and not param.SYNC_TIMES:
+        # without sync_times, the mtime of a destination says nothing
+        warning('check_mode metadata requires sync_times, '
+                'using checksums instead')
+        param.CHECK_MODE = 'checksum'
+
     # diff with fix works like single
     if opt_diff and opt_fix:
         opt_diff = False
@@ -934,6 +1076,18 @@ def get_options():
 
     option_combinations(opt_diff, opt_single, opt_reference, opt_erase_saved,
                         opt_upload, opt_suffix, opt_fix)
+
+    if opt_watch:
+        if opt_diff or opt_single or opt_reference or opt_erase_saved:
+            error('option --watch can not be combined with other actions')
+            sys.exit(1)
+
+        if not opt_fix:
+            error('option --watch requires --fix')
+            sys.exit(1)
+
+        action = ACTION_WATCH
+
     return action
 
 
@@ -1011,12 +1165,17 @@ def main():
     unix_out('')
     os.umask(077)
 
+    t_start = synctool.metrics.start()
+
     if action == ACTION_DIFF:
         diff_files()
 
     elif action == ACTION_REFERENCE:
         reference_files()
 
+    elif action == ACTION_WATCH:
+        watch_files()
+
     elif action == ACTION_ERASE_SAVED:
         if SINGLE_FILES:
             single_erase_saved()
@@ -1027,9 +1186,27 @@ def main():
         single_files()
 
     else:
+        synctool.journal.start()
+
+        t0 = synctool.metrics.start()
         purge_files()
+        synctool.metrics.stop('purge', t0)
+
+        t0 = synctool.metrics.start()
         overlay_files()
+        synctool.metrics.stop('overlay', t0)
+
+        t0 = synctool.metrics.start()
         delete_files()
+        synctool.metrics.stop('delete', t0)
+
+        synctool.journal.finish()
+
+    synctool.digest.save()
+    synctool.state.save()
+
+    synctool.metrics.stop('total', t_start)
+    synctool.metrics.emit()
 
     unix_out('# EOB')
 
@@ -16,13 +16,14 @@ import getopt
 import shlex
 
 try:
-    from typing import List
+    from typing import List, Iterator
 except ImportError:
     pass
 
 from synctool import config, param
 import synctool.aggr
 import synctool.configparser
+import synctool.evloop
 import synctool.lib
 from synctool.lib import verbose, error
 from synctool.main.wrapper import catch_signals
@@ -38,6 +39,7 @@ NODESET = synctool.nodeset.NodeSet()
 
 OPT_SKIP_RSYNC = False
 OPT_AGGREGATE = False
+OPT_LIVE = False
 MASTER_OPTS = None      # type: List[str]
 SSH_OPTIONS = None      # type: str
 OPT_MULTIPLEX = False
@@ -104,7 +106,24 @@ def run_dsh(address_list, remote_cmd_arr):
 
     REMOTE_CMD_ARR = remote_cmd_arr
 
-    synctool.parallel.do(worker_ssh, address_list)
+    synctool.lib.aggr_status('pending',
+                             [NODESET.get_nodename_from_address(x)
+                              for x in address_list])
+
+    if param.SSH_POOL:
+        synctool.multiplex.pool([(x, NODESET.get_nodename_from_address(x))
+                                 for x in address_list])
+
+    # with -N 1, commands run interactively in the worker
+    if synctool.evloop.enabled() and param.NUM_PROC > 1:
+        jobs = []
+        for addr in address_list:
+            nodename = NODESET.get_nodename_from_address(addr)
+            jobs.append(synctool.evloop.Job(nodename,
+                                            ssh_commands(addr, nodename)))
+        synctool.evloop.run(jobs)
+    else:
+        synctool.parallel.do(worker_ssh, address_list)
 
 
 def worker_ssh(addr):
@@ -122,30 +141,70 @@ def worker_ssh(addr):
     use_multiplex = synctool.multiplex.use_mux(nodename)
 
     if SYNC_IT and not (OPT_SKIP_RSYNC or nodename in param.NO_RSYNC):
-        # first, sync the script to the node using rsync
-        # REMOTE_CMD_ARR[0] is the full path to the cmd in SCRIPT_DIR
-        verbose('running rsync $SYNCTOOL/scripts/%s to node %s' %
-                (os.path.basename(REMOTE_CMD_ARR[0]), nodename))
-
-        cmd_arr = shlex.split(param.RSYNC_CMD)
-
-        # add "-e ssh_cmd" to rsync command
-        ssh_cmd_arr = shlex.split(param.SSH_CMD)
-        if use_multiplex:
-            synctool.multiplex.ssh_args(ssh_cmd_arr, nodename)
-        cmd_arr.extend(['-e', ' '.join(ssh_cmd_arr)])
-
-        # safety first; do not use --delete here
-        if '--delete' in cmd_arr:
-            cmd_arr.remove('--delete')
-        if '--delete-excluded' in cmd_arr:
-            cmd_arr.remove('--delete-excluded')
-
-        cmd_arr.append('--')
-        cmd_arr.append('%s' % REMOTE_CMD_ARR[0])
-        cmd_arr.append('%s:%s' % (addr, REMOTE_CMD_ARR[0]))
+        cmd_arr = rsync_script_cmd(addr, nodename, use_multiplex)
         synctool.lib.run_with_nodename(cmd_arr, nodename)
 
+    ssh_cmd_arr = ssh_cmd(addr, nodename, use_multiplex)
+
+    # execute ssh+remote command and show output with the nodename
+    if param.NUM_PROC <= 1:
+        # run with -N 1 : wait on prompts, flush output
+        print nodename + ': ',
+        synctool.lib.exec_command(ssh_cmd_arr)
+    else:
+        # run_with_nodename() shows the nodename, but
+        # does not expect any prompts while running the cmd
+        synctool.lib.run_with_nodename(ssh_cmd_arr, nodename)
+
+    synctool.lib.aggr_status('done', [nodename])
+
+
+def ssh_commands(addr, nodename):
+    # type: (str, str) -> Iterator[List[str]]
+    '''generate the commands to sync script and run ssh+command
+    to the node
+    '''
+
+    use_multiplex = synctool.multiplex.use_mux(nodename)
+
+    if SYNC_IT and not (OPT_SKIP_RSYNC or nodename in param.NO_RSYNC):
+        yield rsync_script_cmd(addr, nodename, use_multiplex)
+
+    yield ssh_cmd(addr, nodename, use_multiplex)
+
+
+def rsync_script_cmd(addr, nodename, use_multiplex):
+    # type: (str, str, bool) -> List[str]
+    '''Returns rsync command for syncing the script to the node'''
+
+    # REMOTE_CMD_ARR[0] is the full path to the cmd in SCRIPT_DIR
+    verbose('running rsync $SYNCTOOL/scripts/%s to node %s' %
+            (os.path.basename(REMOTE_CMD_ARR[0]), nodename))
+
+    cmd_arr = shlex.split(param.RSYNC_CMD)
+
+    # add "-e ssh_cmd" to rsync command
+    ssh_cmd_arr = shlex.split(param.SSH_CMD)
+    if use_multiplex:
+        synctool.multiplex.ssh_args(ssh_cmd_arr, nodename)
+    cmd_arr.extend(['-e', ' '.join(ssh_cmd_arr)])
+
+    # safety first; do not use --delete here
+    if '--delete' in cmd_arr:
+        cmd_arr.remove('--delete')
+    if '--delete-excluded' in cmd_arr:
+        cmd_arr.remove('--delete-excluded')
+
+    cmd_arr.append('--')
+    cmd_arr.append('%s' % REMOTE_CMD_ARR[0])
+    cmd_arr.append('%s:%s' % (addr, REMOTE_CMD_ARR[0]))
+    return cmd_arr
+
+
+def ssh_cmd(addr, nodename, use_multiplex):
+    # type: (str, str, bool) -> List[str]
+    '''Returns ssh+remote command for the node'''
+
     cmd_str = ' '.join(REMOTE_CMD_ARR)
 
     # create local copy
@@ -162,16 +221,7 @@ def worker_ssh(addr):
     ssh_cmd_arr.append('--')
     ssh_cmd_arr.append(addr)
     ssh_cmd_arr.extend(REMOTE_CMD_ARR)
-
-    # execute ssh+remote command and show output with the nodename
-    if param.NUM_PROC <= 1:
-        # run with -N 1 : wait on prompts, flush output
-        print nodename + ': ',
-        synctool.lib.exec_command(ssh_cmd_arr)
-    else:
-        # run_with_nodename() shows the nodename, but
-        # does not expect any prompts while running the cmd
-        synctool.lib.run_with_nodename(ssh_cmd_arr, nodename)
+    return ssh_cmd_arr
 
 
 def start_multiplex(address_list):
@@ -298,6 +348,7 @@ def usage():
       --unix                  Output actions as unix shell commands
   -v, --verbose               Be verbose
   -a, --aggregate             Condense output; list nodes per change
+      --live                  Show aggregated output while nodes finish
       --skip-rsync            Do not sync commands from the scripts/ dir
                               (eg. when it is on a shared filesystem)
 
@@ -309,7 +360,7 @@ def get_options():
     # type: () -> List[str]
     '''parse command-line options'''
 
-    global MASTER_OPTS, OPT_SKIP_RSYNC, OPT_AGGREGATE, SSH_OPTIONS
+    global MASTER_OPTS, OPT_SKIP_RSYNC, OPT_AGGREGATE, OPT_LIVE, SSH_OPTIONS
     global OPT_MULTIPLEX, CTL_CMD, PERSIST
 
     if len(sys.argv) <= 1:
@@ -323,7 +374,8 @@ def get_options():
                                     'options=', 'master', 'multiplex',
                                     'persist=', 'numproc=', 'zzz=',
                                     'no-nodename', 'unix', 'verbose',
-                                    'aggregate', 'skip-rsync', 'quiet'])
+                                    'aggregate', 'live', 'aggr-status',
+                                    'skip-rsync', 'quiet'])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
 #        usage()
@@ -448,6 +500,15 @@ def get_options():
             OPT_AGGREGATE = True
             continue
 
+        if opt == '--live':
+            OPT_LIVE = True
+            continue
+
+        if opt == '--aggr-status':
+            # hidden option; set by the live aggregator
+            synctool.lib.AGGR_STATUS = True
+            continue
+
         if opt == '--no-nodename':
             synctool.lib.OPT_NODENAME = False
             continue
@@ -468,6 +529,10 @@ def get_options():
             synctool.lib.QUIET = True
             continue
 
+    if OPT_LIVE and not OPT_AGGREGATE:
+        print '%s: option --live requires option --aggregate' % PROGNAME
+        sys.exit(1)
+
     if not OPT_MULTIPLEX and PERSIST is not None:
         print '%s: option --persist requires option --master' % PROGNAME
         sys.exit(1)
@@ -508,7 +573,7 @@ def main():
         sys.exit(1)
 
     if OPT_AGGREGATE:
-        if not synctool.aggr.run(MASTER_OPTS):
+        if not synctool.aggr.run(MASTER_OPTS, OPT_LIVE):
             sys.exit(-1)
 
         sys.exit(0)
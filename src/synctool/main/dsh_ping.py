@@ -16,17 +16,19 @@ import getopt
 import shlex
 
 try:
-    from typing import List
+    from typing import List, Tuple
 except ImportError:
     pass
 
 from synctool import config, param
 import synctool.aggr
+import synctool.evloop
 import synctool.lib
 from synctool.lib import verbose, error, unix_out
 from synctool.main.wrapper import catch_signals
 import synctool.nodeset
 import synctool.parallel
+import synctool.ping
 import synctool.unbuffered
 
 # hardcoded name because otherwise we get "dsh_ping.py"
@@ -35,6 +37,7 @@ PROGNAME = 'dsh-ping'
 NODESET = synctool.nodeset.NodeSet()
 
 OPT_AGGREGATE = False
+OPT_RTT = True
 
 MASTER_OPTS = []    # type: List[str]
 
@@ -43,7 +46,20 @@ def ping_nodes(address_list):
     # type: (List[str]) -> None
     '''ping nodes in parallel'''
 
-    synctool.parallel.do(ping_node, address_list)
+    # when sleeping between runs, use the ping command
+    if param.PING_ENGINE == 'probe' and param.SLEEP_TIME == 0:
+        nodes = [(NODESET.get_nodename_from_address(addr), addr)
+                 for addr in address_list]
+        synctool.ping.ping(nodes, print_probe_result)
+
+    elif synctool.evloop.enabled():
+        jobs = []
+        for addr in address_list:
+            node = NODESET.get_nodename_from_address(addr)
+            jobs.append(PingJob(node, addr))
+        synctool.evloop.run(jobs)
+    else:
+        synctool.parallel.do(ping_node, address_list)
 
 
 def ping_node(addr):
@@ -70,35 +86,55 @@ def ping_node(addr):
 
     with f:
         for line in f:
-            line = line.strip()
-
-            # argh, we have to parse output here
-            #
-            # on BSD, ping says something like:
-            # "2 packets transmitted, 0 packets received, 100.0% packet loss"
-            #
-            # on Linux, ping says something like:
-            # "2 packets transmitted, 0 received, 100.0% packet loss, " \
-            # "time 1001ms"
-
-            arr = line.split()
-            if len(arr) > 3 and (arr[1] == 'packets' and
-                                 arr[2] == 'transmitted,'):
-                try:
-                    packets_received = int(arr[3])
-                except ValueError:
-                    pass
-
+            received, done = parse_ping_output(line)
+            if received is not None:
+                packets_received = received
+            if done:
                 break
 
-            # some ping implementations say "hostname is alive"
-            # or "hostname is unreachable"
-            elif len(arr) == 3 and arr[1] == 'is':
-                if arr[2] == 'alive':
-                    packets_received = 100
+    print_ping_result(node, packets_received)
+
+
+def parse_ping_output(line):
+    # type: (str) -> Tuple[int, bool]
+    '''parse a line of output of the ping command
+    Returns tuple: (packets received or None, done?)
+    '''
+
+    line = line.strip()
+
+    # argh, we have to parse output here
+    #
+    # on BSD, ping says something like:
+    # "2 packets transmitted, 0 packets received, 100.0% packet loss"
+    #
+    # on Linux, ping says something like:
+    # "2 packets transmitted, 0 received, 100.0% packet loss, " \
+    # "time 1001ms"
+
+    arr = line.split()
+    if len(arr) > 3 and (arr[1] == 'packets' and
+                         arr[2] == 'transmitted,'):
+        try:
+            return int(arr[3]), True
+        except ValueError:
+            return None, True
+
+    # some ping implementations say "hostname is alive"
+    # or "hostname is unreachable"
+    elif len(arr) == 3 and arr[1] == 'is':
+        if arr[2] == 'alive':
+            return 100, False
 
-                elif arr[2] == 'unreachable':
-                    packets_received = -1
+        elif arr[2] == 'unreachable':
+            return -1, False
+
+    return None, False
+
+
+def print_ping_result(node, packets_received):
+    # type: (str, int) -> None
+    '''print whether the node is up'''
 
     if packets_received > 0:
         print '%s: up' % node
@@ -106,6 +142,49 @@ def ping_node(addr):
         print '%s: not responding' % node
 
 
+def print_probe_result(node, rtt):
+    # type: (str, float) -> None
+    '''print whether the node is up, with the round-trip time'''
+
+    if rtt is None:
+        print '%s: not responding' % node
+    elif OPT_RTT:
+        print '%s: up (%.3f ms)' % (node, rtt * 1000.0)
+    else:
+        print '%s: up' % node
+
+
+class PingJob(synctool.evloop.Job):
+    '''ping a single node from the event loop'''
+
+    def __init__(self, node, addr):
+        # type: (str, str) -> None
+        '''initialize instance'''
+
+        cmd_arr = shlex.split('%s %s' % (param.PING_CMD, addr))
+        super(PingJob, self).__init__(node, [cmd_arr])
+        self.packets_received = 0
+        self.done = False
+        verbose('pinging %s' % node)
+
+    def output(self, line):
+        # type: (str) -> None
+        '''parse output of the ping command'''
+
+        if self.done:
+            return
+
+        received, self.done = parse_ping_output(line)
+        if received is not None:
+            self.packets_received = received
+
+    def finish(self):
+        # type: () -> None
+        '''print the result'''
+
+        print_ping_result(self.nodename, self.packets_received)
+
+
 def check_cmd_config():
     # type: () -> None
     '''check whether the commands as given in synctool.conf actually exist'''
@@ -133,6 +212,7 @@ def usage():
   -a, --aggregate                Condense output
   -N, --numproc=NUM              Set number of concurrent procs
   -z, --zzz=NUM                  Sleep NUM seconds between each run
+      --no-rtt                   Do not show round-trip times
       --unix                     Output actions as unix shell commands
   -v, --verbose                  Be verbose
 '''
@@ -142,14 +222,14 @@ def get_options():
     # type: () -> None
     '''parse command-line options'''
 
-    global MASTER_OPTS, OPT_AGGREGATE
+    global MASTER_OPTS, OPT_AGGREGATE, OPT_RTT
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], 'hc:vn:g:x:X:aN:qp:z:',
                                    ['help', 'conf=', 'verbose', 'node=',
                                     'group=', 'exclude=', 'exclude-group=',
-                                    'aggregate', 'unix', 'quiet', 'numproc=',
-                                    'zzz='])
+                                    'aggregate', 'no-rtt', 'unix', 'quiet',
+                                    'numproc=', 'zzz='])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
 #        usage()
@@ -220,6 +300,10 @@ def get_options():
             OPT_AGGREGATE = True
             continue
 
+        if opt == '--no-rtt':
+            OPT_RTT = False
+            continue
+
         if opt == '--unix':
             synctool.lib.UNIX_CMD = True
             continue
@@ -284,6 +368,10 @@ def main():
         sys.exit(1)
 
     if OPT_AGGREGATE:
+        # round-trip times differ per node; leave them out
+        if '--no-rtt' not in MASTER_OPTS:
+            MASTER_OPTS.append('--no-rtt')
+
         if not synctool.aggr.run(MASTER_OPTS):
             sys.exit(-1)
 
@@ -19,20 +19,25 @@ import shlex
 import tempfile
 
 try:
-    from typing import List, IO
+    from typing import List, Dict, Tuple, Set, IO, Iterator
 except ImportError:
     pass
 
 from synctool import config, param
 import synctool.aggr
+import synctool.evloop
+import synctool.index
 import synctool.lib
 from synctool.lib import verbose, stdout, stderr, error, warning, terse
 from synctool.lib import prettypath
+import synctool.metrics
 import synctool.multiplex
 from synctool.main.wrapper import catch_signals
 import synctool.nodeset
 import synctool.overlay
 import synctool.parallel
+import synctool.plan
+import synctool.store
 import synctool.syncstat
 import synctool.unbuffered
 import synctool.update
@@ -45,6 +50,7 @@ NODESET = synctool.nodeset.NodeSet()
 
 OPT_SKIP_RSYNC = False
 OPT_AGGREGATE = False
+OPT_LIVE = False
 OPT_CHECK_UPDATE = False
 OPT_DOWNLOAD = False
 
@@ -53,22 +59,153 @@ MASTER_OPTS = None      # type: List[str]
 
 UPLOAD_FILE = None      # type: synctool.upload.UploadFile
 
+# destination paths given with --ref
+REF_FILES = []          # type: List[str]
+
+# when relaying, this is the nodename of the slave that runs the relay
+OPT_RELAY = None        # type: str
+# options that are passed on to a relaying slave
+RELAY_ARGS = None       # type: List[str]
+# RELAYS[slave] -> nodenames that the slave relays to
+RELAYS = {}             # type: Dict[str, List[str]]
+# RELAY_ONLY[address] -> slave nodename
+# slaves that relay, but were not selected to run synctool themselves
+RELAY_ONLY = {}         # type: Dict[str, str]
+
+# rsync filter files are shared by nodes with the same signature
+# FILTER_FILES[signature] -> filename
+FILTER_FILES = {}       # type: Dict[Tuple[bool, Tuple[str, ...]], str]
+# GROUP_DIRS[overlaydir] -> list of group dirs
+GROUP_DIRS = {}         # type: Dict[str, List[str]]
+TREE_GROUPS = None      # type: Set[str]
+# PURGE_GROUPS[group] -> whether to include it (None on error)
+PURGE_GROUPS = {}       # type: Dict[str, bool]
+
 
 def run_remote_synctool(address_list):
     # type: (List[str]) -> None
     '''run synctool on target nodes'''
 
-    synctool.parallel.do(worker_synctool, address_list)
+    address_list = plan_fanout(address_list)
+
+    if param.SSH_POOL:
+        synctool.multiplex.pool([(addr, _nodename(addr))
+                                 for addr in address_list
+                                 if _nodename(addr) != param.NODENAME])
+
+    # Note: not try/finally, as forked workers exit through here
+    make_rsync_filters(address_list)
+
+    if synctool.evloop.enabled():
+        jobs = []
+        for addr in address_list:
+            nodename = _nodename(addr)
+            jobs.append(RelayJob(nodename, synctool_commands(addr, nodename),
+                                 RELAYS.get(nodename)))
+        synctool.evloop.run(jobs)
+    else:
+        synctool.parallel.do(worker_synctool, address_list)
+
+    remove_rsync_filters()
 
 
 def worker_synctool(addr):
     # type: (str) -> None
     '''run rsync of ROOTDIR to the nodes and ssh+synctool, in parallel'''
 
-    nodename = NODESET.get_nodename_from_address(addr)
+    nodename = _nodename(addr)
+    relayed = None      # type: Set[str]
+    if nodename in RELAYS:
+        relayed = set(RELAYS[nodename])
+
+    for cmd_arr in synctool_commands(addr, nodename):
+        synctool.lib.run_with_nodename(cmd_arr, nodename, relayed)
+
+    synctool.lib.aggr_status('done', [nodename])
+
+
+class RelayJob(synctool.evloop.Job):
+    '''job for a node that may relay output of other nodes'''
+
+    def __init__(self, nodename, commands, relayed):
+        # type: (str, Iterator[List[str]], List[str]) -> None
+        '''initialize instance'''
+
+        super(RelayJob, self).__init__(nodename, commands)
+        self.relayed = None     # type: Set[str]
+        if relayed:
+            self.relayed = set(relayed)
+
+    def output(self, line):
+        # type: (str) -> None
+        '''handle a line of output'''
+
+        synctool.lib.output_with_nodename(line, self.nodename, self.relayed)
+
+
+def _nodename(addr):
+    # type: (str) -> str
+    '''Returns nodename for address'''
+
+    if addr in RELAY_ONLY:
+        return RELAY_ONLY[addr]
+
+    return NODESET.get_nodename_from_address(addr)
+
+
+def plan_fanout(address_list):
+    # type: (List[str]) -> List[str]
+    '''assign the nodes to slaves, which relay synctool to them
+    Returns list of addresses that the master runs synctool on
+    '''
+
+    if not param.FANOUT or OPT_RELAY:
+        return address_list
+
+    # the master node itself does not relay; it already runs synctool
+    # for the nodes that are not relayed
+    slaves = sorted([x for x in param.SLAVES if x != param.NODENAME])
+    if not slaves:
+        return address_list
+
+    direct = []
+    n = 0
+    for addr in address_list:
+        nodename = NODESET.get_nodename_from_address(addr)
+        if (nodename == param.NODENAME or nodename in param.SLAVES or
+                nodename in param.NO_RSYNC):
+            direct.append(addr)
+            continue
+
+        # spread the nodes evenly over the slaves
+        slave = slaves[n % len(slaves)]
+        n += 1
+        RELAYS.setdefault(slave, []).append(nodename)
+
+    # slaves that relay must be handled even if they were not selected
+    for slave in slaves:
+        if slave not in RELAYS:
+            continue
+
+        verbose('slave %s relays to %d nodes' % (slave, len(RELAYS[slave])))
+        addr = config.get_node_ipaddress(slave)
+        if addr not in direct:
+            RELAY_ONLY[addr] = slave
+            direct.append(addr)
+
+    return direct
+
+
+def synctool_commands(addr, nodename):
+    # type: (str, str) -> Iterator[List[str]]
+    '''generate the rsync and ssh+synctool commands for a node
+    Each command is yielded only after the previous one has been run
+    '''
 
     if nodename == param.NODENAME:
-        run_local_synctool()
+        # run synctool on the master node itself
+        verbose('running synctool on node %s' % nodename)
+        yield shlex.split(param.SYNCTOOL_CMD) + PASS_ARGS
         return
 
     # use ssh connection multiplexing (if possible)
@@ -83,7 +220,7 @@ def worker_synctool(addr):
     if not (OPT_SKIP_RSYNC or nodename in param.NO_RSYNC):
         verbose('running rsync $SYNCTOOL/ to node %s' % nodename)
 
-        # make rsync filter to include the correct dirs
+        # rsync filter to include the correct dirs
         tmp_filename = rsync_include_filter(nodename)
 
         cmd_arr = shlex.split(param.RSYNC_CMD)
@@ -103,44 +240,133 @@ def worker_synctool(addr):
                     param.ROOTDIR)
             sys.exit(-1)
 
-        synctool.lib.run_with_nodename(cmd_arr, nodename)
-
-        # delete temp file
-        try:
-            os.unlink(tmp_filename)
-        except OSError:
-            # silently ignore unlink error
-            pass
+        yield cmd_arr
 
-    # run 'ssh node synctool_cmd'
-    cmd_arr = ssh_cmd_arr[:]
-    cmd_arr.append('--')
-    cmd_arr.append(addr)
-    cmd_arr.extend(shlex.split(param.SYNCTOOL_CMD))
-    cmd_arr.append('--nodename=%s' % nodename)
-    cmd_arr.extend(PASS_ARGS)
+    if addr not in RELAY_ONLY:
+        # run 'ssh node synctool_cmd'
+        cmd_arr = ssh_cmd_arr[:]
+        cmd_arr.append('--')
+        cmd_arr.append(addr)
+        cmd_arr.extend(shlex.split(param.SYNCTOOL_CMD))
+        cmd_arr.append('--nodename=%s' % nodename)
+        cmd_arr.extend(PASS_ARGS)
+
+        verbose('running synctool on node %s' % nodename)
+        yield cmd_arr
+
+    if nodename in RELAYS:
+        # run 'ssh slave synctool --relay' to fan out to the nodes
+        # the slave has just received the full repository
+        cmd_arr = ssh_cmd_arr[:]
+        cmd_arr.append('--')
+        cmd_arr.append(addr)
+        cmd_arr.append(os.path.join(param.ROOTDIR, 'bin', PROGNAME))
+        cmd_arr.append('--relay=%s' % nodename)
+        cmd_arr.append('--node=%s' % ','.join(RELAYS[nodename]))
+        cmd_arr.extend(RELAY_ARGS)
 
-    verbose('running synctool on node %s' % nodename)
-    synctool.lib.run_with_nodename(cmd_arr, nodename)
+        verbose('relaying synctool through slave %s' % nodename)
+        yield cmd_arr
 
 
-def run_local_synctool():
+def print_dry_run_message():
     # type: () -> None
-    '''run synctool on the master node itself'''
+    '''print message about DRY RUN'''
+
+    if not synctool.lib.QUIET:
+        if synctool.lib.DRY_RUN:
+            stdout('DRY RUN, not doing any updates')
+            terse(synctool.lib.TERSE_DRYRUN, 'not doing any updates')
+        else:
+            stdout('--fix specified, applying changes')
+            terse(synctool.lib.TERSE_FIXING, ' applying changes')
+    else:
+        if synctool.lib.DRY_RUN:
+            verbose('DRY RUN, not doing any updates')
+        else:
+            verbose('--fix specified, applying changes')
+
+
+def reference_files(address_list):
+    # type: (List[str]) -> List[str]
+    '''show which source file synctool chooses for each node
+    This uses the plans made on the master node
+    Returns list of addresses of nodes that have to be asked themselves
+    '''
+
+    remote_list = []
+    for addr in address_list:
+        nodename = NODESET.get_nodename_from_address(addr)
+        if nodename in param.NO_RSYNC:
+            # the node has its own copy of the repository
+            remote_list.append(addr)
+            continue
+
+        plan = synctool.plan.get_plan(nodename)
+        for filename in REF_FILES:
+            src = plan.lookup(filename)
+            if src is None:
+                src = '%s is not in the overlay tree' % filename
+
+            synctool.lib.output_with_nodename(src, nodename)
+
+    return remote_list
+
+
+def _filter_signature(nodename):
+    # type: (str) -> Tuple[bool, Tuple[str, ...]]
+    '''Returns signature for the rsync filter of a node
+    Nodes with the same signature get the same filter
+    '''
+
+    # slave nodes get a copy of the entire tree
+    if nodename in param.SLAVES:
+        return True, ()
+
+    # only the groups that have a dir in the repository matter
+    tree_groups = _tree_groups()
+    groups = param.NODES.get(nodename, [])
+    return False, tuple([g for g in groups if g in tree_groups])
 
-    cmd_arr = shlex.split(param.SYNCTOOL_CMD) + PASS_ARGS
 
-    verbose('running synctool on node %s' % param.NODENAME)
-    synctool.lib.run_with_nodename(cmd_arr, param.NODENAME)
+def _tree_groups():
+    # type: () -> Set[str]
+    '''Returns set of group dirs in overlay/, delete/ and purge/'''
+
+    global TREE_GROUPS
+
+    if TREE_GROUPS is None:
+        TREE_GROUPS = set()
+        for overlaydir in (param.OVERLAY_DIR, param.DELETE_DIR,
+                           param.PURGE_DIR):
+            TREE_GROUPS.update(_group_dirs(overlaydir))
+
+    return TREE_GROUPS
+
+
+def _group_dirs(overlaydir):
+    # type: (str) -> List[str]
+    '''Returns list of group dirs under overlaydir'''
+
+    if overlaydir not in GROUP_DIRS:
+        GROUP_DIRS[overlaydir] = [g for g in os.listdir(overlaydir)
+                                  if os.path.isdir(os.path.join(overlaydir,
+                                                                g))]
+    return GROUP_DIRS[overlaydir]
 
 
 def rsync_include_filter(nodename):
     # type: (str) -> str
     '''create temp file with rsync filter rules
     Include only those dirs that apply for this node
+    Nodes that have the same groups share the same filter file
     Returns filename of the filter file
     '''
 
+    sig = _filter_signature(nodename)
+    if sig in FILTER_FILES:
+        return FILTER_FILES[sig]
+
     try:
         (fd, filename) = tempfile.mkstemp(prefix='synctool-',
                                           dir=param.TEMP_DIR)
@@ -157,28 +383,39 @@ def rsync_include_filter(nodename):
     # include $SYNCTOOL/var/ but exclude
     # the top overlay/ and delete/ dir
     with f:
-        f.write('# synctool rsync filter')
+        f.write('# synctool rsync filter\n')
 
-        # set mygroups for this nodename
-        param.NODENAME = nodename
-        param.MY_GROUPS = config.get_my_groups()
+        # set mygroups for this filter
+        # it is restored afterwards
+        is_slave, groups = sig
+        saved_groups = param.MY_GROUPS
+        param.MY_GROUPS = list(groups)
 
         # slave nodes get a copy of the entire tree
         # all other nodes use a specific rsync filter
-        if nodename not in param.SLAVES:
-            if not (_write_overlay_filter(f) and
-                    _write_delete_filter(f) and
-                    _write_purge_filter(f)):
-                # an error occurred;
-                # delete temp file and exit
-                f.close()
-                try:
-                    os.unlink(filename)
-                except OSError:
-                    # silently ignore unlink error
-                    pass
-
-                sys.exit(-1)
+        if not is_slave:
+            ok = (_write_overlay_filter(f) and
+                  _write_delete_filter(f) and
+                  _write_purge_filter(f) and
+                  _write_index_filter(f) and
+                  _write_store_filter(f))
+        else:
+            ok = True
+
+        param.MY_GROUPS = saved_groups
+
+        if not ok:
+            # an error occurred;
+            # delete temp files and exit
+            f.close()
+            try:
+                os.unlink(filename)
+            except OSError:
+                # silently ignore unlink error
+                pass
+
+            remove_rsync_filters()
+            sys.exit(-1)
 
         # Note: sbin/*.pyc is excluded to keep major differences in
         # Python versions (on master vs. client node) from clashing
@@ -186,25 +423,60 @@ def rsync_include_filter(nodename):
                 '- /lib/synctool/*.pyc\n'
                 '- /lib/synctool/pkg/*.pyc\n')
 
-    # Note: remind to delete the temp file later
+        # the cache dir holds node-local state; never sync or delete it
+        f.write('P /var/cache/\n'
+                '- /var/cache/\n')
 
+    # Note: remove_rsync_filters() deletes the temp files later
+    FILTER_FILES[sig] = filename
     return filename
 
 
+def make_rsync_filters(address_list):
+    # type: (List[str]) -> None
+    '''create the rsync filter files for all nodes in advance
+    so that the parallel workers can share them
+    '''
+
+    if OPT_SKIP_RSYNC:
+        return
+
+    for addr in address_list:
+        nodename = NODESET.get_nodename_from_address(addr)
+        if nodename == param.NODENAME or nodename in param.NO_RSYNC:
+            continue
+
+        rsync_include_filter(nodename)
+
+    verbose('using %d distinct rsync filters' % len(FILTER_FILES))
+
+
+def remove_rsync_filters():
+    # type: () -> None
+    '''delete the rsync filter temp files'''
+
+    for filename in FILTER_FILES.values():
+        try:
+            os.unlink(filename)
+        except OSError:
+            # silently ignore unlink error
+            pass
+
+    FILTER_FILES.clear()
+
+
 def _write_rsync_filter(f, overlaydir, label):
     # type: (IO, str, str) -> None
     '''helper function for writing rsync filter'''
 
     f.write('+ /var/%s/\n' % label)
 
-    groups = os.listdir(overlaydir)
+    groups = _group_dirs(overlaydir)
 
     # add only the group dirs that apply
     for g in param.MY_GROUPS:
         if g in groups:
-            d = os.path.join(overlaydir, g)
-            if os.path.isdir(d):
-                f.write('+ /var/%s/%s/\n' % (label, g))
+            f.write('+ /var/%s/%s/\n' % (label, g))
 
     f.write('- /var/%s/*\n' % label)
 
@@ -237,34 +509,118 @@ def _write_purge_filter(f):
 
     f.write('+ /var/purge/\n')
 
-    purge_groups = os.listdir(param.PURGE_DIR)
+    purge_groups = _group_dirs(param.PURGE_DIR)
 
     # add only the group dirs that apply
     for g in param.MY_GROUPS:
         if g in purge_groups:
-            purge_root = os.path.join(param.PURGE_DIR, g)
-            if not os.path.isdir(purge_root):
-                continue
+            include = _check_purge_group(g)
+            if include is None:
+                return False
 
-            for path, _, files in os.walk(purge_root):
-                if path == purge_root:
-                    # guard against user mistakes;
-                    # danger of destroying the entire filesystem
-                    # if it would rsync --delete the root
-                    if files:
-                        warning('cowardly refusing to purge the root '
-                                'directory')
-                        stderr('please remove any files directly '
-                               'under %s/' % prettypath(purge_root))
-                        return False
-                else:
-                    f.write('+ /var/purge/%s/' % g)
-                    break
+            if include:
+                f.write('+ /var/purge/%s/\n' % g)
 
     f.write('- /var/purge/*\n')
     return True
 
 
+def _check_purge_group(g):
+    # type: (str) -> bool
+    '''Returns True if the purge group dir has any subdirs to purge,
+    False if not, or None on error
+    The outcome is remembered, so it is checked only once per group
+    '''
+
+    if g in PURGE_GROUPS:
+        return PURGE_GROUPS[g]
+
+    include = False
+    purge_root = os.path.join(param.PURGE_DIR, g)
+    for path, _, files in os.walk(purge_root):
+        if path == purge_root:
+            # guard against user mistakes;
+            # danger of destroying the entire filesystem
+            # if it would rsync --delete the root
+            if files:
+                warning('cowardly refusing to purge the root '
+                        'directory')
+                stderr('please remove any files directly '
+                       'under %s/' % prettypath(purge_root))
+                include = None
+                break
+        else:
+            include = True
+            break
+
+    PURGE_GROUPS[g] = include
+    return include
+
+
+def _write_index_filter(f):
+    # type: (IO) -> bool
+    '''write rsync filter rules for index/ dir
+    Returns False on error
+    '''
+
+    f.write('+ /var/index/\n')
+
+    # add only the index files that apply
+    for label, overlaydir in (('overlay', param.OVERLAY_DIR),
+                              ('delete', param.DELETE_DIR),
+                              ('purge', param.PURGE_DIR)):
+        groups = _group_dirs(overlaydir)
+        for g in param.MY_GROUPS:
+            if g in groups:
+                f.write('+ /var/index/%s.%s\n' % (label, g))
+
+    # the journal lists the changes for all groups
+    f.write('+ /var/index/journal\n')
+    f.write('- /var/index/*\n')
+    return True
+
+
+def _write_store_filter(f):
+    # type: (IO) -> bool
+    '''write rsync filter rules for store/ and manifest/ dirs
+    Files that are in the manifests are transferred as objects
+    in the store, rather than as part of the overlay tree
+    Returns False on error
+    '''
+
+    if not param.DEDUP_TRANSFER:
+        f.write('- /var/manifest/\n'
+                '- /var/store/\n')
+        return True
+
+    f.write('+ /var/manifest/\n')
+
+    digests = set()     # type: Set[str]
+    for g in param.MY_GROUPS:
+        files = synctool.store.manifest(g)
+        if not files:
+            continue
+
+        f.write('+ /var/manifest/%s\n' % g)
+        for relpath in sorted(files.keys()):
+            f.write('- /var/overlay/%s/%s\n' % (g, relpath))
+            digests.add(files[relpath][1])
+
+    f.write('- /var/manifest/*\n')
+
+    # add only the objects that apply
+    f.write('+ /var/store/\n')
+    for subdir in sorted(set([d[:2] for d in digests])):
+        f.write('+ /var/store/%s/\n' % subdir)
+
+    for digest in sorted(digests):
+        f.write('+ /var/store/%s/%s\n' % (digest[:2], digest))
+
+    f.write('- /var/store/*/*\n'
+            '- /var/store/*\n')
+    return True
+
+
 def make_tempdir():
     # type: () -> None
     '''create temporary directory (for storing rsync filter files)'''
@@ -432,6 +788,9 @@ def usage():
   -p, --purge=GROUP           Upload file or directory to $purge/group/
   -e, --erase-saved           Erase *.saved backup files
       --no-post               Do not run any .post scripts
+      --fast                  Skip checksums when size and mtime match
+      --full                  Check everything, even in incremental mode
+      --metrics               Report timings and counters of the nodes
   -N, --numproc=NUM           Number of concurrent procs
   -F, --fullpath              Show full paths instead of shortened ones
   -T, --terse                 Show terse, shortened paths
@@ -445,6 +804,7 @@ def usage():
   -v, --verbose               Be verbose
   -q, --quiet                 Suppress informational startup messages
   -a, --aggregate             Condense output; list nodes per change
+      --live                  Show aggregated output while nodes finish
   -f, --fix                   Perform updates (otherwise, do dry-run)
 
 Note that synctool does a dry run unless you specify --fix
@@ -456,9 +816,9 @@ def get_options():
     # type: () -> None
     '''parse command-line options'''
 
-    global PASS_ARGS, OPT_SKIP_RSYNC, OPT_AGGREGATE
+    global PASS_ARGS, OPT_SKIP_RSYNC, OPT_AGGREGATE, OPT_LIVE
     global OPT_CHECK_UPDATE, OPT_DOWNLOAD, MASTER_OPTS
-    global UPLOAD_FILE
+    global UPLOAD_FILE, OPT_RELAY, RELAY_ARGS
 
     # check for typo's on the command-line;
     # things like "-diff" will trigger "-f" => "--fix"
@@ -471,11 +831,12 @@ def get_options():
                                     'group=', 'exclude=', 'exclude-group=',
                                     'diff=', 'single=', 'ref=', 'upload=',
                                     'suffix=', 'overlay=', 'purge=',
-                                    'erase-saved', 'fix', 'no-post',
-                                    'numproc=', 'fullpath', 'terse', 'color',
-                                    'no-color', 'quiet', 'aggregate', 'unix',
-                                    'skip-rsync', 'version', 'check-update',
-                                    'download'])
+                                    'erase-saved', 'fix', 'no-post', 'fast',
+                                    'full', 'metrics', 'numproc=', 'fullpath',
+                                    'terse', 'color', 'no-color', 'quiet',
+                                    'aggregate', 'live', 'aggr-status',
+                                    'unix', 'skip-rsync', 'version',
+                                    'check-update', 'download', 'relay='])
     except getopt.GetoptError as reason:
         print '%s: %s' % (PROGNAME, reason)
 #        usage()
@@ -593,6 +954,17 @@ def get_options():
 
         if opt in ('-r', '--ref'):
             opt_reference = True
+            filename = synctool.lib.strip_path(arg)
+            if not filename:
+                error('missing filename')
+                sys.exit(1)
+
+            if filename[0] != '/':
+                error('filename must be a full path, starting with a slash')
+                sys.exit(1)
+
+            if filename not in REF_FILES:
+                REF_FILES.append(filename)
 
         if opt in ('-u', '--upload'):
             opt_upload = True
@@ -627,6 +999,10 @@ def get_options():
         if opt == '--no-post':
             synctool.lib.NO_POST = True
 
+        if opt == '--metrics':
+            # collect metrics from the nodes
+            synctool.metrics.ENABLED = True
+
         if opt in ('-N', '--numproc'):
             try:
                 param.NUM_PROC = int(arg)
@@ -658,6 +1034,15 @@ def get_options():
             OPT_AGGREGATE = True
             continue
 
+        if opt == '--live':
+            OPT_LIVE = True
+            continue
+
+        if opt == '--aggr-status':
+            # hidden option; set by the live aggregator
+            synctool.lib.AGGR_STATUS = True
+            continue
+
         if opt == '--unix':
             synctool.lib.UNIX_CMD = True
 
@@ -673,6 +1058,10 @@ def get_options():
             OPT_DOWNLOAD = True
             continue
 
+        if opt == '--relay':
+            OPT_RELAY = arg
+            continue
+
         if opt:
             PASS_ARGS.append(opt)
 
@@ -706,6 +1095,19 @@ def get_options():
             print 'option --suffix and --purge can not be combined'
             sys.exit(1)
 
+    if OPT_LIVE and not OPT_AGGREGATE:
+        print 'option --live must be used in conjunction with --aggregate'
+        sys.exit(1)
+
+    # a relaying slave gets the same options as the nodes
+    RELAY_ARGS = PASS_ARGS[:]
+    RELAY_ARGS.append('--numproc=%d' % param.NUM_PROC)
+    if OPT_SKIP_RSYNC:
+        RELAY_ARGS.append('--skip-rsync')
+    if synctool.lib.AGGR_STATUS:
+        # the slave reports when the relayed nodes are done
+        RELAY_ARGS.append('--aggr-status')
+
     # enable logging at the master node
     PASS_ARGS.append('--masterlog')
 
@@ -748,17 +1150,30 @@ def main():
         sys.exit(0)
 
     if OPT_AGGREGATE:
-        if not synctool.aggr.run(MASTER_OPTS):
+        if not synctool.aggr.run(MASTER_OPTS, OPT_LIVE):
             sys.exit(-1)
 
         sys.exit(0)
 
-    config.init_mynodename()
+    if OPT_RELAY:
+        # relay for the master; this runs on a slave node
+        param.NODENAME = OPT_RELAY
+        param.MY_GROUPS = config.get_my_groups()
 
-    if param.MASTER != param.HOSTNAME:
-        verbose('master %s != hostname %s' % (param.MASTER, param.HOSTNAME))
-        error('not running on the master node')
-        sys.exit(-1)
+        if param.NODENAME not in param.SLAVES:
+            error('%s is not a slave node' % param.NODENAME)
+            sys.exit(-1)
+
+        # pass log lines on up to the master
+        synctool.lib.MASTERLOG = True
+    else:
+        config.init_mynodename()
+
+        if param.MASTER != param.HOSTNAME:
+            verbose('master %s != hostname %s' % (param.MASTER,
+                                                  param.HOSTNAME))
+            error('not running on the master node')
+            sys.exit(-1)
 
     if not _check_valid_overlaydirs():
         # error message already printed
@@ -785,21 +1200,35 @@ def main():
     else:
         # do regular synctool run
         # first print message about DRY RUN
-        if not synctool.lib.QUIET:
-            if synctool.lib.DRY_RUN:
-                stdout('DRY RUN, not doing any updates')
-                terse(synctool.lib.TERSE_DRYRUN, 'not doing any updates')
-            else:
-                stdout('--fix specified, applying changes')
-                terse(synctool.lib.TERSE_FIXING, ' applying changes')
-        else:
-            if synctool.lib.DRY_RUN:
-                verbose('DRY RUN, not doing any updates')
-            else:
-                verbose('--fix specified, applying changes')
-
-        make_tempdir()
-        run_remote_synctool(address_list)
+        # (when relaying, the master already did so)
+        if not OPT_RELAY:
+            print_dry_run_message()
+
+        # when relaying, the index came along with the repository
+        if param.OVERLAY_INDEX and not OPT_RELAY:
+            synctool.index.update()
+            if param.DEDUP_TRANSFER:
+                synctool.store.update()
+
+        if REF_FILES:
+            # answer from the plans rather than asking every node
+            address_list = reference_files(address_list)
+
+        if address_list:
+            make_tempdir()
+
+            # when relaying, the metrics are passed on to the master
+            if synctool.metrics.ENABLED and not OPT_RELAY:
+                synctool.metrics.make_collect_dir()
+
+            # when relaying, the master already knows what is pending
+            if not OPT_RELAY:
+                synctool.lib.aggr_status('pending',
+                                         [NODESET.get_nodename_from_address(x)
+                                          for x in address_list])
+
+            run_remote_synctool(address_list)
+            synctool.metrics.report()
 
     synctool.lib.closelog()
 
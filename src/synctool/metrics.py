@@ -0,0 +1,340 @@
+#
+#   synctool.metrics.py    WJ131
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''run metrics: timers and counters
+
+With option --metrics, synctool-client measures how long each phase
+takes and counts what it does. At the end of the run it sends a summary
+in JSON to the master, through the same channel as the log messages.
+The master collects the summaries of all nodes and prints a report.
+'''
+
+import os
+import sys
+import time
+import json
+import tempfile
+import threading
+
+try:
+    from typing import List, Dict, Tuple, Any
+except ImportError:
+    pass
+
+import synctool.lib
+import synctool.param
+
+ENABLED = False
+
+# tag for the summary line, after the '%synctool-log%' prefix
+METRICS_TAG = 'metrics'
+
+# TIMERS[name] -> [count, seconds]
+TIMERS = {}         # type: Dict[str, List]
+# COUNTERS[name] -> value
+COUNTERS = {}       # type: Dict[str, int]
+# OBJECTS[source path] -> seconds spent checking and fixing
+OBJECTS = {}        # type: Dict[str, float]
+# SCRIPTS[script] -> [times run, seconds]
+SCRIPTS = {}        # type: Dict[str, List]
+
+# the timers and counters may be updated by worker threads
+# (see synctool.pipeline)
+LOCK = threading.Lock()
+
+# number of slowest objects and nodes that are reported
+TOP_N = 10
+
+# the master collects the summaries of the nodes in this dir
+COLLECT_DIR = None  # type: str
+
+# description of the timers and counters, in order of reporting
+TIMER_NAMES = (('total', 'total run time'),
+               ('purge', 'purge phase'),
+               ('overlay', 'overlay phase'),
+               ('delete', 'delete phase'),
+               ('stat', 'stat'),
+               ('checksum', 'checksum'),
+               ('fix', 'fix (including scripts)'),
+               ('script', '.pre/.post scripts'))
+
+COUNTER_NAMES = (('checked', 'files checked'),
+                 ('hashed', 'files hashed'),
+                 ('verified', 'files known unchanged'),
+                 ('bytes_read', 'bytes read'),
+                 ('fixed', 'fixes applied'))
+
+
+def start():
+    # type: () -> float
+    '''Returns start time for a timer'''
+
+    if not ENABLED:
+        return 0.0
+
+    return time.time()
+
+
+def stop(name, t0):
+    # type: (str, float) -> float
+    '''add time since t0 to timer
+    Returns the elapsed time
+    '''
+
+    if not ENABLED:
+        return 0.0
+
+    elapsed = time.time() - t0
+    with LOCK:
+        try:
+            timer = TIMERS[name]
+        except KeyError:
+            TIMERS[name] = [1, elapsed]
+        else:
+            timer[0] += 1
+            timer[1] += elapsed
+
+    return elapsed
+
+
+def count(name, value=1):
+    # type: (str, int) -> None
+    '''add value to counter'''
+
+    if not ENABLED:
+        return
+
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def object_time(path, t0):
+    # type: (str, float) -> None
+    '''register time spent on a source path since t0'''
+
+    if not ENABLED:
+        return
+
+    OBJECTS[path] = OBJECTS.get(path, 0.0) + time.time() - t0
+
+
+def script_time(script, elapsed):
+    # type: (str, float) -> None
+    '''register time that a .post script took'''
+
+    if not ENABLED:
+        return
+
+    entry = SCRIPTS.setdefault(script, [0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed
+
+
+def summary():
+    # type: () -> Dict[str, Any]
+    '''Returns summary of the metrics of this run'''
+
+    slowest = sorted(OBJECTS.items(), key=lambda x: x[1], reverse=True)
+    scripts = sorted([(x[0], x[1][0], x[1][1]) for x in SCRIPTS.items()],
+                     key=lambda x: x[2], reverse=True)
+    return {'node': synctool.param.NODENAME,
+            'timers': TIMERS,
+            'counters': COUNTERS,
+            'objects': slowest[:TOP_N],
+            'scripts': scripts[:TOP_N]}
+
+
+def emit():
+    # type: () -> None
+    '''output the summary
+    When running under the master, it is sent as a log line
+    '''
+
+    if not ENABLED:
+        return
+
+    if synctool.lib.MASTERLOG:
+        print '%synctool-log%', METRICS_TAG, json.dumps(summary(),
+                                                        sort_keys=True)
+    else:
+        _print_report([summary()])
+
+
+def collect(msg):
+    # type: (str) -> bool
+    '''collect summary from a log message "nodename: metrics {...}"
+    This is done on the master node
+    Returns False if the message is not a summary
+    '''
+
+    arr = msg.split(': ', 1)
+    if len(arr) != 2:
+        return False
+
+    nodename, line = arr
+    arr = line.split(' ', 1)
+    if len(arr) != 2 or arr[0] != METRICS_TAG:
+        return False
+
+    if COLLECT_DIR is None:
+        # not collecting; drop it
+        return True
+
+    # Note: this may run in a forked worker,
+    # so the summary is passed through the filesystem
+    filename = os.path.join(COLLECT_DIR, os.path.basename(nodename))
+    try:
+        with open(filename, 'w') as f:
+            f.write(arr[1] + '\n')
+    except IOError as err:
+        synctool.lib.error('failed to write %s: %s' % (filename,
+                                                       err.strerror))
+    return True
+
+
+def make_collect_dir():
+    # type: () -> None
+    '''create temp dir for collecting the summaries of the nodes'''
+
+    global COLLECT_DIR
+
+    try:
+        COLLECT_DIR = tempfile.mkdtemp(prefix='synctool-metrics-',
+                                       dir=synctool.param.TEMP_DIR)
+    except OSError as err:
+        synctool.lib.error('failed to create temp dir: %s' % err.strerror)
+        sys.exit(-1)
+
+
+def report():
+    # type: () -> None
+    '''print report of the collected summaries,
+    and clean up the collect dir
+    '''
+
+    global COLLECT_DIR
+
+    if COLLECT_DIR is None:
+        return
+
+    summaries = []
+    for entry in sorted(os.listdir(COLLECT_DIR)):
+        filename = os.path.join(COLLECT_DIR, entry)
+        try:
+            with open(filename) as f:
+                summaries.append(json.loads(f.read()))
+        except (IOError, ValueError) as err:
+            synctool.lib.warning('invalid metrics for node %s: %s' %
+                                 (entry, err))
+
+        try:
+            os.unlink(filename)
+        except OSError:
+            # silently ignore unlink error
+            pass
+
+    try:
+        os.rmdir(COLLECT_DIR)
+    except OSError:
+        # silently ignore error
+        pass
+
+    COLLECT_DIR = None
+
+    if not summaries:
+        print 'no metrics were collected'
+        return
+
+    _print_report(summaries)
+
+
+def _print_report(summaries):
+    # type: (List[Dict[str, Any]]) -> None
+    '''print report for summaries of one or more nodes'''
+
+    # Note: the report has no colons, so that it passes through
+    # the aggregator (option --aggregate) unchanged
+
+    def _total(summary, name):
+        # type: (Dict[str, Any], str) -> float
+        '''Returns seconds for timer, or 0.0'''
+
+        return summary['timers'].get(name, [0, 0.0])[1]
+
+    if len(summaries) > 1:
+        print 'metrics for %d nodes' % len(summaries)
+    else:
+        print 'metrics for node %s' % summaries[0]['node']
+
+    print 'run times'
+    for name, descr in TIMER_NAMES:
+        times = [(_total(x, name), x['node']) for x in summaries
+                 if name in x['timers']]
+        if not times:
+            continue
+
+        if len(summaries) > 1:
+            secs, node = max(times)
+            print '  %-26s %10.3fs  (slowest %s %.3fs)' % (
+                descr, sum([t[0] for t in times]), node, secs)
+        else:
+            print '  %-26s %10.3fs' % (descr, times[0][0])
+
+    print 'counters'
+    for name, descr in COUNTER_NAMES:
+        value = sum([x['counters'].get(name, 0) for x in summaries])
+        print '  %-26s %10d' % (descr, value)
+
+    if len(summaries) > 1:
+        print 'slowest nodes'
+        nodes = sorted(summaries, key=lambda x: _total(x, 'total'),
+                       reverse=True)
+        for x in nodes[:TOP_N]:
+            print '  %-26s %10.3fs' % (x['node'], _total(x, 'total'))
+
+    # sum the time spent per path over all nodes
+    paths = {}  # type: Dict[str, List]
+    for x in summaries:
+        for path, secs in x['objects']:
+            entry = paths.setdefault(path, [0.0, 0])
+            entry[0] += secs
+            entry[1] += 1
+
+    if paths:
+        print 'slowest paths'
+        slowest = sorted(paths.items(), key=lambda x: x[1][0], reverse=True)
+        for path, (secs, num_nodes) in slowest[:TOP_N]:
+            if len(summaries) > 1:
+                print '  %10.3fs  %s  (%d nodes)' % (secs, path, num_nodes)
+            else:
+                print '  %10.3fs  %s' % (secs, path)
+
+    # sum the time spent per script over all nodes
+    scripts = {}    # type: Dict[str, List]
+    for x in summaries:
+        # older clients do not report scripts
+        for script, times_run, secs in x.get('scripts', []):
+            entry = scripts.setdefault(script, [0.0, 0, 0])
+            entry[0] += secs
+            entry[1] += times_run
+            entry[2] += 1
+
+    if scripts:
+        print 'slowest scripts'
+        slowest = sorted(scripts.items(), key=lambda x: x[1][0],
+                         reverse=True)
+        for script, (secs, times_run, num_nodes) in slowest[:TOP_N]:
+            if len(summaries) > 1:
+                print '  %10.3fs  %s  (%d runs, %d nodes)' % (
+                    secs, script, times_run, num_nodes)
+            else:
+                print '  %10.3fs  %s  (%d runs)' % (secs, script, times_run)
+
+# EOB
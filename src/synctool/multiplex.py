@@ -8,12 +8,21 @@
 #   License.
 #
 
-'''multiplexing ssh connections'''
+'''multiplexing ssh connections
+
+Master connections are started by hand with "dsh --multiplex", or
+automatically for every run of synctool and dsh with "ssh_pool yes"
+(see pool()). Either way, they stay around until they have been idle
+for ssh_control_persist, and the rsync and ssh commands to a node
+use its master connection for as long as it exists.
+'''
 
 import os
 import re
+import time
 import shlex
 import subprocess
+import collections
 
 try:
     from typing import List, Tuple, Pattern
@@ -28,6 +37,9 @@ import synctool.syncstat
 SSH_VERSION = None      # type: int
 MATCH_SSH_VERSION = re.compile(r'^OpenSSH\_(\d+)\.(\d+)')   # type: Pattern
 
+# seconds between checking whether ssh commands have finished
+POLL_INTERVAL = 0.05
+
 
 def _make_control_path(nodename):
     # type: (str) -> str
@@ -98,18 +110,29 @@ def control(nodename, remote_addr, ctl_cmd):
 
     verbose('sending control command %s to %s' % (ctl_cmd, nodename))
 
+    cmd_arr = _control_cmd(control_path, remote_addr, ctl_cmd)
+    exitcode = synctool.lib.exec_command(cmd_arr, silent=True)
+    return exitcode == 0
+
+
+def _control_cmd(control_path, remote_addr, ctl_cmd, timeout=None):
+    # type: (str, str, str, int) -> List[str]
+    '''Returns command to send ctl_cmd to the ssh mux process
+    timeout is the ssh ConnectTimeout in seconds, if any
+    '''
+
     cmd_arr = shlex.split(synctool.param.SSH_CMD)
     cmd_arr.extend(['-N', '-n',
                     '-O', ctl_cmd,
                     '-o', 'ControlPath=' + control_path])
+    if timeout is not None:
+        cmd_arr.extend(['-o', 'ConnectTimeout=%d' % timeout])
 
     # if VERBOSE: don't care about ssh -v options here
 
     cmd_arr.append('--')
     cmd_arr.append(remote_addr)
-
-    exitcode = synctool.lib.exec_command(cmd_arr, silent=True)
-    return exitcode == 0
+    return cmd_arr
 
 
 def ssh_args(ssh_cmd_arr, nodename):
@@ -217,6 +240,136 @@ in another terminal
     return errors == 0
 
 
+def pool(node_list):
+    # type: (List[Tuple[str, str]]) -> None
+    '''make sure that there are master connections to the nodes,
+    so that all commands of this run share them
+    node_list is a list of pairs: (addr, nodename)
+    Master connections that already exist are checked, all at once;
+    missing ones are opened, all at once
+    Nodes that can not be connected to within ssh_pool_timeout are
+    left alone; their commands simply do not use multiplexing
+    '''
+
+    persist = synctool.param.CONTROL_PERSIST
+    if persist == 'none':
+        # without ControlPersist, ssh -M does not go to the background
+        verbose('ssh_pool requires ssh_control_persist')
+        return
+
+    if detect_ssh() < 56:
+        verbose('ssh_pool requires OpenSSH 5.6 or later')
+        return
+
+    timeout = synctool.param.SSH_POOL_TIMEOUT
+
+    check_list = []     # type: List[Tuple[str, str]]
+    open_list = []      # type: List[Tuple[str, str]]
+    for addr, nodename in node_list:
+        control_path = _make_control_path(nodename)
+        if not control_path:
+            # error message already printed
+            return
+
+        if not os.path.lexists(control_path):
+            open_list.append((addr, control_path))
+        elif use_mux(nodename):
+            check_list.append((addr, control_path))
+        # else: warning already printed
+
+    if check_list:
+        verbose('checking %d ssh master connections' % len(check_list))
+        exitcodes = _run_all([_control_cmd(control_path, addr, 'check',
+                                           timeout)
+                              for addr, control_path in check_list])
+        for (addr, control_path), exitcode in zip(check_list, exitcodes):
+            if exitcode == 0:
+                continue
+
+            # the master is gone, but left its socket behind
+            verbose('removing stale control path %s' % control_path)
+            try:
+                os.unlink(control_path)
+            except OSError as err:
+                warning('failed to remove %s: %s' % (control_path,
+                                                     err.strerror))
+                continue
+
+            open_list.append((addr, control_path))
+
+    if not open_list:
+        return
+
+    # the masters go to the background after logging in,
+    # and exit after being idle for the ControlPersist time
+    ssh_cmd_arr = shlex.split(synctool.param.SSH_CMD)
+    ssh_cmd_arr.extend(['-M', '-N', '-n',
+                        '-o', 'BatchMode=yes',
+                        '-o', 'ConnectTimeout=%d' % timeout,
+                        '-o', 'ControlPersist=' + persist])
+
+    verbose('opening %d ssh master connections' % len(open_list))
+    cmds = []
+    for addr, control_path in open_list:
+        cmd_arr = ssh_cmd_arr[:]
+        cmd_arr.extend(['-o', 'ControlPath=' + control_path, '--', addr])
+        cmds.append(cmd_arr)
+
+    exitcodes = _run_all(cmds)
+    for (addr, control_path), exitcode in zip(open_list, exitcodes):
+        if exitcode != 0:
+            verbose('failed to open ssh master connection to %s' % addr)
+
+
+def _run_all(cmds):
+    # type: (List[List[str]]) -> List[int]
+    '''run the commands at the same time, at most NUM_PROC at once
+    A new command is started as soon as any other one finishes, so that
+    a slow node does not hold up the others
+    Output is discarded; ssh masters that go to the background must not
+    hold on to our stdout, or whoever reads it would never see the end
+    Returns list of exit codes; -1 if a command could not be run
+    '''
+
+    exitcodes = [-1] * len(cmds)
+    pending = collections.deque(xrange(len(cmds)))
+    running = []    # type: List[Tuple[int, subprocess.Popen]]
+    num_proc = max(1, synctool.param.NUM_PROC)
+
+    devnull = open(os.devnull, 'r+')
+    try:
+        while pending or running:
+            while pending and len(running) < num_proc:
+                i = pending.popleft()
+                unix_out(' '.join(cmds[i]))
+                try:
+                    proc = subprocess.Popen(cmds[i], shell=False,
+                                            stdin=devnull, stdout=devnull,
+                                            stderr=devnull)
+                except OSError as err:
+                    error('failed to execute %s: %s' % (cmds[i][0],
+                                                        err.strerror))
+                    continue
+
+                running.append((i, proc))
+
+            still_running = []
+            for i, proc in running:
+                exitcode = proc.poll()
+                if exitcode is None:
+                    still_running.append((i, proc))
+                else:
+                    exitcodes[i] = exitcode
+
+            if len(still_running) == len(running):
+                time.sleep(POLL_INTERVAL)
+            running = still_running
+    finally:
+        devnull.close()
+
+    return exitcodes
+
+
 def detect_ssh():
     # type: () -> int
     '''detect ssh version
@@ -12,30 +12,50 @@
 
 import os
 import stat
+import mmap
+import errno
 import datetime
-import shutil
 import hashlib
+import itertools
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 import synctool.lib
 from synctool.lib import verbose, stdout, error, terse, unix_out, log
 from synctool.lib import dryrun_msg, prettypath, TERSE_FAIL, print_timestamp
+import synctool.digest
+import synctool.fastcopy
+import synctool.metrics
 import synctool.param
+import synctool.postqueue
+import synctool.state
 import synctool.syncstat
 
 try:
-    from typing import Dict
+    from typing import Dict, Tuple, Set, Iterator, IO, Any
     import posix
     SyncStat = synctool.syncstat.SyncStat
 except ImportError:
     pass
 
-# size for doing I/O while checksumming files
-IO_SIZE = 16 * 1024
+# size of blocks when comparing or checksumming files
+BLOCK_SIZE = 1024 * 1024
+
+# names of the checksums, for messages
+CHECKSUM_NAMES = {'md5': 'MD5', 'sha256': 'SHA256', 'xxhash': 'xxHash'}
+
+# temp files that were written while comparing, and not installed yet
+STAGED = set()      # type: Set[str]
 
 
 class VNode(object):
     '''base class for doing actions with directory entries'''
 
+    __slots__ = ('name', 'stat', 'exists')
+
     def __init__(self, filename, statbuf, exists):
         # type: (str, SyncStat, bool) -> None
         '''filename is typically destination path
@@ -213,12 +233,18 @@ class VNode(object):
 class VNodeFile(VNode):
     '''vnode for a regular file'''
 
+    __slots__ = ('src_path', 'staged', 'compared')
+
     def __init__(self, filename, statbuf, exists, src_path):
         # type: (str, SyncStat, bool, str) -> None
         '''initialize instance'''
 
         super(VNodeFile, self).__init__(filename, statbuf, exists)
         self.src_path = src_path
+        # temp file that already holds the new contents
+        self.staged = None  # type: str
+        # outcome of comparing the contents in advance (see SyncObject)
+        self.compared = None    # type: Tuple[str, int, str]
 
     def typename(self):
         # type: () -> str
@@ -241,68 +267,162 @@ class VNodeFile(VNode):
             unix_out('# updating file %s' % self.name)
             return False
 
-        return self._compare_checksums(src_path)
+        if _quick_match(self.stat, dest_stat):
+            return True
 
-    def _compare_checksums(self, src_path):
-        # type: (str) -> bool
-        '''compare checksum of src_path and dest: self.name
+        if self.compared is not None:
+            # it was compared in advance
+            method, offset, self.staged = self.compared
+            return self._report_difference(method, offset)
+
+        t0 = synctool.metrics.start()
+        same = self._compare_contents(src_path, dest_stat)
+        synctool.metrics.stop('checksum', t0)
+        return same
+
+    def _compare_contents(self, src_path, dest_stat):
+        # type: (str, SyncStat) -> bool
+        '''compare contents of src_path and dest: self.name
+        When fixing, the new contents may be written to the temp file
+        along the way (see compare_contents())
         Return True if the same'''
 
+        if synctool.lib.DRY_RUN:
+            tmp_name = None
+        else:
+            tmp_name = _temp_name(self.name)
+
         try:
-            f1 = open(src_path, 'rb')
-        except IOError as err:
-            error('failed to open %s : %s' % (src_path, err.strerror))
-            # return True because we can't fix an error in src_path
-            return True
+            method, offset, self.staged = compare_contents(src_path,
+                                                           self.stat,
+                                                           self.name,
+                                                           dest_stat,
+                                                           tmp_name)
+        except EnvironmentError as err:
+            if err.filename == src_path:
+                error('failed to read %s: %s' % (src_path, err.strerror))
+                # return True because we can't fix an error in src_path
+                return True
+
+            error('failed to compare %s: %s' % (self.name, err.strerror))
+            return False
 
-        sum1 = hashlib.md5()
-        sum2 = hashlib.md5()
+        return self._report_difference(method, offset)
 
-        with f1:
-            try:
-                f2 = open(self.name, 'rb')
-            except IOError as err:
-                error('failed to open %s : %s' % (self.name, err.strerror))
-                return False
-
-            with f2:
-                ended = False
-                while not ended and (sum1.digest() == sum2.digest()):
-                    try:
-                        data1 = f1.read(IO_SIZE)
-                    except IOError as err:
-                        error('failed to read file %s: %s' % (src_path,
-                                                              err.strerror))
-                        return False
+    def _report_difference(self, method, offset):
+        # type: (str, int) -> bool
+        '''report the outcome of compare_contents()
+        Return True if the same'''
 
-                    if not data1:
-                        ended = True
-                    else:
-                        sum1.update(data1)
+        if offset == -1:
+            return True
 
-                    try:
-                        data2 = f2.read(IO_SIZE)
-                    except IOError as err:
-                        error('failed to read file %s: %s' % (self.name,
-                                                              err.strerror))
-                        return False
+        if method == 'bytes':
+            verbose('%s differs at offset %d' % (self.name, offset))
 
-                    if not data2:
-                        ended = True
-                    else:
-                        sum2.update(data2)
+        self._report_mismatch(method)
+        return False
 
-        if sum1.digest() != sum2.digest():
-            if synctool.lib.DRY_RUN:
-                stdout('%s mismatch (MD5 checksum)' % self.name)
+    def _report_mismatch(self, method):
+        # type: (str) -> None
+        '''print message that the file is different
+        method is the compare method that found the difference
+        '''
+
+        if method == 'bytes':
+            what = 'contents'
+        else:
+            what = CHECKSUM_NAMES[method]
+
+        if synctool.lib.DRY_RUN:
+            if method == 'bytes':
+                stdout('%s mismatch (%s)' % (self.name, what))
             else:
-                stdout('%s updated (MD5 mismatch)' % self.name)
+                stdout('%s mismatch (%s checksum)' % (self.name, what))
+        else:
+            stdout('%s updated (%s mismatch)' % (self.name, what))
 
-            unix_out('# updating file %s' % self.name)
-            terse(synctool.lib.TERSE_SYNC, self.name)
-            return False
+        unix_out('# updating file %s' % self.name)
+        terse(synctool.lib.TERSE_SYNC, self.name)
 
-        return True
+    def fix(self):
+        # type: () -> None
+        '''repair the existing entry
+        The file is installed atomically: it is copied to a temp file
+        in the same directory, which gets the owner and permissions of
+        the source, and then the temp file is renamed into place
+        So the destination is never missing nor incomplete
+        '''
+
+        if self.exists and synctool.param.BACKUP_COPIES:
+            self.link_saved()
+
+        self.mkdir_basepath()
+
+        if not self.exists:
+            terse(synctool.lib.TERSE_NEW, self.name)
+
+        dest = self.name
+        if self.staged is not None:
+            # copied already while comparing
+            tmp_name = self.staged
+            STAGED.discard(tmp_name)
+        else:
+            tmp_name = _temp_name(dest)
+
+        verbose(dryrun_msg('  copy %s %s' % (self.src_path, tmp_name)))
+        unix_out('cp %s %s' % (self.src_path, tmp_name))
+        if self.staged is None and not self._copy(tmp_name):
+            return
+
+        # set the metadata on the temp file
+        self.name = tmp_name
+        self.set_owner()
+        self.set_permissions()
+        if synctool.param.SYNC_TIMES:
+            self.set_times()
+        self.name = dest
+
+        verbose(dryrun_msg('  os.rename(%s, %s)' % (tmp_name, dest)))
+        unix_out('mv %s %s' % (tmp_name, dest))
+        if not synctool.lib.DRY_RUN:
+            try:
+                os.rename(tmp_name, dest)
+            except OSError as err:
+                error('failed to rename %s to %s : %s' % (tmp_name, dest,
+                                                          err.strerror))
+                terse(TERSE_FAIL, dest)
+                _remove_temp(tmp_name)
+
+    def link_saved(self):
+        # type: () -> None
+        '''keep existing file as .saved
+        The file is hard linked, so that it stays in place until
+        the new file replaces it
+        '''
+
+        # do not save files that already are .saved
+        _, ext = os.path.splitext(self.name)
+        if ext == '.saved':
+            return
+
+        if synctool.lib.DRY_RUN:
+            # no difference with moving it
+            self.move_saved()
+            return
+
+        saved = '%s.saved' % self.name
+        verbose('saving %s as %s' % (self.name, saved))
+        unix_out('ln -f %s %s' % (self.name, saved))
+        try:
+            if synctool.lib.path_exists(saved):
+                os.unlink(saved)
+            os.link(self.name, saved)
+        except OSError as err:
+            # eg. it is a directory, or hard links are not supported
+            verbose('  os.link(%s, %s) failed: %s' % (self.name, saved,
+                                                      err.strerror))
+            self.move_saved()
 
     def create(self):
         # type: () -> None
@@ -313,20 +433,307 @@ class VNodeFile(VNode):
 
         verbose(dryrun_msg('  copy %s %s' % (self.src_path, self.name)))
         unix_out('cp %s %s' % (self.src_path, self.name))
-        if not synctool.lib.DRY_RUN:
-            try:
-                # copy file
-                shutil.copy(self.src_path, self.name)
-            except (OSError, IOError) as err:
-                error('failed to copy %s to %s: %s' %
-                      (prettypath(self.src_path), self.name, err.strerror))
-                terse(TERSE_FAIL, self.name)
+        self._copy(self.name)
+
+    def _copy(self, dest):
+        # type: (str) -> bool
+        '''copy source file to new file dest
+        Returns False on error
+        '''
+
+        if synctool.lib.DRY_RUN:
+            return True
+
+        _remove_temp(dest)
+        try:
+            synctool.fastcopy.copy(self.src_path, dest)
+        except (OSError, IOError) as err:
+            error('failed to copy %s to %s: %s' %
+                  (prettypath(self.src_path), self.name, err.strerror))
+            terse(TERSE_FAIL, self.name)
+            _remove_temp(dest)
+            return False
+
+        return True
 
 
+def _quick_match(src_stat, dest_stat):
+    # type: (SyncStat, SyncStat) -> bool
+    '''quick check like rsync does: same size and mtime means same file
+    This is only trustworthy when synctool manages the timestamps
+    '''
+
+    return (synctool.param.CHECK_MODE == 'metadata' and
+            synctool.param.SYNC_TIMES and
+            src_stat.size == dest_stat.size and
+            src_stat.mtime == dest_stat.mtime)
+
+
+def compare_contents(src_path, src_stat, dest_path, dest_stat,
+                     tmp_name=None):
+    # type: (str, SyncStat, str, SyncStat, str) -> Tuple[str, int, str]
+    '''compare the contents of two files of the same size
+    It prints nothing, so that it may run in a worker thread
+    If tmp_name is given, and the files are compared byte by byte and
+    differ, the source is written to new file tmp_name along the way,
+    so that it is read only once
+    Returns tuple: compare method, offset of the first difference,
+    and tmp_name if it was written, else None
+    The offset is -1 if the files are the same, and 0 if a checksum differs
+    It raises EnvironmentError on error
+    '''
+
+    # files that did not change since they were last found the same
+    # need not be read at all
+    if synctool.state.verified(src_path, src_stat, dest_path, dest_stat):
+        return 'state', -1, None
+
+    method, offset, staged = _compare_data(src_path, src_stat,
+                                           dest_path, dest_stat, tmp_name)
+    if offset == -1:
+        synctool.state.store(src_path, src_stat, dest_path, dest_stat)
+
+    return method, offset, staged
+
+
+def _compare_data(src_path, src_stat, dest_path, dest_stat, tmp_name=None):
+    # type: (str, SyncStat, str, SyncStat, str) -> Tuple[str, int, str]
+    '''compare the contents of two files of the same size
+    Returns tuple: compare method, offset of the first difference,
+    staged temp file (see compare_contents())
+    It raises EnvironmentError on error
+    '''
+
+    method = synctool.param.COMPARE_METHOD
+
+    if synctool.param.DIGEST_CACHE != 'none':
+        # a known digest of the source saves reading it
+        digest1 = synctool.digest.known(src_path, src_stat)
+        if digest1 is not None or method != 'bytes':
+            if digest1 is None:
+                digest1 = synctool.digest.checksum(src_path, src_stat)
+
+            if synctool.param.DIGEST_CACHE == 'all':
+                digest2 = synctool.digest.checksum(dest_path, dest_stat)
+            else:
+                digest2 = synctool.digest.compute(dest_path)
+
+            if digest1 != digest2:
+                return 'md5', 0, None
+
+            return 'md5', -1, None
+
+    with open(src_path, 'rb') as f1:
+        with open(dest_path, 'rb') as f2:
+            if method == 'bytes':
+                if synctool.param.DIGEST_CACHE == 'none':
+                    offset, staged = _first_difference(f1, f2, None,
+                                                       tmp_name)
+                    return method, offset, staged
+
+                # checksum the source while comparing,
+                # so that the digest cache knows it next time
+                md5 = hashlib.md5()
+                offset, staged = _first_difference(f1, f2, md5, tmp_name)
+                # when staged, all of the source went through md5
+                if offset == -1 or staged is not None:
+                    digest = md5.hexdigest()
+                    synctool.digest.store(src_path, src_stat, digest)
+                    if offset == -1 and synctool.param.DIGEST_CACHE == 'all':
+                        synctool.digest.store(dest_path, dest_stat, digest)
+                return method, offset, staged
+
+            # hash each file as a whole, and compare only the outcome
+            digest1 = _checksum(f1, method)
+            digest2 = _checksum(f2, method)
+
+    synctool.metrics.count('hashed', 2)
+    if digest1 != digest2:
+        return method, 0, None
+
+    return method, -1, None
+
+
+def _new_checksum(method):
+    # type: (str) -> Any
+    '''Returns new checksum object for compare method'''
+
+    if method == 'sha256':
+        return hashlib.sha256()
+
+    if method == 'xxhash':
+        return xxhash.xxh64()
+
+    return hashlib.md5()
+
+
+def _checksum(f, method):
+    # type: (IO, str) -> str
+    '''Returns digest of the contents of file f'''
+
+    checksum = _new_checksum(method)
+    for data in _blocks(f):
+        checksum.update(data)
+
+    return checksum.digest()
+
+
+def _blocks(f):
+    # type: (IO) -> Iterator[str]
+    '''generate the contents of file f in blocks
+    The file is memory mapped if possible
+    '''
+
+    try:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+        # eg. an empty file; read it instead
+        m = None
+
+    if m is None:
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if not data:
+                break
+
+            synctool.metrics.count('bytes_read', len(data))
+            yield data
+        return
+
+    try:
+        for offset in xrange(0, len(m), BLOCK_SIZE):
+            data = m[offset:offset + BLOCK_SIZE]
+            synctool.metrics.count('bytes_read', len(data))
+            yield data
+    finally:
+        m.close()
+
+
+def _first_difference(f1, f2, md5=None, tmp_name=None):
+    # type: (IO, IO, Any, str) -> Tuple[int, str]
+    '''compare the contents of two files block by block
+    If md5 is given, it is updated with the contents of f1 that were read
+    If tmp_name is given and the files differ, the rest of f1 is read
+    as well, and all of f1 is written to new file tmp_name
+    Returns tuple: offset of the first byte that differs, or -1 if the same;
+    and tmp_name if it was written, else None
+    '''
+
+    blocks1 = _blocks(f1)
+    offset = 0
+    for data1, data2 in itertools.izip_longest(blocks1, _blocks(f2),
+                                               fillvalue=''):
+        if md5 is not None:
+            md5.update(data1)
+
+        if data1 != data2:
+            staged = None
+            if tmp_name is not None:
+                staged = _stage(f1, offset, data1, blocks1, md5, tmp_name)
+            return offset + _mismatch(data1, data2), staged
+
+        offset += len(data1)
+
+    return -1, None
+
+
+def _stage(f, size, data, blocks, md5, tmp_name):
+    # type: (IO, int, str, Iterator[str], Any, str) -> str
+    '''write the contents of file f to new file tmp_name
+    The first size bytes of f were compared already, and data is the
+    block that was read last; blocks generates the rest of f, which is
+    added to md5 (if given)
+    Returns tmp_name, or None on error
+    '''
+
+    _remove_temp(tmp_name)
+    try:
+        fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    except OSError:
+        # fix() will try again, and report the error
+        return None
+
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            # the part that was compared is still in the page cache
+            pos = f.tell()
+            f.seek(0)
+            while size > 0:
+                chunk = f.read(min(size, BLOCK_SIZE))
+                if not chunk:
+                    # the file shrunk
+                    raise IOError(errno.EIO, os.strerror(errno.EIO))
+
+                out.write(chunk)
+                size -= len(chunk)
+            f.seek(pos)
+
+            out.write(data)
+            for data in blocks:
+                if md5 is not None:
+                    md5.update(data)
+                out.write(data)
+    except EnvironmentError:
+        _remove_temp(tmp_name)
+        return None
+
+    STAGED.add(tmp_name)
+    return tmp_name
+
+
+def remove_staged():
+    # type: () -> None
+    '''delete temp files that were written while comparing,
+    but that were not installed
+    '''
+
+    for tmp_name in list(STAGED):
+        _remove_temp(tmp_name)
+
+    STAGED.clear()
+
+
+def _mismatch(data1, data2):
+    # type: (str, str) -> int
+    '''Returns index of the first byte that differs'''
+
+    n = min(len(data1), len(data2))
+
+    # find the page, then the byte
+    i = 0
+    while i < n and data1[i:i + 4096] == data2[i:i + 4096]:
+        i += 4096
+
+    while i < n and data1[i] == data2[i]:
+        i += 1
+
+    return i
+
+
+def _temp_name(path):
+    # type: (str) -> str
+    '''Returns name for temp file next to path'''
+
+    return os.path.join(os.path.dirname(path), '.%s.synctool-%d' %
+                        (os.path.basename(path), os.getpid()))
+
+
+def _remove_temp(filename):
+    # type: (str) -> None
+    '''delete temp file, if any'''
+
+    try:
+        os.unlink(filename)
+    except OSError:
+        # silently ignore unlink error
+        pass
+
 
 class VNodeDir(VNode):
     '''vnode for a directory'''
 
+    __slots__ = ()
+
 #    def __init__(self, filename, statbuf, exists):
 #        # type: (str, SyncStat, bool) -> None
 #        '''initialize instance'''
@@ -408,6 +815,8 @@ class VNodeDir(VNode):
 class VNodeLink(VNode):
     '''vnode for a symbolic link'''
 
+    __slots__ = ('oldpath',)
+
     def __init__(self, filename, statbuf, exists, oldpath):
         # type: (str, SyncStat, bool, str) -> None
         '''initialize instance'''
@@ -512,6 +921,8 @@ class VNodeLink(VNode):
 class VNodeFifo(VNode):
     '''vnode for a fifo'''
 
+    __slots__ = ()
+
 #    def __init__(self, filename, statbuf, exists):
 #        # type: (str, SyncStat, bool) -> None
 #        '''initialize instance'''
@@ -544,6 +955,8 @@ class VNodeFifo(VNode):
 class VNodeChrDev(VNode):
     '''vnode for a character device file'''
 
+    __slots__ = ('src_stat',)
+
     def __init__(self, filename, syncstat_obj, exists, src_stat):
         # type: (str, SyncStat, bool, posix.stat_result) -> None
         '''initialize instance'''
@@ -614,6 +1027,8 @@ class VNodeChrDev(VNode):
 class VNodeBlkDev(VNode):
     '''vnode for a block device file'''
 
+    __slots__ = ('src_stat',)
+
     def __init__(self, filename, syncstat_obj, exists, src_stat):
         # type: (str, SyncStat, bool, posix.stat_result) -> None
         '''initialize instance'''
@@ -683,6 +1098,12 @@ class SyncObject(object):
     The SyncObject caches any stat info
     '''
 
+    # there is a SyncObject for every entry in the overlay tree;
+    # slots take a lot less memory than a __dict__ per instance
+    __slots__ = ('src_path', 'dest_path', 'ov_type', 'src_stat',
+                 'dest_stat', 'data_path', 'staged', 'compared',
+                 'fix_action')
+
     FIX_UNDEF = 0
     FIX_CREATE = 1
     FIX_TYPE = 2
@@ -705,16 +1126,72 @@ class SyncObject(object):
         self.dest_path = dest_name
         self.ov_type = ov_type
         self.src_stat = self.dest_stat = None   # type: SyncStat
+        # path to read the contents from, if not src_path
+        # (see synctool.store)
+        self.data_path = None                   # type: str
+        # temp file with the new contents, made while checking
+        self.staged = None                      # type: str
+        # outcome of compare_ahead()
+        self.compared = None                    # type: Tuple[str, int, str]
         self.fix_action = SyncObject.FIX_UNDEF
 
-    def make(self, src_dir, dest_dir):
-        # type: (str, str) -> None
-        '''make() fills in the full paths and stat structures'''
+    def make(self, src_dir, dest_dir, listing=None):
+        # type: (str, str, synctool.syncstat.DirListing) -> None
+        '''make() fills in the full paths and stat structures
+        listing is the DirListing of dest_dir, if any
+        '''
 
         self.src_path = os.path.join(src_dir, self.src_path)
-        self.src_stat = synctool.syncstat.SyncStat(self.src_path)
         self.dest_path = os.path.join(dest_dir, self.dest_path)
-        self.dest_stat = synctool.syncstat.SyncStat(self.dest_path)
+        self.restat(listing)
+
+    def restat(self, listing=None):
+        # type: (synctool.syncstat.DirListing) -> None
+        '''(re)load the stat structures'''
+
+        t0 = synctool.metrics.start()
+        self.src_stat = synctool.syncstat.SyncStat(self.src_path)
+        self.data_path = None
+        if listing is None:
+            self.dest_stat = synctool.syncstat.SyncStat(self.dest_path)
+        else:
+            self.dest_stat = listing.stat(self.dest_path)
+        if self.compared is not None and self.compared[2] is not None:
+            # the destination may have changed; compare again
+            _remove_temp(self.compared[2])
+            STAGED.discard(self.compared[2])
+        self.compared = None
+        synctool.metrics.stop('stat', t0)
+
+    def compare_ahead(self):
+        # type: () -> None
+        '''compare the contents of source and destination in advance
+        This runs in a worker thread (see synctool.pipeline), so it
+        prints nothing; check() reports the outcome later
+        '''
+
+        if not (self.src_stat.is_file() and self.dest_stat.is_file()):
+            return
+
+        if (self.src_stat.size != self.dest_stat.size or
+                _quick_match(self.src_stat, self.dest_stat)):
+            # check() does not need the contents
+            return
+
+        if synctool.lib.DRY_RUN:
+            tmp_name = None
+        else:
+            tmp_name = _temp_name(self.dest_path)
+
+        t0 = synctool.metrics.start()
+        try:
+            self.compared = compare_contents(self.src_path, self.src_stat,
+                                             self.dest_path, self.dest_stat,
+                                             tmp_name)
+        except EnvironmentError:
+            # check() will compare again, and report the error
+            pass
+        synctool.metrics.stop('checksum', t0)
 
     def print_src(self):
         # type: () -> str
@@ -725,6 +1202,15 @@ class SyncObject(object):
 
         return prettypath(self.src_path)
 
+    def src_data(self):
+        # type: () -> str
+        '''Returns path to read the contents of the source from'''
+
+        if self.data_path is not None:
+            return self.data_path
+
+        return self.src_path
+
     def __repr__(self):
         # type: () -> str
         '''return string representation'''
@@ -757,9 +1243,15 @@ class SyncObject(object):
             return SyncObject.FIX_TYPE
 
         vnode = self.vnode_obj()
-        if not vnode.compare(self.src_path, self.dest_stat):
+        is_file = isinstance(vnode, VNodeFile)
+        if is_file:
+            vnode.compared = self.compared
+        self.compared = None
+        if not vnode.compare(self.src_data(), self.dest_stat):
             # content is different; change the entire object
             log('updating %s' % self.dest_path)
+            if is_file:
+                self.staged = vnode.staged
             return SyncObject.FIX_UPDATE
 
         # check ownership and permissions and time
@@ -815,6 +1307,11 @@ class SyncObject(object):
             return False
 
         vnode = self.vnode_obj()
+        if isinstance(vnode, VNodeFile):
+            vnode.staged = self.staged
+        self.staged = None
+
+        errors = synctool.lib.ERRORS
 
         # Note that .post scripts are not run for owner/mode/time changes
 
@@ -856,16 +1353,26 @@ class SyncObject(object):
             vnode.stat.atime = self.dest_stat.atime
             vnode.set_times()
 
+        # remember the installed file, so that it need not be read again
+        # This is before the .post script runs; if the script changes
+        # the file, it will be compared again next time
+        if self.src_stat.is_file() and synctool.lib.ERRORS == errors:
+            synctool.state.installed(self.src_data(), self.src_stat,
+                                     self.dest_path)
+
         # run .post script, if needed
         # Note: for dirs, it is run from overlay._walk_subtree()
         if need_run and not self.src_stat.is_dir():
-            self.run_script(post_dict)
+            self.run_script(post_dict, batch=True)
 
         return True
 
-    def run_script(self, scripts_dict):
-        # type: (Dict[str, str]) -> None
-        '''run a .pre/.post script, if any'''
+    def run_script(self, scripts_dict, batch=False):
+        # type: (Dict[str, str], bool) -> None
+        '''run a .pre/.post script, if any
+        If batch is True, the script may be queued to run later
+        (see synctool.postqueue)
+        '''
 
         if synctool.lib.NO_POST:
             return
@@ -875,19 +1382,26 @@ class SyncObject(object):
 
         script = scripts_dict[self.dest_path]
 
-        # temporarily restore original umask
-        # so the script runs with the umask set by the sysadmin
-        os.umask(synctool.param.ORIG_UMASK)
-
         if self.dest_stat.is_dir():
             # run in the directory itself
-            synctool.lib.run_command_in_dir(self.dest_path, script)
+            cwd = self.dest_path
         else:
             # run in the directory where the file is
-            synctool.lib.run_command_in_dir(os.path.dirname(self.dest_path),
-                                            script)
+            cwd = os.path.dirname(self.dest_path)
+
+        if batch and synctool.postqueue.add(script, cwd):
+            return
+
+        t0 = synctool.metrics.start()
+
+        # temporarily restore original umask
+        # so the script runs with the umask set by the sysadmin
+        os.umask(synctool.param.ORIG_UMASK)
+        synctool.lib.run_command_in_dir(cwd, script)
         os.umask(077)
 
+        synctool.metrics.stop('script', t0)
+
     def vnode_obj(self):
         # type: () -> VNode
         '''create vnode object for this SyncObject'''
@@ -896,7 +1410,7 @@ class SyncObject(object):
 
         if self.src_stat.is_file():
             return VNodeFile(self.dest_path, self.src_stat, exists,
-                             self.src_path)
+                             self.src_data())
 
         if self.src_stat.is_dir():
             return VNodeDir(self.dest_path, self.src_stat, exists)
@@ -42,11 +42,16 @@ try:
 except ImportError:
     pass
 
+import synctool.index
+import synctool.journal
 import synctool.lib
 from synctool.lib import verbose, warning, terse, prettypath
 import synctool.object
 from synctool.object import SyncObject
 import synctool.param
+import synctool.pipeline
+import synctool.store
+import synctool.syncstat
 
 # const enum object types
 OV_REG = 0
@@ -95,44 +100,87 @@ def _group_all():
     return len(synctool.param.MY_GROUPS) - 1
 
 
-def _split_extension(filename, src_dir):
-    # type: (str, str) -> Tuple[SyncObject, int]
+def parse_extension(filename):
+    # type: (str) -> Tuple[str, int, str]
     '''filename in the overlay tree, without leading path
-    src_dir is passed for the purpose of printing error messages
-    Returns tuple: SyncObject, importance
+    Returns tuple: destination name, ov_type, group
+    group is None for generic entries
     '''
 
     (name, ext) = os.path.splitext(filename)
     if not ext:
-        return SyncObject(filename, name, OV_NO_EXT), _group_all()
+        return name, OV_NO_EXT, None
 
     if ext == '.pre':
         # it's a generic .pre script
-        return SyncObject(filename, name, OV_PRE), _group_all()
+        return name, OV_PRE, None
 
     if ext == '.post':
         (name2, ext) = os.path.splitext(name)
         if ext == '._template':
             # it's a generic template generator
-            return SyncObject(filename, name, OV_TEMPLATE_POST), _group_all()
+            return name, OV_TEMPLATE_POST, None
 
         # it's a generic .post script
-        return SyncObject(filename, name, OV_POST), _group_all()
+        return name, OV_POST, None
 
     if ext[:2] != '._':
-        return SyncObject(filename, filename, OV_NO_EXT), _group_all()
+        return filename, OV_NO_EXT, None
 
     ext = ext[2:]
     if not ext:
-        return SyncObject(filename, filename, OV_NO_EXT), _group_all()
+        return filename, OV_NO_EXT, None
 
     if ext == 'template':
-        return SyncObject(filename, name, OV_TEMPLATE), _group_all()
+        return name, OV_TEMPLATE, None
+
+    group = ext
+    (name2, ext) = os.path.splitext(name)
+
+    if ext == '.pre':
+        # group-specific .pre script
+        return name2, OV_PRE, group
+
+    elif ext == '.post':
+        _, ext = os.path.splitext(name2)
+        if ext == '._template':
+            # it's a group-specific template generator
+            return name2, OV_TEMPLATE_POST, group
+
+        # group-specific .post script
+        return name2, OV_POST, group
+
+    elif ext == '._template':
+        return name2, OV_TEMPLATE, group
+
+    return name, OV_REG, group
+
+
+def _split_extension(filename, src_dir):
+    # type: (str, str) -> Tuple[SyncObject, int]
+    '''filename in the overlay tree, without leading path
+    src_dir is passed for the purpose of printing error messages
+    Returns tuple: SyncObject, importance
+    '''
+
+    dest_name, ov_type, group = parse_extension(filename)
+    return _make_object(filename, dest_name, ov_type, group, src_dir)
+
+
+def _make_object(filename, dest_name, ov_type, group, src_dir):
+    # type: (str, str, int, str, str) -> Tuple[SyncObject, int]
+    '''make SyncObject for parsed filename
+    src_dir is passed for the purpose of printing error messages
+    Returns tuple: SyncObject, importance
+    '''
+
+    if group is None:
+        return SyncObject(filename, dest_name, ov_type), _group_all()
 
     try:
-        importance = synctool.param.MY_GROUPS.index(ext)
+        importance = synctool.param.MY_GROUPS.index(group)
     except ValueError:
-        if ext not in synctool.param.ALL_GROUPS:
+        if group not in synctool.param.ALL_GROUPS:
             src_path = os.path.join(src_dir, filename)
             if synctool.param.TERSE:
                 terse(synctool.lib.TERSE_ERROR, ('invalid group on %s' %
@@ -146,25 +194,7 @@ def _split_extension(filename, src_dir):
                 prettypath(os.path.join(src_dir, filename)))
         return None, -1
 
-    (name2, ext) = os.path.splitext(name)
-
-    if ext == '.pre':
-        # register group-specific .pre script
-        return SyncObject(filename, name2, OV_PRE), importance
-
-    elif ext == '.post':
-        _, ext = os.path.splitext(name2)
-        if ext == '._template':
-            # it's a group-specific template generator
-            return (SyncObject(filename, name2, OV_TEMPLATE_POST), importance)
-
-        # register group-specific .post script
-        return SyncObject(filename, name2, OV_POST), importance
-
-    elif ext == '._template':
-        return SyncObject(filename, name2, OV_TEMPLATE), importance
-
-    return SyncObject(filename, name), importance
+    return SyncObject(filename, dest_name, ov_type), importance
 
 
 def _sort_by_importance_post_first(item1, item2):
@@ -217,17 +247,70 @@ def _sort_by_importance_post_first(item1, item2):
     return cmp(importance1, importance2)
 
 
-def _walk_subtree(src_dir, dest_dir, duplicates, callback):
-    # type: (str, str, Set[str], Callable[[SyncObject, Dict[str, str], Dict[str, str]], Tuple[bool, bool]]) -> Tuple[bool, bool]
+def _check_ahead(arr, dest_dir, duplicates):
+    # type: (List[Tuple[SyncObject, int]], str, Set[str]) -> List[Tuple[SyncObject, bool]]
+    '''select the entries whose contents may be compared ahead of time
+    Returns list of tuples: SyncObject, compare contents
+    '''
+
+    entries = []    # type: List[Tuple[SyncObject, bool]]
+    seen = set()    # type: Set[str]
+    for obj, _ in arr:
+        # only the most important source for a destination is compared
+        dest_path = os.path.join(dest_dir, obj.dest_path)
+        compare = ((obj.ov_type == OV_REG or
+                    (obj.ov_type == OV_NO_EXT and
+                     not synctool.param.REQUIRE_EXTENSION)) and
+                   dest_path not in duplicates and dest_path not in seen)
+        if compare:
+            seen.add(dest_path)
+
+        entries.append((obj, compare))
+
+    return entries
+
+
+def _wanted(obj, dest_dir, changes):
+    # type: (SyncObject, str, synctool.journal.Changes) -> bool
+    '''Returns True if the entry should be looked at in this run'''
+
+    if changes is None:
+        return True
+
+    # scripts are needed for whatever else changed in this dir
+    if obj.ov_type in (OV_PRE, OV_POST, OV_TEMPLATE_POST):
+        return True
+
+    return changes.wanted(os.path.join(dest_dir, obj.dest_path))
+
+
+def _walk_subtree(src_dir, dest_dir, duplicates, callback, dest_exists=True,
+                  changes=None, sources_only=False):
+    # type: (str, str, Set[str], Callable[[SyncObject, Dict[str, str], Dict[str, str]], Tuple[bool, bool]], bool, synctool.journal.Changes, bool) -> Tuple[bool, bool]
     '''walk subtree under overlay/group/
     duplicates is a set that keeps us from selecting any duplicate matches
+    dest_exists is False if dest_dir did not exist before it was checked
+    changes are the destination paths to look at, or None for all
+    If sources_only is True, the destinations are not looked at;
+    they all appear to be missing
     Returns pair of booleans: ok, dir was updated
     '''
 
 #    verbose('_walk_subtree(%s)' % src_dir)
 
+    # use the index made by the master node, if possible
+    indexed = synctool.index.listdir(src_dir)
+    if indexed is None:
+        entries = os.listdir(src_dir)
+        # files that came through the store are not in the dir itself
+        stored = synctool.store.listdir(src_dir)
+        if stored:
+            entries = list(set(entries) | set(stored))
+    else:
+        entries = indexed.keys()
+
     arr = []
-    for entry in os.listdir(src_dir):
+    for entry in entries:
         if entry in synctool.param.IGNORE_FILES:
             verbose('ignoring %s' % prettypath(os.path.join(src_dir, entry)))
             continue
@@ -245,10 +328,18 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
         if wildcard_match:
             continue
 
-        obj, importance = _split_extension(entry, src_dir)
+        if indexed is None:
+            obj, importance = _split_extension(entry, src_dir)
+        else:
+            dest_name, ov_type, group, _ = indexed[entry]
+            obj, importance = _make_object(entry, dest_name, ov_type, group,
+                                           src_dir)
         if not obj:
             continue
 
+        if not _wanted(obj, dest_dir, changes):
+            continue
+
         arr.append((obj, importance))
 
     # sort with .pre and .post scripts first
@@ -259,8 +350,27 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
     post_dict = {}      # type: Dict[str, str]
     dir_changed = False
 
+    # saves stat() calls for entries that are missing from dest_dir
+    listing = synctool.syncstat.DirListing(dest_dir,
+                                           dest_exists and not sources_only)
+
+    # with check_workers, the entries are stat-ed and compared
+    # in worker threads, ahead of the loop below
+    jobs = None
+    if synctool.pipeline.QUEUE is not None and not sources_only:
+        jobs = synctool.pipeline.submit(_check_ahead(arr, dest_dir,
+                                                     duplicates),
+                                        src_dir, dest_dir, listing)
+
     for obj, importance in arr:
-        obj.make(src_dir, dest_dir)
+        if jobs is None:
+            obj.make(src_dir, dest_dir, listing)
+        else:
+            synctool.pipeline.wait(jobs[id(obj)])
+
+        if not (sources_only or obj.src_stat.exists()):
+            # the contents may be in the store
+            synctool.store.resolve(obj)
 
         if obj.ov_type == OV_PRE:
             # register the .pre script and continue
@@ -297,7 +407,11 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
                     continue
 
             updated = False
-            if obj.dest_path not in duplicates:
+            dest_exists = True
+            # in an incremental run, a dir that did not change itself
+            # is only passed through on the way to what did change
+            if (obj.dest_path not in duplicates and
+                    (changes is None or changes.changed(obj.dest_path))):
                 # this is the most important source for this dir
                 duplicates.add(obj.dest_path)
 
@@ -305,22 +419,29 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
                 # this will create or fix directory entry if needed
                 # a .pre script may be run
                 # a .post script should not be run
+                commands_run = synctool.lib.COMMANDS_RUN
                 ok, updated = callback(obj, pre_dict, {})
                 if not ok:
                     # quick exit
                     return False, dir_changed
 
+                # a dir that did not exist has no entries, even if it
+                # was created just now; unless a script put them there
+                dest_exists = (obj.dest_stat.exists() or
+                               synctool.lib.COMMANDS_RUN != commands_run)
+
             # recurse down into the directory
             # with empty pre_dict and post_dict parameters
             ok, updated2 = _walk_subtree(obj.src_path, obj.dest_path,
-                                         duplicates, callback)
+                                         duplicates, callback, dest_exists,
+                                         changes, sources_only)
             if not ok:
                 # quick exit
                 return False, dir_changed
 
             # we still need to run the .post script on the dir (if any)
             if updated or updated2:
-                obj.run_script(post_dict)
+                obj.run_script(post_dict, batch=True)
 
             # finished checking directory
             continue
@@ -371,18 +492,26 @@ def _walk_subtree(src_dir, dest_dir, duplicates, callback):
     return True, dir_changed
 
 
-def visit(overlay, callback):
-    # type: (str, Callable[[SyncObject, Dict[str, str], Dict[str, str]], Tuple[bool, bool]]) -> None
+def visit(overlay, callback, changes=None, sources_only=False):
+    # type: (str, Callable[[SyncObject, Dict[str, str], Dict[str, str]], Tuple[bool, bool]], synctool.journal.Changes, bool) -> None
     '''visit all entries in the overlay tree
     overlay is either synctool.param.OVERLAY_DIR or synctool.param.DELETE_DIR
     callback will called with arguments: (SyncObject, pre_dict, post_dict)
     callback must return a two booleans: ok, updated
+    If changes is given, only the destination paths in it are visited
+    If sources_only is True, the destinations are not looked at, and
+    all appear to be missing (see synctool.plan)
     '''
 
     duplicates = set()  # type: Set[str]
 
+    if changes is None:
+        # in an incremental run, only what changed is looked at
+        changes = synctool.journal.changes(overlay)
+
     for d in _toplevel(overlay):
-        ok, _ = _walk_subtree(d, os.sep, duplicates, callback)
+        ok, _ = _walk_subtree(d, os.sep, duplicates, callback, True, changes,
+                              sources_only)
         if not ok:
             # quick exit
             break
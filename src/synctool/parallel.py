@@ -17,6 +17,7 @@ import os
 import sys
 import errno
 import time
+import struct
 
 try:
     from typing import List, Set, Callable, Any
@@ -29,6 +30,10 @@ import synctool.param
 
 ALL_PIDS = set()    # type: Set[int]
 
+# work items are passed to the workers as indices into the work list
+JOB_FORMAT = '=I'
+JOB_SIZE = struct.calcsize(JOB_FORMAT)
+
 
 def do(func, work):
     # type: (Callable[[Any], None], List[Any]) -> None
@@ -37,52 +42,101 @@ def do(func, work):
     if synctool.param.SLEEP_TIME != 0:
         synctool.param.NUM_PROC = 1
 
-    # 'part' becomes amount of work for each rank to do
     len_work = len(work)
-    if len_work <= synctool.param.NUM_PROC:
+    if len_work <= 0:
+        return
+
+    num_proc = synctool.param.NUM_PROC
+    if len_work < num_proc:
         num_proc = len_work
-        part = 1
-    else:
-        num_proc = synctool.param.NUM_PROC
-        part = len_work / num_proc
-        if len_work % num_proc != 0:
-            part += 1
+
+    # The work queue is a pipe holding the indices of the work items
+    # Workers pull the next item as soon as they are done with the
+    # previous one, so a slow node only holds up a single worker
+    # The token pipe holds a single byte; it serializes reading
+    # from the work queue so that items are never torn apart
+    job_rd, job_wr = os.pipe()
+    token_rd, token_wr = os.pipe()
+    os.write(token_wr, 'T')
 
     # spawn pool of workers
-    for rank in xrange(num_proc):
+    for _ in xrange(num_proc):
         try:
             pid = os.fork()
         except OSError as err:
             error('failed to fork(): %s' % err.strerror)
-            return
+            break
 
         if pid == 0:
             # child process
-            worker(rank, func, work, part)
+            os.close(job_wr)
+            worker(func, work, job_rd, token_rd, token_wr)
             sys.exit(0)
 
         # parent process
         ALL_PIDS.add(pid)
 
+    os.close(job_rd)
+    os.close(token_rd)
+    os.close(token_wr)
+
+    # feed the work queue; a write this small is atomic
+    # when the pipe is full, this blocks until the workers catch up
+    if ALL_PIDS:
+        for idx in xrange(len_work):
+            try:
+                os.write(job_wr, struct.pack(JOB_FORMAT, idx))
+            except OSError as err:
+                if err.errno != errno.EPIPE:
+                    error('failed to write to work queue: %s' % err.strerror)
+                # else: all workers are gone
+                break
+
+    # closing the pipe signals end of work
+    os.close(job_wr)
+
     # wait for all workers to exit
     join()
 
 
+def _next_job(job_fd, token_rd, token_wr):
+    # type: (int, int, int) -> int
+    '''get index of next work item from the work queue
+    Returns -1 when there is no more work
+    '''
+
+    # grab the token
+    os.read(token_rd, 1)
+    try:
+        data = ''
+        while len(data) < JOB_SIZE:
+            buf = os.read(job_fd, JOB_SIZE - len(data))
+            if not buf:
+                # end of work
+                break
+
+            data += buf
+    finally:
+        # pass on the token
+        os.write(token_wr, 'T')
+
+    if len(data) < JOB_SIZE:
+        return -1
+
+    return struct.unpack(JOB_FORMAT, data)[0]
+
+
 @catch_signals
-def worker(rank, func, work, part):
-    # type: (int, Callable[[Any], None], List[Any], int) -> None
-    '''run func to do part of work for parallel rank'''
+def worker(func, work, job_fd, token_rd, token_wr):
+    # type: (Callable[[Any], None], List[Any], int, int, int) -> None
+    '''run func for work items taken from the work queue'''
 
-    # determine which chunk of work to do
-    lower = part * rank
-    upper = part * (rank + 1)
-    len_work = len(work)
-    if upper > len_work:
-        upper = len_work
+    while True:
+        idx = _next_job(job_fd, token_rd, token_wr)
+        if idx < 0:
+            break
 
-    # run all work items in sequence
-    for item in work[lower:upper]:
-        func(item)
+        func(work[idx])
         # this is for option --zzz
         if synctool.param.SLEEP_TIME > 0:
             time.sleep(synctool.param.SLEEP_TIME)
@@ -45,6 +45,10 @@ DELETE_LEN = 0              # type: int
 PURGE_DIR = None            # type: str
 PURGE_LEN = 0               # type: int
 SCRIPT_DIR = None           # type: str
+CACHE_DIR = None            # type: str
+INDEX_DIR = None            # type: str
+STORE_DIR = None            # type: str
+MANIFEST_DIR = None         # type: str
 TEMP_DIR = '/tmp/synctool'  # type: str
 HOSTNAME = None             # type: str
 NODENAME = None             # type: str
@@ -60,14 +64,33 @@ PACKAGE_MANAGER = None      # type: str
 
 NUM_PROC = 16               # type: int
 SLEEP_TIME = 0              # type: int
+PARALLEL_ENGINE = 'fork'    # type: str
+
+PING_ENGINE = 'command'     # type: str
+PING_PORT = 22              # type: int
+PING_TIMEOUT = 1            # type: int
 
 CONTROL_PERSIST = '1h'      # type: str
+SSH_POOL = False            # type: bool
+SSH_POOL_TIMEOUT = 10       # type: int
 REQUIRE_EXTENSION = True    # type: bool
 BACKUP_COPIES = True        # type: bool
 SYSLOGGING = True           # type: bool
 FULL_PATH = False           # type: bool
 TERSE = False               # type: bool
 SYNC_TIMES = False          # type: bool
+DIGEST_CACHE = 'source'     # type: str
+CHECK_MODE = 'checksum'     # type: str
+COMPARE_METHOD = 'bytes'    # type: str
+CHECK_WORKERS = 1           # type: int
+DEST_STATE = True           # type: bool
+BATCH_POST = False          # type: bool
+POST_WORKERS = 1            # type: int
+OVERLAY_INDEX = False       # type: bool
+INCREMENTAL = False         # type: bool
+FULL_SWEEP_INTERVAL = 86400         # type: int
+DEDUP_TRANSFER = False      # type: bool
+FANOUT = False              # type: bool
 IGNORE_DOTFILES = False     # type: bool
 IGNORE_DOTDIRS = False      # type: bool
 IGNORE_FILES = set()                # type: Set[str]
@@ -148,6 +171,21 @@ KNOWN_PACKAGE_MANAGERS = ('apt-get', 'yum', 'zypper', 'brew', 'pacman',
                           # 'urpmi', 'portage', 'port', 'swaret',
                           'pkg', 'bsdpkg')  # type: Sequence[str]
 
+# valid values for parameter digest_cache
+DIGEST_CACHE_MODES = ('none', 'source', 'all')  # type: Sequence[str]
+
+# valid values for parameter check_mode
+CHECK_MODES = ('checksum', 'metadata')          # type: Sequence[str]
+
+# valid values for parameter compare_method
+COMPARE_METHODS = ('bytes', 'md5', 'sha256', 'xxhash')  # type: Sequence[str]
+
+# valid values for parameter parallel_engine
+PARALLEL_ENGINES = ('fork', 'eventloop')        # type: Sequence[str]
+
+# valid values for parameter ping_engine
+PING_ENGINES = ('command', 'probe')             # type: Sequence[str]
+
 ORIG_UMASK = 022    # type: int
 
 
@@ -157,7 +195,9 @@ def init():
 
     global ROOTDIR, CONF_FILE
     global VAR_DIR, VAR_LEN, OVERLAY_DIR, OVERLAY_LEN, DELETE_DIR, DELETE_LEN
-    global PURGE_DIR, PURGE_LEN, SCRIPT_DIR, ORIG_UMASK
+    global PURGE_DIR, PURGE_LEN, SCRIPT_DIR, CACHE_DIR, INDEX_DIR
+    global STORE_DIR, MANIFEST_DIR
+    global ORIG_UMASK
 
     base = os.path.abspath(os.path.dirname(sys.argv[0]))
     if not base:
@@ -176,6 +216,11 @@ def init():
     PURGE_DIR = os.path.join(VAR_DIR, 'purge')
     PURGE_LEN = len(PURGE_DIR) + 1
     SCRIPT_DIR = os.path.join(ROOTDIR, 'scripts')
+    # the cache dir is local to each node; it is not synced
+    CACHE_DIR = os.path.join(VAR_DIR, 'cache')
+    INDEX_DIR = os.path.join(VAR_DIR, 'index')
+    STORE_DIR = os.path.join(VAR_DIR, 'store')
+    MANIFEST_DIR = os.path.join(VAR_DIR, 'manifest')
 
     # the following only makes sense for synctool-client, but OK
 
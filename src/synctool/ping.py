@@ -0,0 +1,410 @@
+#
+#   synctool.ping.py    WJ132
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''in-process ping engine
+
+Rather than running a ping command for every node, dsh-ping can send
+probes to all nodes at once and wait for the replies in a single
+event loop. So pinging many nodes takes about as long as the timeout.
+
+When running as root, it sends ICMP echo requests over a raw socket.
+Otherwise, it connects to a TCP port (ping_port); a node that either
+accepts or refuses the connection is up.
+'''
+
+import os
+import time
+import errno
+import select
+import socket
+import struct
+import resource
+import collections
+
+try:
+    from typing import List, Dict, Tuple, Callable, Deque
+except ImportError:
+    pass
+
+from synctool.lib import verbose
+import synctool.param
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# payload of the echo request
+ICMP_PAYLOAD = 'synctool-ping'
+
+# size of the receive buffer for replies, so that none get lost
+# when many nodes reply at once
+RECV_BUF_SIZE = 4 * 1024 * 1024
+
+# keep this many file descriptors free when probing TCP ports
+RESERVED_FDS = 32
+
+
+class Probe(object):
+    '''a probe for a single node'''
+
+    def __init__(self, nodename, addr):
+        # type: (str, str) -> None
+        '''initialize instance'''
+
+        self.nodename = nodename
+        self.addr = addr
+        self.family = None      # type: int
+        self.sockaddr = None    # type: Tuple
+        self.sock = None        # type: socket.socket
+        # time when the probe was sent
+        self.t0 = 0.0
+        self.done = False
+
+
+def ping(nodes, callback):
+    # type: (List[Tuple[str, str]], Callable[[str, float], None]) -> None
+    '''ping all nodes at once
+    nodes is a list of tuples: (nodename, address)
+    For each node, callback(nodename, rtt) is called with
+    the round-trip time in seconds, or None if the node is not responding
+    '''
+
+    probes = [Probe(nodename, addr) for nodename, addr in nodes]
+    timeout = synctool.param.PING_TIMEOUT
+
+    if os.geteuid() == 0:
+        # the probes that can not be done with ICMP are done with TCP
+        probes = _ping_icmp(probes, timeout, callback)
+
+    if probes:
+        _ping_tcp(probes, timeout, callback)
+
+
+def _resolve(probe, family, port):
+    # type: (Probe, int, int) -> bool
+    '''look up the socket address of the node
+    Returns False on error
+    '''
+
+    try:
+        info = socket.getaddrinfo(probe.addr, port, family,
+                                  socket.SOCK_STREAM)
+    except socket.gaierror as err:
+        verbose('%s: %s' % (probe.addr, err.args[1]))
+        return False
+
+    probe.family = info[0][0]
+    probe.sockaddr = info[0][4]
+    return True
+
+
+def _checksum(data):
+    # type: (str) -> int
+    '''Returns internet checksum of data'''
+
+    if len(data) & 1:
+        data += '\0'
+
+    total = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _echo_request(ident, seq):
+    # type: (int, int) -> str
+    '''Returns ICMP echo request packet'''
+
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = _checksum(header + ICMP_PAYLOAD)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, csum, ident, seq)
+    return header + ICMP_PAYLOAD
+
+
+def _expire(sent, now, timeout):
+    # type: (Deque[Probe], float, int) -> Tuple[float, List[Probe]]
+    '''find the probes that timed out
+    sent is the queue of probes in the order in which they were sent
+    Returns tuple: seconds until the next probe times out (or None
+    if no probes are left), list of probes that timed out
+    '''
+
+    expired = []        # type: List[Probe]
+    while sent:
+        probe = sent[0]
+        if probe.done:
+            sent.popleft()
+            continue
+
+        if now - probe.t0 < timeout:
+            return probe.t0 + timeout - now, expired
+
+        sent.popleft()
+        probe.done = True
+        expired.append(probe)
+
+    return None, expired
+
+
+def _poll(poller, wait):
+    # type: (select.poll, float) -> List[Tuple[int, int]]
+    '''poll for events for at most wait seconds (None is forever)
+    Returns list of events
+    '''
+
+    if wait is not None:
+        # in milliseconds; round up to avoid spinning
+        wait = int(wait * 1000) + 1
+
+    try:
+        return poller.poll(wait)
+    except select.error as err:
+        if err.args[0] == errno.EINTR:
+            return []
+        raise
+
+
+def _ping_icmp(probes, timeout, callback):
+    # type: (List[Probe], int, Callable[[str, float], None]) -> List[Probe]
+    '''send ICMP echo requests to the nodes and wait for the replies
+    Returns list of probes that can not be done with ICMP
+    '''
+
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                             socket.getprotobyname('icmp'))
+    except socket.error as err:
+        verbose('can not create raw socket: %s' % err.args[1])
+        return probes
+
+    # only IPv4; the rest is probed with TCP
+    other = []          # type: List[Probe]
+    unsent = collections.deque()    # type: Deque[Probe]
+    for probe in probes:
+        if _resolve(probe, socket.AF_INET, 0):
+            unsent.append(probe)
+        else:
+            other.append(probe)
+
+    ident = os.getpid() & 0xffff
+    sock.setblocking(0)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUF_SIZE)
+    except socket.error:
+        # not fatal; keep the default size
+        pass
+
+    poller = select.poll()
+    poller.register(sock.fileno(), select.POLLIN | select.POLLOUT)
+    polling_out = True
+
+    # waiting[(ipaddr, seq)] -> probe
+    waiting = {}        # type: Dict[Tuple[str, int], Probe]
+    sent = collections.deque()      # type: Deque[Probe]
+    seq = 0
+
+    while True:
+        wait, expired = _expire(sent, time.time(), timeout)
+        for probe in expired:
+            callback(probe.nodename, None)
+
+        if unsent:
+            wait = None
+        elif wait is None:
+            # all done
+            break
+        elif polling_out:
+            poller.modify(sock.fileno(), select.POLLIN)
+            polling_out = False
+
+        for _, event in _poll(poller, wait):
+            if event & select.POLLOUT:
+                seq = _send_echo(sock, unsent, sent, waiting, ident, seq,
+                                 callback)
+
+            if event & select.POLLIN:
+                _recv_echo(sock, waiting, ident, callback)
+
+    sock.close()
+    return other
+
+
+def _send_echo(sock, unsent, sent, waiting, ident, seq, callback):
+    # type: (socket.socket, Deque[Probe], Deque[Probe], Dict[Tuple[str, int], Probe], int, int, Callable[[str, float], None]) -> int
+    '''send echo requests until the socket would block
+    Returns next sequence number
+    '''
+
+    while unsent:
+        probe = unsent[0]
+        seq = (seq + 1) & 0xffff
+        try:
+            sock.sendto(_echo_request(ident, seq), probe.sockaddr)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.ENOBUFS, errno.EINTR):
+                # try again later
+                break
+
+            verbose('%s: %s' % (probe.addr, err.args[1]))
+            unsent.popleft()
+            probe.done = True
+            callback(probe.nodename, None)
+            continue
+
+        unsent.popleft()
+        probe.t0 = time.time()
+        sent.append(probe)
+        waiting[(probe.sockaddr[0], seq)] = probe
+
+    return seq
+
+
+def _recv_echo(sock, waiting, ident, callback):
+    # type: (socket.socket, Dict[Tuple[str, int], Probe], int, Callable[[str, float], None]) -> None
+    '''receive echo replies until the socket would block'''
+
+    while True:
+        try:
+            data, (ipaddr, _) = sock.recvfrom(2048)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        now = time.time()
+
+        # skip the IP header
+        offset = (ord(data[0]) & 0x0f) * 4
+        if len(data) < offset + 8:
+            continue
+
+        icmp_type, _, _, reply_ident, seq = struct.unpack(
+            '!BBHHH', data[offset:offset + 8])
+        if icmp_type != ICMP_ECHO_REPLY or reply_ident != ident:
+            # not for us
+            continue
+
+        probe = waiting.pop((ipaddr, seq), None)
+        if probe is None or probe.done:
+            continue
+
+        probe.done = True
+        callback(probe.nodename, now - probe.t0)
+
+
+def _max_sockets():
+    # type: () -> int
+    '''Returns max number of sockets that may be open at once'''
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, resource.error):
+            pass
+
+    return max(soft - RESERVED_FDS, 1)
+
+
+def _ping_tcp(probes, timeout, callback):
+    # type: (List[Probe], int, Callable[[str, float], None]) -> None
+    '''connect to a TCP port of the nodes'''
+
+    port = synctool.param.PING_PORT
+    max_sockets = _max_sockets()
+
+    unsent = collections.deque(probes)     # type: Deque[Probe]
+    sent = collections.deque()              # type: Deque[Probe]
+    # active[fd] -> probe
+    active = {}         # type: Dict[int, Probe]
+    poller = select.poll()
+
+    while unsent or active:
+        while unsent and len(active) < max_sockets:
+            probe = unsent.popleft()
+            if not _connect(probe, port):
+                probe.done = True
+                callback(probe.nodename, None)
+                continue
+
+            if probe.done:
+                # connection refused right away; the node is up
+                callback(probe.nodename, time.time() - probe.t0)
+                continue
+
+            active[probe.sock.fileno()] = probe
+            poller.register(probe.sock, select.POLLOUT)
+            sent.append(probe)
+
+        wait, expired = _expire(sent, time.time(), timeout)
+        for probe in expired:
+            _disconnect(probe, active, poller)
+            callback(probe.nodename, None)
+
+        if not active:
+            continue
+
+        for fd, _ in _poll(poller, wait):
+            probe = active[fd]
+            now = time.time()
+            err = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            _disconnect(probe, active, poller)
+            probe.done = True
+
+            if err in (0, errno.ECONNREFUSED):
+                callback(probe.nodename, now - probe.t0)
+            else:
+                verbose('%s: %s' % (probe.addr, os.strerror(err)))
+                callback(probe.nodename, None)
+
+
+def _disconnect(probe, active, poller):
+    # type: (Probe, Dict[int, Probe], select.poll) -> None
+    '''close the socket of a probe'''
+
+    fd = probe.sock.fileno()
+    poller.unregister(fd)
+    del active[fd]
+    probe.sock.close()
+    probe.sock = None
+
+
+def _connect(probe, port):
+    # type: (Probe, int) -> bool
+    '''start connecting to the TCP port of a node
+    Returns False on error
+    '''
+
+    if not _resolve(probe, socket.AF_UNSPEC, port):
+        return False
+
+    try:
+        probe.sock = socket.socket(probe.family, socket.SOCK_STREAM)
+    except socket.error as err:
+        verbose('failed to create socket: %s' % err.args[1])
+        return False
+
+    probe.sock.setblocking(0)
+    probe.t0 = time.time()
+    err = probe.sock.connect_ex(probe.sockaddr)
+    if err in (0, errno.EINPROGRESS):
+        return True
+
+    probe.sock.close()
+    probe.sock = None
+
+    if err == errno.ECONNREFUSED:
+        probe.done = True
+        return True
+
+    verbose('%s: %s' % (probe.addr, os.strerror(err)))
+    return False
+
+# EOB
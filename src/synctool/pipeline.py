@@ -0,0 +1,182 @@
+#
+#   synctool.pipeline.py    WJ134
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''check the overlay tree in worker threads
+
+With "check_workers" set, synctool-client hands the entries of every
+directory in the overlay tree to a pool of worker threads, that stat
+them and compare the contents of source and destination. Meanwhile,
+the main thread walks the tree just like before; it waits for the
+outcome of each entry, reports it, and applies the fixes and runs
+the .pre and .post scripts in the usual order.
+
+Reading and hashing files does not hold the interpreter lock, so the
+work is spread over multiple cores and disks can serve many requests
+at once.
+
+A command may change any file, so the work of the workers is discarded
+(and done again by the main thread) when a command ran in the meantime.
+'''
+
+import sys
+import threading
+import Queue
+
+try:
+    from typing import List, Dict, Tuple
+    from synctool.object import SyncObject
+    from synctool.syncstat import DirListing
+except ImportError:
+    pass
+
+import synctool.digest
+import synctool.lib
+import synctool.object
+import synctool.param
+import synctool.state
+
+# QUEUE is None when no workers are running
+QUEUE = None        # type: Queue.Queue
+WORKERS = []        # type: List[threading.Thread]
+
+
+class Job(object):
+    '''a SyncObject to check ahead of time'''
+
+    def __init__(self, obj, src_dir, dest_dir, listing, compare):
+        # type: (SyncObject, str, str, DirListing, bool) -> None
+        '''initialize instance
+        compare is whether the contents should be compared
+        '''
+
+        self.obj = obj
+        self.src_dir = src_dir
+        self.dest_dir = dest_dir
+        self.listing = listing
+        self.compare = compare
+        # value of synctool.lib.COMMANDS_RUN when the job started
+        self.commands_run = -1
+        # exception to pass on to the main thread
+        self.exc_info = None
+        self.done = threading.Event()
+
+    def run(self):
+        # type: () -> None
+        '''stat, and compare the contents'''
+
+        self.commands_run = synctool.lib.COMMANDS_RUN
+        try:
+            self.obj.make(self.src_dir, self.dest_dir, self.listing)
+            if self.compare:
+                self.obj.compare_ahead()
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+        self.done.set()
+
+
+def start():
+    # type: () -> None
+    '''start the worker threads, if configured'''
+
+    global QUEUE
+
+    if synctool.param.CHECK_WORKERS <= 1 or QUEUE is not None:
+        return
+
+    # load the digest cache and state now, rather than in every thread
+    if (synctool.param.DIGEST_CACHE != 'none' and
+            synctool.digest.CACHE is None):
+        synctool.digest.load()
+
+    if synctool.param.DEST_STATE and synctool.state.STATE is None:
+        synctool.state.load()
+
+    QUEUE = Queue.Queue()
+    for _ in xrange(synctool.param.CHECK_WORKERS):
+        t = threading.Thread(target=_worker)
+        t.daemon = True
+        t.start()
+        WORKERS.append(t)
+
+
+def stop():
+    # type: () -> None
+    '''stop the worker threads'''
+
+    global QUEUE
+
+    if QUEUE is None:
+        return
+
+    # drop any jobs that were left over after a quick exit
+    while True:
+        try:
+            QUEUE.get_nowait()
+        except Queue.Empty:
+            break
+
+    for _ in WORKERS:
+        QUEUE.put(None)
+
+    for t in WORKERS:
+        t.join()
+
+    del WORKERS[:]
+    QUEUE = None
+
+    # jobs that were left over may have written temp files
+    synctool.object.remove_staged()
+
+
+def _worker():
+    # type: () -> None
+    '''run jobs until told to stop'''
+
+    while True:
+        job = QUEUE.get()
+        if job is None:
+            break
+
+        job.run()
+
+
+def submit(entries, src_dir, dest_dir, listing):
+    # type: (List[Tuple[SyncObject, bool]], str, str, DirListing) -> Dict[int, Job]
+    '''hand the entries of a directory to the workers
+    entries is a list of tuples: (SyncObject, compare contents)
+    listing is the DirListing of dest_dir
+    Returns dict of jobs by id(obj)
+    '''
+
+    jobs = {}       # type: Dict[int, Job]
+    for obj, compare in entries:
+        job = Job(obj, src_dir, dest_dir, listing, compare)
+        jobs[id(obj)] = job
+        QUEUE.put(job)
+
+    return jobs
+
+
+def wait(job):
+    # type: (Job) -> None
+    '''wait until the job is done
+    If a command ran while working on it, stat the object again
+    '''
+
+    job.done.wait()
+
+    if job.exc_info is not None:
+        raise job.exc_info[0], job.exc_info[1], job.exc_info[2]
+
+    if job.commands_run != synctool.lib.COMMANDS_RUN:
+        job.obj.restat()
+
+# EOB
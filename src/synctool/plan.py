@@ -0,0 +1,199 @@
+#
+#   synctool.plan.py    WJ129
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''a plan tells which source in the repository wins for which destination
+
+The plan is computed on the master node by walking the overlay tree
+the same way synctool-client does, but for the groups of a given node.
+Plans are cached by group signature: the node's ordered list of groups,
+leaving out groups that do not occur in the repository at all (except
+for the final group 'all').
+Nodes that have the same signature share a single plan.
+'''
+
+import os
+
+try:
+    from typing import List, Dict, Tuple, Set
+    from synctool.object import SyncObject
+except ImportError:
+    pass
+
+import synctool.lib
+import synctool.overlay
+import synctool.param
+
+# PLANS[signature] -> Plan
+PLANS = {}          # type: Dict[Tuple[str, ...], Plan]
+
+# set of groups that occur in the overlay tree
+USED_GROUPS = None  # type: Set[str]
+
+
+class PlanEntry(object):
+    '''a resolved destination'''
+
+    def __init__(self, dest_path, src_path, ov_type, is_dir, pre, post):
+        # type: (str, str, int, bool, str, str) -> None
+        '''initialize instance'''
+
+        self.dest_path = dest_path
+        self.src_path = src_path
+        self.ov_type = ov_type
+        self.is_dir = is_dir
+        # the .pre and .post scripts that go with it (or None)
+        self.pre = pre
+        self.post = post
+
+    def print_src(self):
+        # type: () -> str
+        '''pretty print my source path'''
+
+        if self.is_dir:
+            return synctool.lib.prettypath(self.src_path) + os.sep
+
+        return synctool.lib.prettypath(self.src_path)
+
+
+class Plan(object):
+    '''the mapping of destination to source for a group signature'''
+
+    def __init__(self, groups):
+        # type: (List[str]) -> None
+        '''initialize instance'''
+
+        self.groups = groups
+        # entries in the order in which synctool visits them
+        self.entries = []       # type: List[PlanEntry]
+        self.by_dest = {}       # type: Dict[str, PlanEntry]
+
+    def add(self, entry):
+        # type: (PlanEntry) -> None
+        '''add entry to the plan'''
+
+        self.entries.append(entry)
+        self.by_dest[entry.dest_path] = entry
+
+    def lookup(self, path):
+        # type: (str) -> str
+        '''Returns pretty printed source path for destination path
+        (which may be a terse path)
+        or None if it is not in the repository
+        '''
+
+        if path in self.by_dest:
+            return self.by_dest[path].print_src()
+
+        for entry in self.entries:
+            if synctool.lib.terse_match(path, entry.dest_path):
+                return entry.print_src()
+
+        # look in the purge/ tree, too
+        filepath = path
+        if filepath[0] == os.sep:
+            filepath = filepath[1:]
+
+        for group in self.groups:
+            src = os.path.join(synctool.param.PURGE_DIR, group, filepath)
+            if synctool.lib.path_exists(src):
+                return synctool.lib.prettypath(src)
+
+        return None
+
+
+def _used_groups():
+    # type: () -> Set[str]
+    '''Returns set of groups that occur in the overlay tree'''
+
+    global USED_GROUPS
+
+    if USED_GROUPS is not None:
+        return USED_GROUPS
+
+    USED_GROUPS = set()
+    for tree in (synctool.param.OVERLAY_DIR, synctool.param.PURGE_DIR):
+        for group in os.listdir(tree):
+            USED_GROUPS.add(group)
+
+    for path, subdirs, files in os.walk(synctool.param.OVERLAY_DIR):
+        for name in subdirs + files:
+            _, _, group = synctool.overlay.parse_extension(name)
+            if group is not None:
+                USED_GROUPS.add(group)
+
+    return USED_GROUPS
+
+
+def signature(groups):
+    # type: (List[str]) -> Tuple[str, ...]
+    '''Returns group signature for ordered list of groups'''
+
+    used = _used_groups()
+    # the final group is 'all', which is also the group of files
+    # without group extension (see overlay._group_all());
+    # it is kept even if it does not occur in the repository
+    sig = [g for g in groups[:-1] if g in used]
+    sig.extend(groups[-1:])
+    return tuple(sig)
+
+
+def get_plan(nodename):
+    # type: (str) -> Plan
+    '''Returns the plan for a node'''
+
+    groups = synctool.param.NODES.get(nodename, [])
+    sig = signature(groups)
+    if sig not in PLANS:
+        PLANS[sig] = make_plan(list(sig))
+
+    return PLANS[sig]
+
+
+def make_plan(groups):
+    # type: (List[str]) -> Plan
+    '''compute the plan for an ordered list of groups'''
+
+    plan = Plan(groups)
+
+    def _plan_callback(obj, pre_dict, post_dict):
+        # type: (SyncObject, Dict[str, str], Dict[str, str]) -> Tuple[bool, bool]
+        '''register the source that wins for this destination'''
+
+        pre = pre_dict.get(obj.dest_path)
+        if obj.ov_type == synctool.overlay.OV_TEMPLATE:
+            # the template generator is keyed by its path in the overlay
+            template = os.path.join(os.path.dirname(obj.src_path),
+                                    os.path.basename(obj.dest_path) +
+                                    '._template')
+            post = post_dict.get(template)
+            # do not generate anything; the template itself is the source
+            obj.ov_type = synctool.overlay.OV_IGNORE
+            ov_type = synctool.overlay.OV_TEMPLATE
+        else:
+            post = post_dict.get(obj.dest_path)
+            ov_type = obj.ov_type
+
+        plan.add(PlanEntry(obj.dest_path, obj.src_path, ov_type,
+                           obj.src_stat.is_dir(), pre, post))
+        return True, False
+
+    # overlay uses MY_GROUPS; it is restored afterwards
+    saved_groups = synctool.param.MY_GROUPS
+    synctool.param.MY_GROUPS = groups
+    try:
+        # the plan does not depend on what is on the master itself
+        synctool.overlay.visit(synctool.param.OVERLAY_DIR, _plan_callback,
+                               sources_only=True)
+    finally:
+        synctool.param.MY_GROUPS = saved_groups
+
+    return plan
+
+# EOB
@@ -0,0 +1,258 @@
+#
+#   synctool.postqueue.py    WJ141
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''queue of .post scripts
+
+With "batch_post yes", the .post scripts of updated files and directories
+are not run right away, but queued, and run at the end of the overlay
+(and delete) phase. A script is queued only once per directory that it
+runs in, so restarting a daemon from the .post scripts of many files
+restarts it only once. Scripts are told apart by the file that they
+resolve to, so symlinks to the same script count as one.
+
+The scripts run in the order in which they were first queued. With
+"post_workers" set, up to that many scripts run at the same time; a
+script still waits for the scripts before it that run in the same
+directory or below it, so a directory's .post script runs after those
+of its files. The output of a script is shown when it finishes.
+
+.pre scripts are always run right away.
+'''
+
+import os
+import sys
+import time
+import shlex
+import threading
+import subprocess
+import Queue
+
+try:
+    from typing import List, Tuple, Set, Any
+except ImportError:
+    pass
+
+import synctool.lib
+from synctool.lib import verbose, stdout, stderr, terse, prettypath
+from synctool.lib import dryrun_msg
+import synctool.metrics
+import synctool.param
+
+# QUEUE is a list of tuples: (script, dir to run it in)
+# It is None when not queueing
+QUEUE = None        # type: List[Tuple[str, str]]
+# keys of the queued scripts
+QUEUED = set()      # type: Set[Tuple[str, str]]
+
+
+def start():
+    # type: () -> None
+    '''start queueing .post scripts, if configured'''
+
+    global QUEUE
+
+    if not synctool.param.BATCH_POST or QUEUE is not None:
+        return
+
+    QUEUE = []
+    QUEUED.clear()
+
+
+def _key(script, cwd):
+    # type: (str, str) -> Tuple[str, str]
+    '''Returns key that identifies the script'''
+
+    try:
+        arr = shlex.split(script)
+    except ValueError:
+        return script, cwd
+
+    if not arr:
+        return script, cwd
+
+    arr[0] = os.path.realpath(arr[0])
+    return ' '.join(arr), cwd
+
+
+def add(script, cwd):
+    # type: (str, str) -> bool
+    '''queue script to run in directory cwd
+    Returns False if not queueing; the caller should run it now
+    '''
+
+    if QUEUE is None:
+        return False
+
+    key = _key(script, cwd)
+    if key in QUEUED:
+        verbose('%s already queued for %s' % (prettypath(script), cwd))
+        return True
+
+    verbose('queueing %s for %s' % (prettypath(script), cwd))
+    QUEUED.add(key)
+    QUEUE.append((script, cwd))
+    return True
+
+
+def run():
+    # type: () -> None
+    '''run the queued scripts, and stop queueing'''
+
+    global QUEUE
+
+    if QUEUE is None:
+        return
+
+    scripts = QUEUE
+    QUEUE = None
+    QUEUED.clear()
+
+    if not scripts:
+        return
+
+    # run with the umask set by the sysadmin
+    os.umask(synctool.param.ORIG_UMASK)
+
+    # scripts are run one by one in dry run mode, and for --unix,
+    # because that prints the commands as a shell script
+    if (synctool.param.POST_WORKERS <= 1 or synctool.lib.DRY_RUN or
+            synctool.lib.UNIX_CMD):
+        for script, cwd in scripts:
+            t0 = time.time()
+            synctool.lib.run_command_in_dir(cwd, script)
+            _timed(script, time.time() - t0)
+    else:
+        _run_parallel(scripts)
+
+    os.umask(077)
+
+
+def _timed(script, elapsed):
+    # type: (str, float) -> None
+    '''register the time that a script took'''
+
+    verbose('%s took %.3fs' % (prettypath(script), elapsed))
+    synctool.metrics.stop('script', time.time() - elapsed)
+    synctool.metrics.script_time(prettypath(script), elapsed)
+
+
+def _below(path, top):
+    # type: (str, str) -> bool
+    '''Returns True if path is top or a path under it'''
+
+    return path == top or path.startswith(top.rstrip(os.sep) + os.sep)
+
+
+def _run_parallel(scripts):
+    # type: (List[Tuple[str, str]]) -> None
+    '''run the scripts in parallel, as far as their order allows'''
+
+    # waiting is a list of tuples: (index, set of indices to wait for)
+    waiting = []    # type: List[Tuple[int, Set[int]]]
+    for i in xrange(len(scripts)):
+        cwd = scripts[i][1]
+        after = set([j for j in xrange(i) if _below(scripts[j][1], cwd)])
+        waiting.append((i, after))
+
+    finished = set()    # type: Set[int]
+    done = Queue.Queue()
+    running = 0
+
+    while waiting or running:
+        # start what may run now, in order
+        for item in waiting[:]:
+            if running >= synctool.param.POST_WORKERS:
+                break
+
+            i, after = item
+            if not after <= finished:
+                continue
+
+            waiting.remove(item)
+            if _start(i, scripts[i][0], scripts[i][1], done):
+                running += 1
+            else:
+                finished.add(i)
+
+        if not running:
+            continue
+
+        i, ret, output, elapsed = done.get()
+        running -= 1
+        finished.add(i)
+
+        script = scripts[i][0]
+        if output:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+        if isinstance(ret, OSError):
+            stderr("failed to run shell command '%s' : %s" %
+                   (prettypath(script), ret.strerror))
+        else:
+            verbose('exit code %d' % ret)
+
+        _timed(script, elapsed)
+
+
+def _start(i, script, cwd, done):
+    # type: (int, str, str, Queue.Queue) -> bool
+    '''start running script number i in a thread
+    The outcome is put on the done queue
+    Returns False if the script can not be run
+    '''
+
+    cmdfile = shlex.split(script)[0]
+    if not os.path.isfile(cmdfile):
+        synctool.lib.error('command %s not found' % prettypath(cmdfile))
+        return False
+
+    if not os.access(cmdfile, os.X_OK):
+        synctool.lib.error("file '%s' is not executable" %
+                           prettypath(cmdfile))
+        return False
+
+    if not synctool.lib.QUIET:
+        stdout('running command %s' % prettypath(script))
+
+    verbose(dryrun_msg('  os.system(%s)' % prettypath(script)))
+    terse(synctool.lib.TERSE_EXEC, cmdfile)
+
+    synctool.lib.COMMANDS_RUN += 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    t = threading.Thread(target=_execute, args=(i, script, cwd, done))
+    t.daemon = True
+    t.start()
+    return True
+
+
+def _execute(i, script, cwd, done):
+    # type: (int, str, str, Queue.Queue) -> None
+    '''run the script in directory cwd, collecting its output
+    This runs in a thread
+    '''
+
+    t0 = time.time()
+    try:
+        proc = subprocess.Popen(script, shell=True, cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        ret = proc.returncode   # type: Any
+    except OSError as err:
+        output = None
+        ret = err
+
+    done.put((i, ret, output, time.time() - t0))
+
+# EOB
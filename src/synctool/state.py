@@ -0,0 +1,244 @@
+#
+#   synctool.state.py    WJ139
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''state of the destination files
+
+synctool-client keeps a record of every regular file that it installed,
+or found to be the same as its source: $SYNCTOOL/var/cache/dest.state
+It holds the size, mtime, ctime and inode number of the destination file
+and of the source that it was the same as. As long as both still match,
+the contents are known to be the same, and the files need not be read.
+
+A file that is changed outside synctool gets a new ctime, even if its
+size and mtime are put back. The sources get a new inode when they are
+synced, so a change of either one means that the files are compared
+again.
+'''
+
+import os
+import time
+import errno
+
+try:
+    from typing import Dict, Tuple, Set
+    from synctool.syncstat import SyncStat
+except ImportError:
+    pass
+
+import synctool.lib
+from synctool.lib import verbose, error, warning
+import synctool.metrics
+import synctool.param
+import synctool.syncstat
+
+STATE_FILE = 'dest.state'
+# header line; bump the version when changing the file format
+STATE_MAGIC = '# synctool dest state v1'
+
+# STATE[dest path] -> (dest stat key, src path, src stat key)
+# where a stat key is: (size, mtime, ctime, inode)
+STATE = None        # type: Dict[str, Tuple[Tuple, str, Tuple]]
+# set of paths that were looked up during this run
+USED = set()        # type: Set[str]
+DIRTY = False       # type: bool
+
+# time at which the state was loaded
+# on filesystems with timestamps in whole seconds, a file that changes
+# again within the same second can not be told apart (see _key())
+NOW = 0             # type: int
+
+
+def _state_filename():
+    # type: () -> str
+    '''Returns full path of the state file'''
+
+    return os.path.join(synctool.param.CACHE_DIR, STATE_FILE)
+
+
+def _key(statbuf):
+    # type: (SyncStat) -> Tuple[int, int, float, int]
+    '''Returns tuple that identifies the version of a file,
+    or None if it can not be trusted
+    '''
+
+    ctime = statbuf.ctime
+    if ctime == int(ctime) and int(ctime) >= NOW:
+        return None
+
+    return statbuf.size, statbuf.mtime, ctime, statbuf.ino
+
+
+def load():
+    # type: () -> None
+    '''load the state from disk'''
+
+    global STATE, NOW
+
+    STATE = {}
+    NOW = int(time.time())
+
+    filename = _state_filename()
+    try:
+        f = open(filename, 'r')
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            warning('failed to read %s: %s' % (filename, err.strerror))
+        return
+
+    with f:
+        if f.readline().rstrip('\n') != STATE_MAGIC:
+            verbose('discarding %s: unknown format' % filename)
+            return
+
+        for line in f:
+            arr = line.rstrip('\n').split('\t')
+            if len(arr) != 10:
+                continue
+
+            try:
+                dest_key = (int(arr[1]), int(arr[2]), float(arr[3]),
+                            int(arr[4]))
+                src_key = (int(arr[6]), int(arr[7]), float(arr[8]),
+                           int(arr[9]))
+            except ValueError:
+                continue
+
+            STATE[arr[0]] = (dest_key, arr[5], src_key)
+
+    verbose('loaded state of %d destination files' % len(STATE))
+
+
+def save():
+    # type: () -> None
+    '''write the state back to disk
+    Entries for files that no longer exist are evicted
+    '''
+
+    global DIRTY
+
+    if not synctool.param.DEST_STATE:
+        return
+
+    if STATE is None:
+        # state was not used in this run,
+        # but it may still hold entries that need evicting
+        load()
+
+    # entries that were used in this run are known to exist
+    for path in STATE.keys():
+        if path not in USED and not synctool.lib.path_exists(path):
+            del STATE[path]
+            DIRTY = True
+
+    if not DIRTY:
+        return
+
+    if not synctool.lib.mkdir_p(synctool.param.CACHE_DIR):
+        # error message already printed
+        return
+
+    # write to temp file and rename, so that the state is never corrupt
+    filename = _state_filename()
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        warning('failed to write %s: %s' % (tmp_filename, err.strerror))
+        return
+
+    with f:
+        f.write(STATE_MAGIC + '\n')
+        for path in sorted(STATE.keys()):
+            dest_key, src_path, src_key = STATE[path]
+            f.write('%s\t%d\t%d\t%r\t%d\t%s\t%d\t%d\t%r\t%d\n' %
+                    ((path,) + dest_key + (src_path,) + src_key))
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        return
+
+    DIRTY = False
+
+
+def verified(src_path, src_stat, dest_path, dest_stat):
+    # type: (str, SyncStat, str, SyncStat) -> bool
+    '''Returns True if the destination is known to have the same
+    contents as the source, because neither changed since
+    '''
+
+    if not synctool.param.DEST_STATE:
+        return False
+
+    if STATE is None:
+        load()
+
+    USED.add(dest_path)
+
+    try:
+        dest_key, old_src_path, src_key = STATE[dest_path]
+    except KeyError:
+        return False
+
+    if (dest_key != _key(dest_stat) or old_src_path != src_path or
+            src_key != _key(src_stat)):
+        return False
+
+    synctool.metrics.count('verified')
+    return True
+
+
+def store(src_path, src_stat, dest_path, dest_stat):
+    # type: (str, SyncStat, str, SyncStat) -> None
+    '''record that the destination has the same contents as the source'''
+
+    global DIRTY
+
+    if not synctool.param.DEST_STATE:
+        return
+
+    if STATE is None:
+        load()
+
+    USED.add(dest_path)
+
+    dest_key = _key(dest_stat)
+    src_key = _key(src_stat)
+    # tabs and newlines would break the file format
+    if (dest_key is None or src_key is None or
+            '\t' in dest_path or '\n' in dest_path or
+            '\t' in src_path or '\n' in src_path):
+        if dest_path in STATE:
+            del STATE[dest_path]
+            DIRTY = True
+        return
+
+    STATE[dest_path] = (dest_key, src_path, src_key)
+    DIRTY = True
+
+
+def installed(src_path, src_stat, dest_path):
+    # type: (str, SyncStat, str) -> None
+    '''record the destination file that was just installed or fixed'''
+
+    if not synctool.param.DEST_STATE or synctool.lib.DRY_RUN:
+        return
+
+    dest_stat = synctool.syncstat.SyncStat(dest_path)
+    if dest_stat.is_file():
+        store(src_path, src_stat, dest_path, dest_stat)
+
+# EOB
@@ -0,0 +1,438 @@
+#
+#   synctool.store.py    WJ130
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''content-addressed store for transferring the overlay tree
+
+Many files in the overlay tree are identical, like the same file
+under overlay/groupA/ and overlay/groupB/. With "dedup_transfer yes",
+the master keeps a copy of every regular file in the store, named
+after its MD5 digest: $SYNCTOOL/var/store/<xx>/<digest>
+Next to the store, there is a manifest per group dir:
+$SYNCTOOL/var/manifest/<group>
+that lists for each file its digest and its attributes.
+
+The files that are in the manifest are not transferred as part of
+the overlay tree, but as objects in the store. So identical files
+travel only once, and only objects that the node is missing are sent.
+synctool-client finds the contents of a file through the manifest.
+'''
+
+import os
+import stat
+import hashlib
+
+try:
+    from typing import List, Dict, Tuple, Set
+    from synctool.object import SyncObject
+except ImportError:
+    pass
+
+import synctool.digest
+import synctool.index
+import synctool.lib
+from synctool.lib import verbose, error, warning, prettypath
+import synctool.overlay
+import synctool.param
+import synctool.pwdgrp
+import synctool.syncstat
+
+# size for doing I/O while copying files
+IO_SIZE = 16 * 1024
+
+# header line; bump the version when changing the file format
+MANIFEST_MAGIC = '# synctool manifest v1'
+
+# MANIFESTS[group] -> {relpath: array of fields}
+MANIFESTS = {}      # type: Dict[str, Dict[str, List[str]]]
+# DIRS[dirname] -> list of names that are in the manifest
+DIRS = {}           # type: Dict[str, List[str]]
+
+# characters that would make a path be taken as a pattern by rsync
+RSYNC_WILDCARDS = '*?[\\'
+
+
+def object_path(digest):
+    # type: (str) -> str
+    '''Returns full path of the object in the store'''
+
+    return os.path.join(synctool.param.STORE_DIR, digest[:2], digest)
+
+
+def manifest_filename(group):
+    # type: (str) -> str
+    '''Returns full path of the manifest file for a group'''
+
+    return os.path.join(synctool.param.MANIFEST_DIR, group)
+
+
+def _read_manifest(filename):
+    # type: (str) -> List[List[str]]
+    '''Returns list of entries (as arrays of fields) in manifest file,
+    or None if the manifest can not be read
+    '''
+
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        return None
+
+    entries = []
+    with f:
+        if f.readline().rstrip('\n') != MANIFEST_MAGIC:
+            verbose('discarding manifest %s: unknown format' % filename)
+            return None
+
+        for line in f:
+            arr = line.rstrip('\n').split('\t')
+            if len(arr) != 9:
+                verbose('discarding manifest %s: invalid line' % filename)
+                return None
+
+            entries.append(arr)
+
+    return entries
+
+
+def _copy_object(src, dest):
+    # type: (str, str) -> str
+    '''copy src to dest, while computing the digest of the data
+    Returns MD5 hex digest of the copy, or None on error
+    '''
+
+    try:
+        f1 = open(src, 'rb')
+    except IOError as err:
+        error('failed to open %s : %s' % (src, err.strerror))
+        return None
+
+    checksum = hashlib.md5()
+    with f1:
+        try:
+            f2 = open(dest, 'wb')
+        except IOError as err:
+            error('failed to create %s : %s' % (dest, err.strerror))
+            return None
+
+        with f2:
+            while True:
+                try:
+                    data = f1.read(IO_SIZE)
+                except IOError as err:
+                    error('failed to read file %s: %s' % (src, err.strerror))
+                    return None
+
+                if not data:
+                    break
+
+                checksum.update(data)
+                try:
+                    f2.write(data)
+                except IOError as err:
+                    error('failed to write file %s: %s' % (dest,
+                                                           err.strerror))
+                    return None
+
+    return checksum.hexdigest()
+
+
+def _add_object(src, digest, mtime):
+    # type: (str, str, int) -> bool
+    '''put a copy of src into the store (if not already there)
+    Returns False if the object could not be stored
+    '''
+
+    path = object_path(digest)
+    if synctool.lib.path_exists(path):
+        return True
+
+    if not synctool.lib.mkdir_p(os.path.dirname(path), 0755):
+        # error message already printed
+        return False
+
+    # Note: objects are copies rather than hard links, because
+    # a file that is edited in place would change the object, too
+    tmp_path = '%s.%d' % (path, os.getpid())
+    if _copy_object(src, tmp_path) != digest:
+        # file changed since it was indexed; leave it out for now
+        verbose('not storing %s: file changed' % prettypath(src))
+        _remove(tmp_path)
+        return False
+
+    # objects never change; give them a fixed timestamp
+    # so that rsync can see that the node already has it
+    try:
+        os.utime(tmp_path, (mtime, mtime))
+        os.rename(tmp_path, path)
+    except OSError as err:
+        error('failed to store object %s: %s' % (path, err.strerror))
+        _remove(tmp_path)
+        return False
+
+    return True
+
+
+def _remove(filename):
+    # type: (str) -> None
+    '''delete file'''
+
+    try:
+        os.unlink(filename)
+    except OSError:
+        # silently ignore unlink error
+        pass
+
+
+def _storable(arr):
+    # type: (List[str]) -> bool
+    '''Returns True if an index entry may go into the store'''
+
+    relpath, ftype, _, _, digest, ov_type, _, _ = arr
+
+    if ftype != 'f' or digest == '-':
+        return False
+
+    # scripts and templates are run from the overlay tree
+    if int(ov_type) not in (synctool.overlay.OV_REG,
+                            synctool.overlay.OV_NO_EXT):
+        return False
+
+    # the path is put into the rsync filter as is
+    for c in RSYNC_WILDCARDS:
+        if c in relpath:
+            return False
+
+    return True
+
+
+def _update_group(group, objects):
+    # type: (str, Set[str]) -> bool
+    '''(re)generate the manifest for a group dir in the overlay tree
+    and put its files into the store
+    The digests of the objects are added to the set objects
+    Returns False if there is no manifest for this group
+    '''
+
+    entries = synctool.index.read('overlay', group)
+    if entries is None:
+        # not indexed; the group dir is transferred as is
+        return False
+
+    group_dir = os.path.join(synctool.param.OVERLAY_DIR, group)
+    lines = []
+    for arr in entries:
+        if not _storable(arr):
+            continue
+
+        relpath, _, size, mtime, digest, _, _, _ = arr
+        src = os.path.join(group_dir, relpath)
+        try:
+            statbuf = os.lstat(src)
+        except OSError as err:
+            error('stat(%s) failed: %s' % (src, err.strerror))
+            continue
+
+        if (statbuf.st_size != int(size) or
+                int(statbuf.st_mtime) != int(mtime)):
+            # file changed since it was indexed; leave it out for now
+            continue
+
+        if not _add_object(src, digest, int(mtime)):
+            continue
+
+        objects.add(digest)
+        lines.append('\t'.join([relpath, digest, size, mtime,
+                                '%o' % (statbuf.st_mode & 07777),
+                                synctool.pwdgrp.pw_name(statbuf.st_uid),
+                                str(statbuf.st_uid),
+                                synctool.pwdgrp.grp_name(statbuf.st_gid),
+                                str(statbuf.st_gid)]))
+
+    filename = manifest_filename(group)
+    old_entries = _read_manifest(filename)
+    if (old_entries is not None and
+            ['\t'.join(arr) for arr in old_entries] == lines):
+        # unchanged
+        return True
+
+    verbose('updating manifest %s' % prettypath(filename))
+
+    # write to temp file and rename, so that the manifest is never corrupt
+    tmp_filename = '%s.%d' % (filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'w')
+    except IOError as err:
+        error('failed to write manifest %s: %s' % (tmp_filename,
+                                                   err.strerror))
+        return False
+
+    with f:
+        f.write(MANIFEST_MAGIC + '\n')
+        for line in lines:
+            f.write(line + '\n')
+
+    try:
+        os.rename(tmp_filename, filename)
+    except OSError as err:
+        error('failed to rename %s to %s: %s' % (tmp_filename, filename,
+                                                 err.strerror))
+        _remove(tmp_filename)
+        _remove(filename)
+        return False
+
+    return True
+
+
+def update():
+    # type: () -> None
+    '''(re)generate the manifests and the store
+    This is done on the master node, after updating the index
+    '''
+
+    for path in (synctool.param.STORE_DIR, synctool.param.MANIFEST_DIR):
+        if not synctool.lib.mkdir_p(path, 0755):
+            # error message already printed
+            return
+
+    valid = set()       # type: Set[str]
+    objects = set()     # type: Set[str]
+
+    for group in sorted(os.listdir(synctool.param.OVERLAY_DIR)):
+        if not os.path.isdir(os.path.join(synctool.param.OVERLAY_DIR,
+                                          group)):
+            continue
+
+        if _update_group(group, objects):
+            valid.add(group)
+
+    # remove manifests for groups that no longer exist
+    for entry in os.listdir(synctool.param.MANIFEST_DIR):
+        if entry not in valid:
+            verbose('removing manifest %s' % entry)
+            _remove(os.path.join(synctool.param.MANIFEST_DIR, entry))
+
+    # remove objects that are no longer in any manifest
+    for subdir in os.listdir(synctool.param.STORE_DIR):
+        path = os.path.join(synctool.param.STORE_DIR, subdir)
+        for entry in os.listdir(path):
+            if entry not in objects:
+                verbose('removing object %s' % entry)
+                _remove(os.path.join(path, entry))
+
+        try:
+            os.rmdir(path)
+        except OSError:
+            # not empty
+            pass
+
+
+def manifest(group):
+    # type: (str) -> Dict[str, List[str]]
+    '''Returns the manifest of a group: {relpath: array of fields}
+    The manifest is empty if the group has none
+    '''
+
+    if group in MANIFESTS:
+        return MANIFESTS[group]
+
+    entries = _read_manifest(manifest_filename(group))
+    if entries is None:
+        entries = []
+
+    group_dir = os.path.join(synctool.param.OVERLAY_DIR, group)
+    files = {}      # type: Dict[str, List[str]]
+    for arr in entries:
+        files[arr[0]] = arr
+
+        path = os.path.join(group_dir, arr[0])
+        DIRS.setdefault(os.path.dirname(path), []).append(
+            os.path.basename(path))
+
+    MANIFESTS[group] = files
+    return files
+
+
+def _split_path(path):
+    # type: (str) -> Tuple[str, str]
+    '''Returns (group, relpath) for path in the overlay tree,
+    or (None, None) if not under any group dir
+    '''
+
+    overlay = synctool.param.OVERLAY_DIR + os.sep
+    if path[:len(overlay)] != overlay:
+        return None, None
+
+    arr = path[len(overlay):].split(os.sep, 1)
+    if len(arr) != 2:
+        return None, None
+
+    return arr[0], arr[1]
+
+
+def listdir(path):
+    # type: (str) -> List[str]
+    '''Returns list of names in the manifest for directory path'''
+
+    if not synctool.param.DEDUP_TRANSFER:
+        return []
+
+    group, _ = _split_path(path + os.sep)
+    if group is None:
+        return []
+
+    manifest(group)
+    return DIRS.get(path, [])
+
+
+def resolve(obj):
+    # type: (SyncObject) -> None
+    '''if the source of obj was transferred as an object in the store,
+    then read its contents from the store and
+    take its attributes from the manifest
+    '''
+
+    if not synctool.param.DEDUP_TRANSFER:
+        return
+
+    group, relpath = _split_path(obj.src_path)
+    if group is None:
+        return
+
+    arr = manifest(group).get(relpath)
+    if arr is None:
+        return
+
+    _, digest, size, mtime, mode, user, uid, grp, gid = arr
+    data_path = object_path(digest)
+
+    src_stat = synctool.syncstat.SyncStat(data_path)
+    if not src_stat.exists():
+        warning('object for %s is missing from the store' % obj.print_src())
+        return
+
+    src_stat.mode = stat.S_IFREG | int(mode, 8)
+    # like rsync, map by name unless the name is unknown
+    try:
+        src_stat.uid = synctool.pwdgrp.pw_uid(user)
+    except KeyError:
+        src_stat.uid = int(uid)
+    try:
+        src_stat.gid = synctool.pwdgrp.grp_gid(grp)
+    except KeyError:
+        src_stat.gid = int(gid)
+    src_stat.size = int(size)
+    src_stat.atime = src_stat.mtime = int(mtime)
+
+    obj.src_stat = src_stat
+    obj.data_path = data_path
+
+    # no need to checksum the object; its name is the digest
+    synctool.digest.KNOWN[data_path] = (int(size), int(mtime), digest)
+
+# EOB
@@ -14,6 +14,12 @@ import os
 import stat
 import errno
 
+try:
+    from typing import Set
+except ImportError:
+    pass
+
+import synctool.lib
 from synctool.lib import error
 import synctool.pwdgrp
 
@@ -27,6 +33,11 @@ class SyncStat(object):
     # But then again, should take less than the posix.stat_result Pyobject
     # Also note how I left device files (major, minor) out, they are so rare
     # that they get special treatment in object.py
+    # Using __slots__ rather than a __dict__ per instance makes it about
+    # ten times smaller. Mind that there are two for every overlay entry
+
+    __slots__ = ('entry_exists', 'mode', 'uid', 'gid', 'size', 'atime',
+                 'mtime', 'ctime', 'ino')
 
     def __init__(self, path=None):
         # type: (str) -> None
@@ -35,6 +46,8 @@ class SyncStat(object):
         self.entry_exists = False
         self.mode = self.uid = self.gid = self.size = None  # type: int
         self.atime = self.mtime = None                      # type: int
+        self.ctime = None                                   # type: float
+        self.ino = None                                     # type: int
         self.stat(path)
 
     def __repr__(self):
@@ -55,6 +68,8 @@ class SyncStat(object):
             self.entry_exists = False
             self.mode = self.uid = self.gid = self.size = None
             self.atime = self.mtime = None
+            self.ctime = None
+            self.ino = None
             return
 
         try:
@@ -71,6 +86,8 @@ class SyncStat(object):
             self.entry_exists = False
             self.mode = self.uid = self.gid = self.size = None
             self.atime = self.mtime = None
+            self.ctime = None
+            self.ino = None
 
         else:
             self.entry_exists = True
@@ -82,6 +99,11 @@ class SyncStat(object):
             # trunc to an integer value
             self.atime = int(statbuf.st_atime)
             self.mtime = int(statbuf.st_mtime)
+            # the ctime is kept in full; it tells whether a file changed
+            # since synctool last looked at it (see synctool.state)
+            self.ctime = statbuf.st_ctime
+            # inode number is used for validating cached digests
+            self.ino = statbuf.st_ino
 
     def is_dir(self):
         # type: () -> bool
@@ -161,4 +183,64 @@ class SyncStat(object):
 
         return synctool.pwdgrp.grp_name(self.gid)
 
+
+class DirListing(object):
+    '''the names in a destination directory
+    Many entries in the repository may not exist on the node yet,
+    like when installing a new tree. Rather than a failing lstat() call
+    for each of them, the directory is listed once
+    '''
+
+    __slots__ = ('path', 'names', 'commands_run')
+
+    def __init__(self, path, exists=True):
+        # type: (str, bool) -> None
+        '''path is the directory
+        If exists is False, the directory is known to be missing
+        (or it was only just created) so it has no entries at all
+        '''
+
+        self.path = path
+        # names is None until there is reason to list the directory
+        self.names = None       # type: Set[str]
+        # a command (like a .pre script) may create entries
+        self.commands_run = synctool.lib.COMMANDS_RUN
+        if not exists:
+            self.names = set()
+
+    def stat(self, path):
+        # type: (str) -> SyncStat
+        '''Returns SyncStat for path, an entry in this directory'''
+
+        if (self.names is not None and
+                self.commands_run == synctool.lib.COMMANDS_RUN and
+                os.path.basename(path) not in self.names):
+            # it is not there
+            return SyncStat()
+
+        statbuf = SyncStat(path)
+        if not statbuf.exists() and self.names is None:
+            # the directory has missing entries; list it, so that
+            # any further missing entries do not need a stat() call
+            self._list()
+
+        return statbuf
+
+    def _list(self):
+        # type: () -> None
+        '''read the names in the directory'''
+
+        commands_run = synctool.lib.COMMANDS_RUN
+        try:
+            names = set(os.listdir(self.path))
+        except OSError as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                # keep doing stat() calls
+                return
+
+            names = set()
+
+        self.commands_run = commands_run
+        self.names = names
+
 # EOB
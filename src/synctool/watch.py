@@ -0,0 +1,235 @@
+#
+#   synctool.watch.py    WJ140
+#
+#   synctool Copyright 2015 Walter de Jong <walter@heiho.net>
+#
+#   synctool COMES WITH NO WARRANTY. synctool IS FREE SOFTWARE.
+#   synctool is distributed under terms described in the GNU General Public
+#   License.
+#
+
+'''watch destination directories with Linux inotify
+
+synctool-client --watch uses this to learn which destination paths
+changed, so that it can check and fix just those. The directories that
+hold the destination paths are watched, rather than the paths
+themselves, so that files that are removed, or replaced by renaming
+another file into place, are noticed as well.
+
+inotify is used through ctypes, as Python 2 has no wrappers.
+'''
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+
+try:
+    from typing import List, Dict, Set
+except ImportError:
+    pass
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+from synctool.lib import verbose, warning
+
+# inotify events, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_CLOEXEC = 02000000
+
+# the events that may mean that a destination is no longer in order
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# struct inotify_event: wd, mask, cookie, len; followed by the name
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+# seconds to wait for more events after the first one
+DEBOUNCE = 1.0
+# but do not wait longer than this
+DEBOUNCE_MAX = 10.0
+
+_INOTIFY_INIT1 = None
+_INOTIFY_ADD_WATCH = None
+_INOTIFY_RM_WATCH = None
+
+if ctypes is not None and sys.platform.startswith('linux'):
+    try:
+        _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        pass
+    else:
+        if hasattr(_LIBC, 'inotify_init1'):
+            _INOTIFY_INIT1 = _LIBC.inotify_init1
+            _INOTIFY_INIT1.restype = ctypes.c_int
+            _INOTIFY_INIT1.argtypes = [ctypes.c_int]
+
+            _INOTIFY_ADD_WATCH = _LIBC.inotify_add_watch
+            _INOTIFY_ADD_WATCH.restype = ctypes.c_int
+            _INOTIFY_ADD_WATCH.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+
+            _INOTIFY_RM_WATCH = _LIBC.inotify_rm_watch
+            _INOTIFY_RM_WATCH.restype = ctypes.c_int
+            _INOTIFY_RM_WATCH.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+class Overflow(Exception):
+    '''the kernel dropped events; anything may have changed'''
+    pass
+
+
+class Inotify(object):
+    '''watches on directories'''
+
+    def __init__(self):
+        # type: () -> None
+        '''initialize instance
+        It raises OSError if inotify can not be used
+        '''
+
+        if _INOTIFY_INIT1 is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = _INOTIFY_INIT1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        # the watched dirs, by watch descriptor and by path
+        self.paths = {}     # type: Dict[int, str]
+        self.wds = {}       # type: Dict[str, int]
+
+    def close(self):
+        # type: () -> None
+        '''stop watching'''
+
+        os.close(self.fd)
+        self.paths.clear()
+        self.wds.clear()
+
+    def watch(self, dirs):
+        # type: (Set[str]) -> None
+        '''watch exactly these directories
+        Directories that do not exist are not watched
+        '''
+
+        for path in set(self.wds.keys()) - dirs:
+            wd = self.wds.pop(path)
+            del self.paths[wd]
+            _INOTIFY_RM_WATCH(self.fd, wd)
+
+        for path in dirs:
+            if path in self.wds:
+                continue
+
+            wd = _INOTIFY_ADD_WATCH(self.fd, path, WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    warning('too many directories to watch; '
+                            'raise fs.inotify.max_user_watches')
+                    return
+
+                if err not in (errno.ENOENT, errno.ENOTDIR):
+                    warning('can not watch %s: %s' % (path,
+                                                      os.strerror(err)))
+                continue
+
+            self.wds[path] = wd
+            self.paths[wd] = path
+
+        verbose('watching %d directories' % len(self.wds))
+
+    def _read(self, timeout):
+        # type: (float) -> List[str]
+        '''wait at most timeout seconds for events
+        Returns list of paths that changed
+        It raises Overflow when events were lost
+        '''
+
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 65536)
+
+        changed = []    # type: List[str]
+        offset = 0
+        while offset + EVENT_SIZE <= len(data):
+            wd, mask, _, length = struct.unpack_from(EVENT_FORMAT, data,
+                                                     offset)
+            offset += EVENT_SIZE
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                raise Overflow()
+
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+
+            if mask & IN_IGNORED:
+                # the directory is gone; its parent has the event
+                del self.paths[wd]
+                del self.wds[path]
+                continue
+
+            if name:
+                changed.append(os.path.join(path, name))
+            else:
+                changed.append(path)
+
+        return changed
+
+    def wait(self, timeout):
+        # type: (float) -> Set[str]
+        '''wait at most timeout seconds for changes
+        After the first event, it waits until things have been quiet
+        for a moment, so that a burst of changes is handled at once
+        Returns set of paths that changed
+        It raises Overflow when events were lost
+        '''
+
+        changed = set(self._read(timeout))
+        if not changed:
+            return changed
+
+        t_max = time.time() + DEBOUNCE_MAX
+        while time.time() < t_max:
+            more = self._read(max(0.0, min(DEBOUNCE, t_max - time.time())))
+            if not more:
+                break
+
+            changed.update(more)
+
+        return changed
+
+# EOB